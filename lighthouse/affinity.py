@@ -0,0 +1,91 @@
+import os
+from typing import Dict, List
+
+from hardware import LogicalCpu, format_cpulist, logical_cpus, parse_cpulist
+
+# none keeps the inherited affinity, an explicit list is given as cpus:0-7,16-23
+STRATEGIES = ('none', 'compact', 'scatter', 'socket', 'physical')
+EXPLICIT = 'cpus:'
+
+
+def pinning_strategy(value: str) -> str:
+    """argparse type of --pinning."""
+    if value in STRATEGIES:
+        return value
+    if value.startswith(EXPLICIT):
+        parse_cpulist(value[len(EXPLICIT):])
+        return value
+    raise ValueError(f"Unknown pinning {value}, expected one of {STRATEGIES} or {EXPLICIT}<cpulist>.")
+
+
+def sibling_ranks(cpus: List[LogicalCpu]) -> Dict[int, int]:
+    """0 for the first hyper-thread of every physical core, 1 for the second, ..."""
+    ranks = {}
+    seen: Dict[tuple, int] = {}
+    for c in sorted(cpus, key=lambda c: c.cpu):
+        key = (c.package, c.core)
+        ranks[c.cpu] = seen.get(key, 0)
+        seen[key] = ranks[c.cpu] + 1
+    return ranks
+
+
+class CorePinner:
+    """
+    Pin the benchmark to a subset of the CPUs it was started on.
+
+    Strategies order the allowed CPUs and the first n_threads of them are kept:
+    - compact: as few NUMA nodes as possible, physical cores before their hyper-threads.
+    - scatter: alternate between NUMA nodes, physical cores before their hyper-threads.
+    - socket: the CPUs of the first socket only.
+    - physical: one hyper-thread per physical core.
+
+    llama.cpp starts its worker threads from the calling thread at every evaluation,
+    so they inherit the affinity set with os.sched_setaffinity on the main thread.
+    """
+    def __init__(self):
+        self.allowed = sorted(os.sched_getaffinity(0))
+        allowed = set(self.allowed)
+        self.cpus = [c for c in logical_cpus() if c.cpu in allowed]
+        if not self.cpus:
+            # no sysfs topology, every CPU is its own core on one node
+            self.cpus = [LogicalCpu(cpu=cpu, package=0, core=cpu, node=0) for cpu in self.allowed]
+        self.ranks = sibling_ranks(self.cpus)
+
+    def order(self, strategy: str) -> List[int]:
+        cpus = self.cpus
+        if strategy == 'socket':
+            first_package = min(c.package for c in cpus)
+            cpus = [c for c in cpus if c.package == first_package]
+        elif strategy == 'physical':
+            cpus = [c for c in cpus if self.ranks[c.cpu] == 0]
+
+        if strategy == 'scatter':
+            # position of every CPU among the CPUs of its node with the same sibling rank
+            position = {}
+            counts: Dict[tuple, int] = {}
+            for c in sorted(cpus, key=lambda c: (c.node, c.core, c.cpu)):
+                key = (c.node, self.ranks[c.cpu])
+                position[c.cpu] = counts.get(key, 0)
+                counts[key] = position[c.cpu] + 1
+            ordered = sorted(cpus, key=lambda c: (self.ranks[c.cpu], position[c.cpu], c.node))
+        else:
+            ordered = sorted(cpus, key=lambda c: (c.node, self.ranks[c.cpu], c.package, c.core, c.cpu))
+        return [c.cpu for c in ordered]
+
+    def select(self, strategy: str, n_threads: int) -> List[int]:
+        """CPUs of a strategy, more threads than CPUs oversubscribe them."""
+        if strategy == 'none':
+            return self.allowed
+        if strategy.startswith(EXPLICIT):
+            return parse_cpulist(strategy[len(EXPLICIT):])
+        return self.order(strategy)[:max(1, n_threads)]
+
+    def apply(self, strategy: str, n_threads: int) -> str:
+        """Pin the calling thread and the threads it starts, returns the resulting affinity as a cpulist."""
+        os.sched_setaffinity(0, self.select(strategy, n_threads))
+        return format_cpulist(os.sched_getaffinity(0))
+
+    def nodes(self, cpus: List[int]) -> int:
+        """Number of NUMA nodes a set of CPUs spans."""
+        node = {c.cpu: c.node for c in self.cpus}
+        return len({node.get(cpu, 0) for cpu in cpus})
@@ -0,0 +1,53 @@
+import importlib
+from dataclasses import dataclass
+from types import ModuleType
+from typing import Dict, Tuple
+
+# pip package of the modules whose name differs
+PACKAGES = {
+    'llama_cpp': 'llama-cpp-python',
+    'auto_gptq': 'auto-gptq',
+}
+
+
+@dataclass(frozen=True)
+class Backend:
+    """
+    A way of running a model and the packages it needs.
+
+    Nothing is imported until the backend is selected, so a GGUF run never pays
+    for torch or auto_gptq and a GPTQ run doesn't need llama_cpp installed.
+    """
+    name: str
+    quant_method: str                   # value of the "Quant. Method" column
+    requires: Tuple[str, ...]           # modules imported by load()
+    versioned: Tuple[str, ...] = ()     # modules whose version is part of the experiment identity
+
+    def load(self) -> Dict[str, ModuleType]:
+        """Import the dependencies of the backend, with an install hint for the missing ones."""
+        modules = {}
+        for name in self.requires:
+            try:
+                modules[name] = importlib.import_module(name)
+            except ImportError as e:
+                package = PACKAGES.get(name, name)
+                raise ImportError(f"The {self.name} backend needs {package}: pip install {package}") from e
+        return modules
+
+    def versions(self) -> Dict[str, str]:
+        """Identity columns such as llama_cpp_v, call after load()."""
+        return {f"{name}_v": importlib.import_module(name).__version__ for name in self.versioned}
+
+
+BACKENDS = {backend.name: backend for backend in [
+    Backend('gguf', 'gguf', ('llama_cpp',), ('llama_cpp',)),
+    Backend('gptq', 'gptq', ('torch', 'transformers', 'optimum', 'auto_gptq'), ('auto_gptq',)),
+    Backend('bitsandbytes', 'bitsandbytes', ('torch', 'transformers', 'bitsandbytes'), ('bitsandbytes',)),
+    Backend('fp16', 'noquant', ('torch', 'transformers'), ('transformers',)),
+]}
+
+
+def get_backend(name: str) -> Backend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, expected one of {list(BACKENDS)}.")
+    return BACKENDS[name]
@@ -1,33 +1,51 @@
-# TODO
-# offload based on the memory I want free
-# track memory peak/usage
-
 import gc
 import os
+import time
+import uuid
+import random
+import functools
 from utils import *
-import torch
 import psutil
 import argparse
 import datetime
-import llama_cpp
 import itertools
 
 import numpy as np
-import pandas as pd
 
 from tqdm import tqdm
 from datetime import datetime
-from typing import Dict
-from memory_tracker import MemoryTracker
-from llama_cpp import Llama, llama_get_timings, llama_free
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+from dataclasses import dataclass, field
+from affinity import CorePinner, pinning_strategy
+from backends import get_backend
+from bulb_store import BulbStore
+from energy import POWERCAP_ROOT, energy_domains, energy_tracker, phase_energy
+from executor import Job, run_parallel
+from hardware import hardware_profile, register_hardware
+from gguf_reader import GGUFFile, read_gguf
+from latency_stats import pooled_token_latencies
+from measurement import StoppingRule, measure
+from memory_tracker import FILE_BACKED, RSS, MemoryTracker, gpu_info
+from model_cache import LlamaSessionCache, LoadKey
+from offload_planner import kv_bytes_per_layer, layers_to_offload, plan_offload, predict, predictions
+from parallel_decode import benchmark_parallel_decode, required_context
+from perplexity import cached_tokens, evaluate_perplexity, gguf_scorer, gguf_tokenizer_hash
+from prompt_cache import CACHE_BACKENDS, benchmark_prompt_cache
+from roofline import HostCeilings, gguf_cost, host_ceilings, roofline_metrics
+from sample_store import SampleStore, Series, memory_series, replica_series, token_series
+from speculative import PROMPT_KINDS, benchmark_speculative_gguf, compare_to_baseline, gguf_lookup_missing, speculation_prompt
+from sweep_planner import ORDERS, CostModel, format_seconds, plan_sweep
+from tuner import successive_halving, thread_candidates
+from workload import REQUESTS_TABLE, common_prefix_length, parse_workload, replay, request_metrics
+
+# llama_cpp is imported by the gguf backend in main(), after the arguments are parsed
+if TYPE_CHECKING:
+    from llama_cpp import Llama
 
 np.random.seed(101)
 
 MODELS_DIR = os.path.join(os.path.expanduser("~"), 'models')
-#df = pd.read_csv('bulb.csv')
-
-RUN_NAME = random_noun_adjective()
-print(RUN_NAME)
 
 def parse_arguments():
     """Parse command line arguments."""
@@ -38,14 +56,49 @@ def parse_arguments():
     parser.add_argument('--model', action='store', type=str, help="Path of Model to benchmark.")
     parser.add_argument('--n-threads', action='store',  nargs='+', type=int, default=[10], help="Number of threads to use for generation.")
     parser.add_argument('--n-threads_batch', action='store',  nargs='+', type=int, default=[10], help="Number of threads to use during batch and prompt processing.")
+    parser.add_argument('--pinning', action='store', nargs='+', type=pinning_strategy, default=['none'], help="CPU pinning strategies to sweep: none, compact, scatter, socket, physical or cpus:<cpulist>.")
+    parser.add_argument('--numa', action='store_true', default=False, help="Enable the NUMA optimizations of llama.cpp (applied once per process, when the first model loads).")
     parser.add_argument('--n-batch', action='store',  nargs='+', type=int, default=[512], help="Prompt processing maximum batch size.")
     parser.add_argument('--ngl', action='store', nargs='+', type=float, default=[0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1], help="Percentage of layers to store in VRAM.")
-    parser.add_argument('--force', action='store_true', default=False, help="False the test even if the config already exists.")
+    parser.add_argument('--leave-vram', action='store', type=float, default=None, help="Offload as many layers as possible while leaving this much VRAM free (GB), replaces --ngl.")
+    parser.add_argument('--leave-ram', action='store', type=float, default=None, help="RAM to leave free (GB) when planning the offload.")
+    parser.add_argument('--force', action='store_true', default=False, help="Run the combinations already in the bulb again.")
     parser.add_argument("--prompt-length", nargs='+', type=int, default=[100], help="Length of the prompt.")
     parser.add_argument("--new-tokens", nargs='+', type=int, default=[100], help="Length of the generation.")
+    parser.add_argument("--workload", type=str, default=None, help="Replay a JSONL trace or a parametric workload (lognormal:n=1000,prompt=256,...) instead of --prompt-length/--new-tokens.")
+    parser.add_argument("--prompt-cache", nargs='+', choices=CACHE_BACKENDS, default=None, help="Measure the prefill saved by a cached prefix instead of generating: kept in the context, LlamaRAMCache or LlamaDiskCache.")
+    parser.add_argument("--prefix-length", nargs='+', type=int, default=[64, 256, 512], help="Tokens of --prompt-length shared with the cached prompt.")
+    parser.add_argument("--cache-capacity", type=float, default=2, help="Capacity of the RAM and disk prompt caches (GB).")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Directory of the disk prompt cache, the system temp directory by default.")
+    parser.add_argument("--draft-tokens", nargs='+', type=int, default=None, help="Benchmark prompt lookup decoding with these draft lengths against plain decoding (0, always included).")
+    parser.add_argument("--prompt-kind", nargs='+', choices=PROMPT_KINDS, default=list(PROMPT_KINDS), help="Prompts of --draft-tokens: repetitive code, repeated sentences or random tokens.")
+    parser.add_argument("--n-parallel", nargs='+', type=int, default=None, help="Decode this many sequences at once from one model (llama_batch with one sequence id per request).")
+    parser.add_argument("--ppl", type=str, default=None, help="Text file to measure the perplexity of the model on, written next to the speed of every configuration of the model.")
+    parser.add_argument("--ppl-ctx", type=int, default=512, help="Tokens per perplexity window.")
+    parser.add_argument("--ppl-stride", type=int, default=256, help="Tokens the perplexity windows move by, each one scores the tokens it adds.")
+    parser.add_argument("--ppl-rel-ci", type=float, default=0.01, help="Stop the perplexity once its 95%% CI half-width is below this fraction of it.")
+    parser.add_argument("--ppl-max-tokens", type=int, default=None, help="Score at most this many tokens of --ppl.")
     parser.add_argument("--ctx", type=int, default=1100, help="Context length.")
-    parser.add_argument("--replica", type=int, default=1, help="Number of repeated experiments.")
+    parser.add_argument("--replica", type=int, default=10, help="Maximum number of repeated experiments.")
+    parser.add_argument("--min-replica", type=int, default=3, help="Repetitions before the confidence interval is checked.")
+    parser.add_argument("--warmup", type=int, default=1, help="Cold runs discarded before the measured ones.")
+    parser.add_argument("--rel-ci", type=float, default=0.02, help="Repeat until the 95%% CI half-width of --ci-metric is below this fraction of its mean.")
+    parser.add_argument("--ci-metric", type=str, default="Decode Time (tk/s)", help="Metric whose confidence interval decides when to stop repeating.")
+    parser.add_argument("--no-mmap", action='store_true', default=False, help="Read the whole model in memory instead of memory-mapping it.")
+    parser.add_argument("--mlock", action='store_true', default=False, help="Lock the model weights in RAM.")
     parser.add_argument("--memo", type=str, default='', help="Description of the experiment.")
+    parser.add_argument("--mem-interval", type=float, default=10, help="Memory sampling interval in ms.")
+    parser.add_argument("--stream", action='store_true', default=False, help="Timestamp every generated token (TTFT, TPOT percentiles).")
+    parser.add_argument("--energy", action='store_true', default=False, help="Measure the energy of prefill and decode from the RAPL counters and NVML (joules, watts, tokens/J).")
+    parser.add_argument("--powercap-root", type=str, default=POWERCAP_ROOT, help="Sysfs directory of the RAPL powercap zones.")
+    parser.add_argument("--order", default='product', choices=ORDERS, help="Order of the combinations, grouped by loaded model: command line order, shortest first or least known first.")
+    parser.add_argument("--dry-run", action='store_true', default=False, help="Print the plan of the sweep and its predicted time without running it.")
+    parser.add_argument("--workers", type=int, default=1, help="Run up to this many CPU-only combinations at the same time, each in its own process on its own physical cores.")
+    parser.add_argument("--tune", action='store_true', default=False, help="Search the best threads/batch/offload configuration instead of running the full grid.")
+    parser.add_argument("--tune-objective", default='decode', choices=['decode', 'prefill'], help="Speed to maximise with --tune.")
+    parser.add_argument("--tune-trials", type=int, default=None, help="Maximum number of configurations measured by --tune.")
+    parser.add_argument("--tune-time", type=float, default=None, help="Wall-clock budget of --tune in seconds.")
+    parser.add_argument("--profile-startup", action='store_true', default=False, help="Report the time spent before the first experiment.")
     parser.add_argument("--debug", action='store_true', default=False, help="Reslts won't be stored.")
     parser.add_argument("--verbose", action='store_true', default=False, help="Verbose.")
     return parser.parse_args()
@@ -69,7 +122,8 @@ def parse_arguments():
 #     load_time = llama_get_timings(model._ctx.ctx).t_load_ms / 1000
 
 #     return model, load_time
-def get_timings(llm: Llama) -> Dict[str, float]:
+def get_timings(llm: 'Llama') -> Dict[str, float]:
+    from llama_cpp import llama_get_timings
     timings = llama_get_timings(llm._ctx.ctx)
 
     return {
@@ -84,168 +138,768 @@ def get_timings(llm: Llama) -> Dict[str, float]:
         "Latency (tk/s)": ((timings.n_p_eval + timings.n_eval) * 1000) / (timings.t_end_ms - timings.t_start_ms)
     }
 
-def benchmark_gguf(model: Llama,
+def run_completion(model: 'Llama',
+                   prompt: List[int],
+                   new_tokens: int,
+                   stream: bool) -> Tuple[str, int, List[int]]:
+    """Run one generation, with the perf_counter_ns() arrival time of every token when streaming."""
+    if not stream:
+        output = model(
+            prompt,
+            max_tokens=new_tokens,
+            logit_bias={model._token_eos: float('-inf')},
+            temperature=0.3,
+            seed=101
+            )
+        return output["id"], 0, []
+
+    # Llama.generate is the token loop stream=True is built on, it yields each token as soon as it
+    # is sampled while the completion stream holds back tokens that end in incomplete UTF-8
+    from llama_cpp import LogitsProcessorList
+
+    def suppress_eos(input_ids, scores):
+        scores[model._token_eos] = -np.inf
+        return scores
+
+    model._ctx.set_rng_seed(101)
+    token_ns = []
+    start_ns = time.perf_counter_ns()
+    if new_tokens < 1:
+        # generate() never ends on its own with EOS suppressed
+        return f"cmpl-{uuid.uuid4()}", start_ns, token_ns
+    for _ in model.generate(prompt, temp=0.3, logits_processor=LogitsProcessorList([suppress_eos])):
+        token_ns.append(time.perf_counter_ns())
+        if len(token_ns) >= new_tokens:
+            break
+    return f"cmpl-{uuid.uuid4()}", start_ns, token_ns
+
+def benchmark_gguf(model: 'Llama',
+                   n_vocab: int,
                    prompt_length: int,
                    new_tokens: int,
-                   replica: int,
-                   memory_tracker: MemoryTracker) -> Dict[str, int | str]:
+                   rule: StoppingRule,
+                   metric: str,
+                   memory_tracker: MemoryTracker,
+                   stream: bool = False,
+                   energy: MemoryTracker | None = None,
+                   gpu: bool = True) -> Tuple[Dict[str, int | str], List[Series]]:
+    from llama_cpp import llama_reset_timings
 
-    torch.cuda.empty_cache()
     gc.collect()
     
-    prompt = np.random.randint(1, model._model.n_vocab(), size=prompt_length).tolist()
-
-    timings = {
-        "Load Time (s)": [],
-        #"Sample Time (s)": [],
-        "Prefill Time (s)": [],
-        "Decode Time (s)": [],
-        "Latency (s)": [],
-        #"Sample Time (Tk/s)": [],
-        "Prefill Time (tk/s)": [],
-        "Decode Time (tk/s)": [],
-        "Latency (tk/s)": []
-    }
-
-    
-    for r in range(replica):
-        if r == 0:
-            with memory_tracker.track():
-                output = model(
-                    prompt,
-                    max_tokens=new_tokens,
-                    logit_bias={model._token_eos: float('-inf')},
-                    temperature=0.3,
-                    seed=101
-                    )
-                torch.cuda.synchronize()
-                memory_stats = torch.cuda.memory_stats()
-        else:
-            output = model(
-                prompt,
-                max_tokens=new_tokens,
-                logit_bias={model._token_eos: float('-inf')},
-                temperature=0.3,
-                seed=101
-                )
-        model_timings = get_timings(model)
-
-        for key in timings:
-            timings[key].append(model_timings[key])
+    prompt = np.random.randint(1, n_vocab, size=prompt_length).tolist()
+
+    token_times = []
+    completion_ids = []
+
+    def replica() -> Dict[str, float]:
+        # timings accumulate on a reused context unless they are reset
+        llama_reset_timings(model._ctx.ctx)
+        with ExitStack() as stack:
+            if not completion_ids:
+                # the cold run allocates the compute buffers, the peaks come from it
+                stack.enter_context(memory_tracker.track(gpu=gpu))
+            if energy is not None:
+                stack.enter_context(energy.track())
+            start = time.perf_counter()
+            completion_id, start_ns, token_ns = run_completion(model, prompt, new_tokens, stream)
+            end = time.perf_counter()
+        completion_ids.append(completion_id)
+        timings = get_timings(model)
+        if energy is not None:
+            # perf_counter_ns() and perf_counter() share their clock, without streaming the
+            # prefill ends when llama.cpp says it took
+            first_token = token_ns[0] / 1e9 if token_ns else start + timings["Prefill Time (s)"]
+            timings.update(phase_energy(energy, start, first_token, end, prompt_length, new_tokens - 1))
+
+        if stream:
+            token_times.append((start_ns, token_ns))
 
         # Manually reset the model state to repeat the operation
         model.reset()
+        # the load happened once, it is not a per-replica measurement
+        del timings["Load Time (s)"]
+        return timings
 
-    #     torch.cuda.synchronize()
-
-    # memory_stats = torch.cuda.memory_stats()
+    measurement = measure(replica, metric, rule)
+    # warmup runs are discarded
+    token_times = token_times[measurement.warmup:]
 
-    peak_allocated_torch_mb = memory_stats["allocated_bytes.all.peak"] * 1e-6
-    peak_reserved_torch_mb = memory_stats["reserved_bytes.all.peak"] * 1e-6
-    peak_nvml_mb = memory_tracker.peak_memory
-    peak_external_mb = peak_nvml_mb - peak_reserved_torch_mb
-    peak_memory_mb = peak_allocated_torch_mb + peak_external_mb
+    if memory_tracker.gpu_tracked:
+        # llama.cpp allocates outside of any torch allocator, the device-wide peak is its own
+        peak_memory_mb = memory_tracker.peak_memory
+    else:
+        # CPU-only host or no layer offloaded, the model lives in the process memory
+        peak_memory_mb = memory_tracker.peaks[RSS]
 
-    def average_timings(lst):
-        return round(sum(lst) / len(lst), 2)
-
-    averaged_timings = {key: average_timings(value) for key, value in timings.items()}
     run_time = datetime.now().strftime("%d-%m-%Y_%H:%M:%S")
 
-    return {
-        "id": output["id"],
+    diagnostics = {
+        "id": completion_ids[-1],
         "run_time": run_time,
-        **averaged_timings,
-        "Mem. Usage (GB)": f'{peak_memory_mb / 1000:.2f}'
+        "Load Time (s)": get_timings(model)["Load Time (s)"],
+        **measurement.summary(rule),
+        "Mem. Usage (GB)": round(peak_memory_mb / 1000, 2),
+        "RAM Usage (GB)": round(memory_tracker.peaks[RSS] / 1000, 2),
+        "Mapped Weights (GB)": round(memory_tracker.peaks.get(FILE_BACKED, 0) / 1000, 2),
     }
+    if stream:
+        diagnostics.update(pooled_token_latencies(token_times, prompt_length))
+    if energy is not None:
+        diagnostics["Energy Domains"] = energy_domains(energy)
+
+    series = replica_series(measurement.samples) + memory_series(memory_tracker.timeline)
+    series += [token_series(start_ns, token_ns, r) for r, (start_ns, token_ns) in enumerate(token_times)]
+    return diagnostics, series
+
+@dataclass
+class Sweep:
+    """Everything the experiments of one benchmark_gguf run share."""
+    args: argparse.Namespace
+    model_path: str
+    gguf: GGUFFile
+    identity: Dict[str, Any]
+    run_name: str
+    pinner: CorePinner
+    sessions: LlamaSessionCache
+    memory_tracker: MemoryTracker
+    ceilings: HostCeilings
+    energy: MemoryTracker | None = None   # --energy, None when no counter can be read
+    quality: Dict[str, Any] = field(default_factory=dict)   # --ppl, the same for every configuration
+
+def unknown_types(gguf: GGUFFile) -> str:
+    return ", ".join(sorted({t.type_name for t in gguf.tensors if t.n_bytes is None}))
+
+def mode_params(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Load and measurement modes that change the results, part of the Config Hash.
+
+    Only the ones that differ from the defaults are returned, so the hashes of the runs
+    measured before they were tracked stay valid.
+    """
+    modes = {}
+    if args.no_mmap:
+        modes["mmap"] = False
+    if args.mlock:
+        modes["mlock"] = True
+    if args.stream:
+        modes["Stream"] = True
+    return modes
+
+def load_session(sweep: Sweep, params: Dict[str, Any]) -> Tuple['Llama', Dict[str, Any]]:
+    """Load (or reuse) the model of one parameter combination, with the columns describing it."""
+    args = sweep.args
+    gguf = sweep.gguf
+    n_threads = params["Decode Threads"]
+    n_threads_batch = params["Prefill Threads"]
+    n_batch = params["Batch Size"]
+    ngl = params["GPU Layers"]
+    int_ngl = layers_to_offload(ngl, gguf.block_count) # convert to the number of layers to offload
+    footprint = predict(gguf, int_ngl, args.ctx, n_batch)
+    # the llama.cpp worker threads are started at every evaluation and inherit the pinning
+    pinning = params.get("Pinning", 'none')
+    affinity = sweep.pinner.apply(pinning, max(n_threads, n_threads_batch))
+
+    model = sweep.sessions.get(LoadKey(model_path=sweep.model_path,
+                                       n_gpu_layers=int_ngl,
+                                       n_batch=n_batch,
+                                       n_threads=n_threads,
+                                       n_threads_batch=n_threads_batch,
+                                       n_ctx=args.ctx,
+                                       use_mmap=not args.no_mmap,
+                                       use_mlock=args.mlock,
+                                       numa=args.numa,
+                                       logits_all=args.draft_tokens is not None))
+
+    header = {
+        # experiment configuration
+        "memo": args.memo,
+        "Run Name": sweep.run_name,
+        "Config Hash": params["Config Hash"],
+        "Params Hash": params["Params Hash"],
+        # software configuration, hardware configuration and model
+        **sweep.identity,
+        # model configuration
+        "Quant. Method": 'gguf',
+        "Model Size (GB)": round(gguf.file_size / 1024 / 1024 / 1024, 2),
+        "Bits Per Weight": round(gguf.bits_per_weight, 2) if gguf.sizes_known else None,
+        "Batch Size": n_batch,
+        "Context Length": args.ctx,
+        "Decode Threads": n_threads,
+        "Prefill Threads": n_threads_batch,
+        "Pinning": pinning,
+        "CPU Affinity": affinity,
+        "NUMA": args.numa,
+        "mmap": not args.no_mmap,
+        "mlock": args.mlock,
+        "Stream": args.stream,
+        "GPU Layers": ngl,
+        "Offloaded Layers": int_ngl,
+        "Predicted VRAM (GB)": round(footprint.vram_gb, 2) if footprint is not None else None,
+        "Predicted RAM (GB)": round(footprint.ram_gb, 2) if footprint is not None else None,
+        **sweep.quality,
+        }
+    return model, header
+
+def run_experiment(sweep: Sweep,
+                   params: Dict[str, Any],
+                   rule: StoppingRule | None = None) -> Tuple[Dict[str, Any], List[Series]]:
+    """Load (or reuse) the model for one parameter combination and benchmark it."""
+    args = sweep.args
+    if rule is None:
+        rule = StoppingRule(warmup=args.warmup,
+                            min_runs=min(args.min_replica, args.replica),
+                            max_runs=args.replica,
+                            rel_ci=args.rel_ci)
+    prompt_length = params["Prompt Length"]
+    new_tokens = params["New Tokens"]
+    model, header = load_session(sweep, params)
+
+    diagnostics, series = benchmark_gguf(model,
+                       sweep.gguf.n_vocab,
+                       prompt_length - 1,
+                       new_tokens,
+                       rule,
+                       args.ci_metric,
+                       sweep.memory_tracker,
+                       stream=args.stream,
+                       energy=sweep.energy,
+                       gpu=header["Offloaded Layers"] > 0)
+
+    experiment = {
+        **header,
+        "Prompt Length": prompt_length,
+        "New Tokens": new_tokens,
+        **diagnostics,
+        # every generated token reads the weights and the KV cache of the context so far
+        **roofline_metrics(gguf_cost(sweep.gguf, header["Offloaded Layers"]),
+                           sweep.ceilings,
+                           diagnostics["Prefill Time (tk/s)"],
+                           diagnostics["Decode Time (tk/s)"],
+                           context=prompt_length + new_tokens / 2),
+        }
+    return experiment, series
+
+def run_prompt_cache(sweep: Sweep, params: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Series]]:
+    """Measure the prefix cache of one parameter combination."""
+    args = sweep.args
+    rule = StoppingRule(warmup=args.warmup,
+                        min_runs=min(args.min_replica, args.replica),
+                        max_runs=args.replica,
+                        rel_ci=args.rel_ci)
+    model, header = load_session(sweep, params)
+    gc.collect()
+    diagnostics, series = benchmark_prompt_cache(model,
+                                                 sweep.gguf.n_vocab,
+                                                 params["Prompt Length"],
+                                                 params["Prefix Length"],
+                                                 params["Cache"],
+                                                 rule,
+                                                 capacity_bytes=int(args.cache_capacity * 1024 ** 3),
+                                                 cache_dir=args.cache_dir)
+    experiment = {
+        **header,
+        "id": f"prompt-cache-{uuid.uuid4()}",
+        "run_time": datetime.now().strftime("%d-%m-%Y_%H:%M:%S"),
+        "Mode": "prompt-cache",
+        "Cache": params["Cache"],
+        "Prompt Length": params["Prompt Length"],
+        "Prefix Length": params["Prefix Length"],
+        **diagnostics
+        }
+    return experiment, series
+
+def run_speculative(sweep: Sweep,
+                    params: Dict[str, Any],
+                    baselines: Dict[Tuple, Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Series]]:
+    """Decode the prompt of one combination with speculation, compared with the plain decoding measured before it."""
+    args = sweep.args
+    rule = StoppingRule(warmup=args.warmup,
+                        min_runs=min(args.min_replica, args.replica),
+                        max_runs=args.replica,
+                        rel_ci=args.rel_ci)
+    model, header = load_session(sweep, params)
+    prompt = speculation_prompt(params["Prompt Kind"],
+                                params["Prompt Length"],
+                                lambda text: model.tokenize(text.encode('utf-8'), add_bos=False),
+                                sweep.gguf.n_vocab)
+    gc.collect()
+    diagnostics, series = benchmark_speculative_gguf(model, prompt, params["New Tokens"], params["Draft Tokens"], rule)
+
+    # Draft Tokens is the inner-most parameter, the plain decoding (0) of a configuration runs first
+    key = tuple((k, v) for k, v in params.items() if k not in ("Draft Tokens", "Config Hash", "Params Hash"))
+    if params["Draft Tokens"] == 0:
+        baselines[key] = diagnostics
+    experiment = {
+        **header,
+        "id": f"speculative-{uuid.uuid4()}",
+        "run_time": datetime.now().strftime("%d-%m-%Y_%H:%M:%S"),
+        "Mode": "speculative",
+        "Speculation": "prompt-lookup" if params["Draft Tokens"] > 0 else "none",
+        "Prompt Kind": params["Prompt Kind"],
+        "Draft Tokens": params["Draft Tokens"],
+        "Prompt Length": params["Prompt Length"],
+        "New Tokens": params["New Tokens"],
+        **diagnostics,
+        **compare_to_baseline(diagnostics, baselines.get(key)),
+        }
+    return experiment, series
+
+def run_parallel_decode(sweep: Sweep, params: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Series]]:
+    """Decode the sequences of one combination concurrently."""
+    args = sweep.args
+    rule = StoppingRule(warmup=args.warmup,
+                        min_runs=min(args.min_replica, args.replica),
+                        max_runs=args.replica,
+                        rel_ci=args.rel_ci)
+    n_sequences = params["Num. Requests"]
+    model, header = load_session(sweep, params)
+    gc.collect()
+    diagnostics, series = benchmark_parallel_decode(model,
+                                                    sweep.gguf.n_vocab,
+                                                    n_sequences,
+                                                    params["Prompt Length"],
+                                                    params["New Tokens"],
+                                                    params["Batch Size"],
+                                                    rule,
+                                                    sweep.memory_tracker,
+                                                    gpu=header["Offloaded Layers"] > 0)
+    kv_tokens = required_context(n_sequences, params["Prompt Length"], params["New Tokens"])
+    experiment = {
+        **header,
+        "id": f"parallel-{uuid.uuid4()}",
+        "run_time": datetime.now().strftime("%d-%m-%Y_%H:%M:%S"),
+        "Mode": "parallel",
+        "Num. Requests": n_sequences,
+        "Prompt Length": params["Prompt Length"],
+        "New Tokens": params["New Tokens"],
+        # f16 cache of the cells the sequences fill
+        "KV Cache (GB)": round(kv_bytes_per_layer(sweep.gguf, kv_tokens) * sweep.gguf.block_count / 1024 ** 3, 3),
+        **diagnostics,
+        **roofline_metrics(gguf_cost(sweep.gguf, header["Offloaded Layers"]),
+                           sweep.ceilings,
+                           diagnostics["Prefill Time (tk/s)"],
+                           diagnostics["Decode Time (tk/s)"],
+                           context=params["Prompt Length"] + params["New Tokens"] / 2,
+                           n_sequences=n_sequences),
+        }
+    return experiment, series
+
+def replay_workload(sweep: Sweep, params: Dict[str, Any], store: BulbStore) -> Tuple[Dict[str, Any], List[Series]]:
+    """Serve the --workload requests one after the other on the model of one parameter combination."""
+    args = sweep.args
+    model, header = load_session(sweep, params)
+    experiment_id = f"workload-{uuid.uuid4()}"
+    rng = random.Random(101)
+
+    def serve(request) -> Dict[str, Any] | None:
+        prompt = request.prompt_tokens(sweep.gguf.n_vocab, rng)
+        new_tokens = min(request.new_tokens, args.ctx - len(prompt))
+        if new_tokens < 1:
+            return None
+        # the model is not reset between requests: Llama.generate keeps the longest prefix the prompt
+        # shares with the previous one in the KV cache and evaluates the rest only, like a prefix cache
+        reused = common_prefix_length(model._input_ids.tolist(), prompt[:-1])
+        _, start_ns, token_ns = run_completion(model, prompt, new_tokens, stream=True)
+        return {"id": experiment_id,
+                "Prompt Length": len(prompt),
+                "Prefix ID": request.prefix_id,
+                "Reused Prefix": reused,
+                **request_metrics(start_ns, token_ns)}
+
+    def flush(rows):
+        if not args.debug:
+            store.append_many(rows, table=REQUESTS_TABLE)
+
+    from llama_cpp import llama_reset_timings
+    gc.collect()
+    model.reset()
+    llama_reset_timings(model._ctx.ctx)
+    # a replay can last hours, sample memory coarser than a single generation
+    memory_tracker = sweep.memory_tracker
+    with memory_tracker.track(interval=max(memory_tracker.interval, 0.1), gpu=header["Offloaded Layers"] > 0):
+        summary = replay(parse_workload(args.workload), serve, flush)
+    model.reset()
+
+    experiment = {
+        **header,
+        "id": experiment_id,
+        "run_time": datetime.now().strftime("%d-%m-%Y_%H:%M:%S"),
+        "Mode": "workload",
+        "Workload": args.workload,
+        **summary,
+        # device-wide peak, the torch allocator is not involved in a llama.cpp replay
+        "Mem. Usage (GB)": round((memory_tracker.peak_memory if memory_tracker.gpu_tracked else memory_tracker.peaks[RSS]) / 1000, 2),
+        "RAM Usage (GB)": round(memory_tracker.peaks[RSS] / 1000, 2),
+        "Mapped Weights (GB)": round(memory_tracker.peaks.get(FILE_BACKED, 0) / 1000, 2),
+        }
+    return experiment, memory_series(memory_tracker.timeline)
+
+def commit_experiment(store: BulbStore,
+                      samples: SampleStore,
+                      experiment: Dict[str, Any],
+                      series: List[Series]):
+    """Append one experiment to the bulb and its raw samples to the sample store."""
+    samples.append(experiment["id"], series)
+    store.append(experiment)
+
+# state of a --workers process, kept between the jobs it runs so it can reuse its model
+_WORKER_SWEEP: Sweep | None = None
+
+def run_in_worker(args: argparse.Namespace,
+                  model_path: str,
+                  identity: Dict[str, Any],
+                  run_name: str,
+                  quality: Dict[str, Any],
+                  params: Dict[str, Any],
+                  cpus: List[int]) -> Tuple[Dict[str, Any], List[Series]]:
+    """Run one combination in an executor process, already pinned to `cpus`."""
+    global _WORKER_SWEEP
+    if _WORKER_SWEEP is None:
+        _WORKER_SWEEP = Sweep(args=args,
+                              model_path=model_path,
+                              gguf=read_gguf(model_path),
+                              identity=identity,
+                              run_name=run_name,
+                              pinner=CorePinner(),
+                              sessions=LlamaSessionCache(verbose=args.verbose),
+                              memory_tracker=MemoryTracker(interval=args.mem_interval / 1000),
+                              ceilings=host_ceilings(),
+                              quality=quality)
+    # pinning strategies apply within the cores of this job
+    _WORKER_SWEEP.pinner = CorePinner()
+    return run_experiment(_WORKER_SWEEP, params)
+
+def run_workers(sweep: Sweep,
+                pending: List[Dict[str, Any]],
+                store: BulbStore,
+                samples: SampleStore,
+                has_gpu: bool):
+    """Pack the combinations on disjoint cores, the ones sharing the GPU or placing threads themselves run alone."""
+    args = sweep.args
+    jobs = [Job(params=params,
+                n_cpus=max(params["Decode Threads"], params["Prefill Threads"]),
+                exclusive=(has_gpu and params["GPU Layers"] > 0) or params["Pinning"] not in ('none', 'compact', 'physical'))
+            for params in pending]
+    progress = tqdm(total=len(jobs), desc=f'Running experiments ({args.workers} workers)')
+
+    def on_result(job: Job, result):
+        experiment, series = result
+        # concurrent jobs share the memory bandwidth, keep track of it
+        experiment["Workers"] = 1 if job.exclusive else args.workers
+        if not args.debug:
+            commit_experiment(store, samples, experiment, series)
+        progress.update()
+
+    def on_error(job: Job, error: BaseException):
+        print(f"Failed: {job.params} ({error!r})")
+        progress.update()
+
+    worker = functools.partial(run_in_worker, args, sweep.model_path, sweep.identity, sweep.run_name, sweep.quality)
+    run_parallel(jobs, worker, on_result, max_workers=args.workers, on_error=on_error)
+    progress.close()
+
+def measure_perplexity(args: argparse.Namespace, model_path: str, gguf: GGUFFile) -> Dict[str, Any]:
+    """Perplexity of the model on --ppl, with a model of its own loaded with logits_all."""
+    sessions = LlamaSessionCache(verbose=args.verbose)
+    model = sessions.get(LoadKey(model_path=model_path,
+                                 n_gpu_layers=layers_to_offload(max(args.ngl), gguf.block_count),
+                                 n_batch=max(args.n_batch),
+                                 n_threads=max(args.n_threads),
+                                 n_threads_batch=max(args.n_threads_batch),
+                                 n_ctx=args.ppl_ctx,
+                                 use_mmap=not args.no_mmap,
+                                 logits_all=True))
+    try:
+        tokens = cached_tokens(args.ppl, gguf_tokenizer_hash(gguf),
+                               lambda text: model.tokenize(text.encode('utf-8'), add_bos=False))
+        quality = evaluate_perplexity(tokens, gguf_scorer(model), args.ppl_ctx, args.ppl_stride,
+                                      bos=model.token_bos(), rel_ci=args.ppl_rel_ci, max_tokens=args.ppl_max_tokens)
+    finally:
+        sessions.clear()
+    return {"PPL Dataset": os.path.basename(args.ppl), **quality}
+
+def tune(sweep: Sweep, store: BulbStore, samples: SampleStore):
+    """Search threads, batch size and offload with successive halving instead of the full grid."""
+    args = sweep.args
+    gguf = sweep.gguf
+    objective = "Decode Time (tk/s)" if args.tune_objective == 'decode' else "Prefill Time (tk/s)"
+    physical_cores = psutil.cpu_count(logical=False) or len(psutil.Process().cpu_affinity())
+
+    # only the thread pool used by the objective matters, the other one follows it
+    threads = thread_candidates(physical_cores, args.n_threads if len(args.n_threads) > 1 else None)
+    if args.tune_objective == 'decode':
+        batches = args.n_batch[:1]
+    else:
+        batches = sorted(set(args.n_batch)) if len(args.n_batch) > 1 else [64, 128, 256, 512, 1024]
+
+    # more offloaded layers is faster as long as they fit, keep the deepest level that does
+    gpu = gpu_info()
+    if gpu is not None and not gguf.sizes_known:
+        # nothing to predict with, a level that runs out of memory scores NaN
+        ngls = [max(args.ngl)]
+    elif gpu is not None:
+        vram_free = gpu["free"]
+        fitting = [ngl for ngl in args.ngl
+                   if predict(gguf, layers_to_offload(ngl, gguf.block_count), args.ctx, max(batches)).vram_bytes <= vram_free]
+        ngls = [max(fitting)] if fitting else [0]
+    else:
+        ngls = [0]
+
+    candidates = [{"Decode Threads": t, "Prefill Threads": t, "Batch Size": b, "GPU Layers": ngl}
+                  for t, b, ngl in itertools.product(threads, batches, ngls)]
+
+    def evaluate(config: Dict[str, Any], rung: int, budget: int) -> float:
+        params = {**config,
+                  **mode_params(args),
+                  "Prompt Length": max(args.prompt_length),
+                  "New Tokens": max(args.new_tokens),
+                  "Context Length": args.ctx}
+        config = {**sweep.identity, **params}
+        params["Config Hash"] = config_fingerprint(config)
+        params["Params Hash"] = params_fingerprint(config)
+        try:
+            experiment, series = run_experiment(sweep, params, rule=StoppingRule.fixed(budget, warmup=args.warmup))
+        except Exception as e:
+            # e.g. out of memory at a deep offload, the configuration ranks last
+            print(f"rung {rung} x{budget}: {config} failed: {type(e).__name__}: {e}")
+            sweep.sessions.clear()
+            return float('nan')
+        experiment.update({"Tune Objective": objective, "Tune Rung": rung})
+        if not args.debug:
+            commit_experiment(store, samples, experiment, series)
+        print(f"rung {rung} x{budget}: {config} -> {experiment[objective]:.2f} {objective}")
+        return experiment[objective]
+
+    best, trials = successive_halving(candidates,
+                                      evaluate,
+                                      max_trials=args.tune_trials,
+                                      time_budget=args.tune_time)
+    scores = [t.score for t in trials if t.config is best and not np.isnan(t.score)]
+    if best is None or not scores:
+        print(f"No configuration was measured successfully in {len(trials)} trials, "
+              f"raise --tune-trials or --tune-time.")
+        return None
+    print(f"Best configuration after {len(trials)} trials: {best} ({scores[-1]:.2f} {objective})")
+    return best
 
 def main():
     args = parse_arguments()
-    columns = ['Device',
-               'CPU Count',
-               'Model',
-               'Prompt Length',
-               'New Tokens',
-               'llama_cpp_v',
-               'Context Length',
-               'Decode Threads',
-               'Prefill Threads',
-               'GPU Layers',
-               'auto_gptq_v',
-               'Num. Requests',
-               'Kernel']
-
-    bulb = initialize_bulb(columns) if not os.path.exists('bulb.csv') else pd.read_csv('bulb.csv')
+    profile = StepTimer()
+    with profile.step("run name"):
+        run_name = random_noun_adjective()
+    print(run_name)
+    with profile.step("import backend"):
+        backend = get_backend('gguf')
+        backend.load()
+    with profile.step("open bulb"):
+        store = BulbStore()
+        samples = SampleStore(store)
     model_path = os.path.join(MODELS_DIR, args.model)
-    memory_tracker = MemoryTracker()
+    # all pre-flight facts come from the GGUF header, the weights are never read here
+    with profile.step("read GGUF header"):
+        gguf = read_gguf(model_path)
+    if gguf.context_length is not None and args.ctx > gguf.context_length:
+        print(f"Warning: --ctx {args.ctx} exceeds the training context of the model ({gguf.context_length}).")
+    with profile.step("query hardware"):
+        memory_tracker = MemoryTracker(interval=args.mem_interval / 1000)
+        gpu = gpu_info()
+        # identity of the sweep, queried once instead of once per combination
+        identity = {
+            **hardware_identity(),
+            "Model": os.path.basename(model_path),
+            **backend.versions(),
+        }
+        register_hardware(store, hardware_profile())
 
-    if not torch.cuda.is_available():
+    if gpu is None:
         args.ngl = [0]
 
+    if (args.leave_vram is not None or args.leave_ram is not None) and not gguf.sizes_known:
+        print(f"The model has tensors of unknown ggml types ({unknown_types(gguf)}), their size is unknown: "
+              f"--leave-vram/--leave-ram cannot plan the offload, --ngl {args.ngl} is used instead.")
+    elif args.leave_vram is not None or args.leave_ram is not None:
+        vram_free_gb = gpu["free"] / 1024 / 1024 / 1024 if gpu is not None else 0
+        ram_free_gb = psutil.virtual_memory().available / 1024 / 1024 / 1024
+        # the largest batch has the largest compute buffer
+        plan = plan_offload(gguf, args.ctx, max(args.n_batch), vram_free_gb, ram_free_gb,
+                            leave_vram_gb=args.leave_vram or 0, leave_ram_gb=args.leave_ram or 0)
+        if plan is None:
+            # offloading takes weights out of RAM, the VRAM budget may be what stops it
+            levels = predictions(gguf, args.ctx, max(args.n_batch))
+            ram_budget_gb = ram_free_gb - (args.leave_ram or 0)
+            fits_ram = [p for p in levels if p.ram_gb <= ram_budget_gb]
+            if not fits_ram:
+                print(f"The model does not fit in RAM while leaving {args.leave_ram or 0} GB free.")
+            else:
+                print(f"The model only fits in RAM with at least {fits_ram[0].n_gpu_layers} layers on the GPU "
+                      f"({fits_ram[0].vram_gb:.2f} GB of VRAM), more than the {max(vram_free_gb - (args.leave_vram or 0), 0):.2f} GB "
+                      f"left after --leave-vram {args.leave_vram or 0}.")
+            return None
+        print(f"Offload plan: {plan.n_gpu_layers}/{gguf.block_count + 1} layers, "
+              f"predicted VRAM {plan.vram_gb:.2f} GB, RAM {plan.ram_gb:.2f} GB")
+        args.ngl = [plan.n_gpu_layers / (gguf.block_count + 1)]
+
+    if args.n_parallel is not None:
+        # the sequences share the KV cache of one context, sized for the largest combination so the model is loaded once
+        needed = required_context(max(args.n_parallel), max(args.prompt_length), max(args.new_tokens))
+        if args.ctx < needed:
+            print(f"--ctx raised from {args.ctx} to {needed} to hold {max(args.n_parallel)} sequences.")
+            args.ctx = needed
+
+    quality = {}
+    if args.ppl is not None and not args.dry_run:
+        with profile.step("measure perplexity"):
+            quality = measure_perplexity(args, model_path, gguf)
+        print(f"Perplexity {quality['Perplexity']:.3f} +/- {quality['Perplexity CI']:.3f} on {quality['PPL Tokens']} tokens")
+        if not args.debug:
+            # the rows already in the bulb get it too, perplexity does not depend on the speed parameters
+            n_rows = store.update(quality, where={"Model": identity["Model"], "Quant. Method": 'gguf'})
+            print(f"Perplexity written to {n_rows} experiments of {identity['Model']} (gguf).")
+
+    # sweep order keeps the load parameters outer-most, so consecutive
+    # combinations differing only in prompt length or new tokens share a model
     param_combinations = {
         "Decode Threads": args.n_threads,
         "Prefill Threads": args.n_threads_batch,
+        "Pinning": args.pinning,
+        "NUMA": [args.numa],
         "Batch Size": args.n_batch,
         "GPU Layers": args.ngl,
         "Prompt Length": args.prompt_length, 
         "New Tokens": args.new_tokens,
-        "Context Length": [args.ctx]
+        "Context Length": [args.ctx],
+        **{key: [value] for key, value in mode_params(args).items()},
     }
+    if args.workload is not None:
+        if args.tune:
+            print("--tune measures fixed prompt lengths, it cannot be combined with --workload.")
+            return None
+        # the workload sets the lengths of every request
+        del param_combinations["Prompt Length"], param_combinations["New Tokens"]
+        param_combinations["Workload"] = [args.workload]
+    if args.n_parallel is not None:
+        if args.tune or args.workload is not None or args.draft_tokens is not None or args.prompt_cache is not None:
+            print("--n-parallel cannot be combined with --tune, --workload, --draft-tokens or --prompt-cache.")
+            return None
+        param_combinations["Num. Requests"] = args.n_parallel
+    if args.draft_tokens is not None:
+        if args.tune or args.workload is not None or args.prompt_cache is not None:
+            print("--draft-tokens cannot be combined with --tune, --workload or --prompt-cache.")
+            return None
+        missing = gguf_lookup_missing() if any(args.draft_tokens) else None
+        if missing is not None:
+            print(missing)
+            return None
+        param_combinations["Prompt Kind"] = args.prompt_kind
+        param_combinations["Draft Tokens"] = sorted({0, *args.draft_tokens})
+    if args.prompt_cache is not None:
+        if args.tune or args.workload is not None:
+            print("--prompt-cache measures prefill only, it cannot be combined with --tune or --workload.")
+            return None
+        # the prefill is measured, nothing is generated
+        del param_combinations["New Tokens"]
+        param_combinations["Cache"] = args.prompt_cache
+        param_combinations["Prefix Length"] = args.prefix_length
+
+    with profile.step("check bulb"):
+        pending = check_experiment(store.fingerprints(), param_combinations, identity, force=args.force or args.tune)
+    if args.prompt_cache is not None:
+        pending = [params for params in pending if params["Prefix Length"] < params["Prompt Length"]]
+    if args.profile_startup:
+        print(profile.report())
+    if not pending:
+        return None
 
-    if check_experiment(bulb, param_combinations, model_path):
+    # combinations sharing a model run back to back, timed by the earlier runs of the model
+    cost_model = CostModel.from_store(store, identity["Model"], identity["Hardware ID"])
+    # most configurations converge after the minimum number of replicas
+    plan = plan_sweep(pending, cost_model, args.warmup + min(args.min_replica, args.replica), order=args.order)
+    if args.dry_run:
+        print(plan.report())
         return None
+    pending = plan.combinations
 
-    param_combinations = list(itertools.product(
-        args.n_threads,
-        args.n_threads_batch,
-        args.n_batch,
-        args.ngl,
-        args.prompt_length, 
-        args.new_tokens
-    ))
-
-    for params in tqdm(param_combinations, total=len(param_combinations), desc='Running experiments'):
-        n_threads, n_threads_batch, n_batch, ngl, prompt_length, new_tokens = params
-        int_ngl = int((int(Llama(model_path=model_path, verbose=False).metadata['llama.block_count'])+1)*ngl) # convert to the number of layers to offload
-
-        model = Llama(model_path=model_path, n_gpu_layers=int_ngl, n_batch=n_batch, n_threads=n_threads, n_threads_batch=n_threads_batch, n_ctx=args.ctx, verbose=False)
-
-        diagnostics = benchmark_gguf(model,
-                           prompt_length - 1,
-                           new_tokens,
-                           args.replica,
-                           memory_tracker)
-        
-        experiment = {
-            # experiment configuration
-            "memo": args.memo,
-            "Run Name": RUN_NAME,
-            # software configuration
-            "llama_cpp_v": llama_cpp.__version__,
-            # hardware configuration
-            "Device": torch.cuda.get_device_name(),
-            "VRAM (GB)": round(torch.cuda.get_device_properties('cuda').total_memory / 1024 / 1024 / 1024, 2),
-            "RAM (GB)": round(psutil.virtual_memory().total / 1024 / 1024 / 1024, 2),
-            "CPU Count": len(psutil.Process().cpu_affinity()),
-            # model configuration
-            "Quant. Method": 'gguf',
-            "Model": os.path.basename(model_path),
-            "Model Size (GB)": round(os.path.getsize(model_path) / 1024 / 1024 / 1024, 2),
-            "Batch Size": n_batch,
-            "Context Length": args.ctx,
-            "Decode Threads": n_threads,
-            "Prefill Threads": n_threads_batch,
-            "Prompt Length": prompt_length,
-            "New Tokens": new_tokens,
-            "GPU Layers": ngl,
-            **diagnostics
-            }
+    # measured once per host, the workers read them from the cache
+    with profile.step("measure roofline"):
+        ceilings = host_ceilings(hardware_profile(), gpu=gpu is not None and max(args.ngl) > 0)
+
+    energy = None
+    if args.energy:
+        if args.workers > 1:
+            # RAPL counts the whole socket, concurrent jobs would be charged for each other
+            print("--energy is ignored with --workers > 1.")
+        else:
+            energy = energy_tracker(args.powercap_root, interval=args.mem_interval / 1000)
+            if energy is None:
+                print(f"No readable energy counter (RAPL under {args.powercap_root} is root-only since Linux 5.10, "
+                      f"NVML needs a Volta or newer GPU), energy is not measured.")
+
+    sweep = Sweep(args=args,
+                  model_path=model_path,
+                  gguf=gguf,
+                  identity=identity,
+                  run_name=run_name,
+                  pinner=CorePinner(),
+                  sessions=LlamaSessionCache(verbose=args.verbose),
+                  memory_tracker=memory_tracker,
+                  ceilings=ceilings,
+                  energy=energy,
+                  quality=quality)
+
+    if args.tune:
+        tune(sweep, store, samples)
+        sweep.sessions.clear()
+        return None
+
+    plan.start()
+    if args.workload is not None:
+        for params in tqdm(pending, total=len(pending), desc='Replaying workload'):
+            experiment, series = replay_workload(sweep, params, store)
+            if not args.debug:
+                commit_experiment(store, samples, experiment, series)
+        sweep.sessions.clear()
+        return None
+
+    if args.n_parallel is not None:
+        for params in tqdm(pending, total=len(pending), desc='Decoding in parallel'):
+            experiment, series = run_parallel_decode(sweep, params)
+            if not args.debug:
+                commit_experiment(store, samples, experiment, series)
+        sweep.sessions.clear()
+        return None
+
+    if args.draft_tokens is not None:
+        baselines = {}
+        for params in tqdm(pending, total=len(pending), desc='Measuring speculative decoding'):
+            experiment, series = run_speculative(sweep, params, baselines)
+            if not args.debug:
+                commit_experiment(store, samples, experiment, series)
+        sweep.sessions.clear()
+        return None
+
+    if args.prompt_cache is not None:
+        for params in tqdm(pending, total=len(pending), desc='Measuring prompt cache'):
+            experiment, series = run_prompt_cache(sweep, params)
+            if not args.debug:
+                commit_experiment(store, samples, experiment, series)
+        sweep.sessions.clear()
+        return None
+
+    if args.workers > 1:
+        run_workers(sweep, pending, store, samples, has_gpu=gpu is not None)
+        return None
+
+    progress = tqdm(pending, total=len(pending), desc='Running experiments')
+    for i, params in enumerate(progress):
+        progress.set_postfix_str(f"ETA {format_seconds(plan.eta(i))}")
+        experiment, series = run_experiment(sweep, params)
 
+        # committed as soon as it is measured, a crash later in the sweep keeps it
         if not args.debug:
-            bulb = pd.concat([bulb, pd.DataFrame([experiment])], ignore_index=True)
+            commit_experiment(store, samples, experiment, series)
 
-    if not args.debug:
-        bulb.to_csv('bulb.csv', index=False)
+    sweep.sessions.clear()
 
 if __name__ == "__main__":
     print('Thinking...')
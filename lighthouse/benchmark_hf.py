@@ -1,19 +1,27 @@
 # Inspired from https://github.com/huggingface/optimum/blob/main/tests/benchmark/benchmark_gptq.py
 
 import argparse
-import itertools
 import gc
 import os
 import time
-import auto_gptq
+import uuid
+import random
 from utils import *
 
 import numpy as np
-import pandas as pd
 import torch
-from auto_gptq.utils import Perplexity
-from memory_tracker import MemoryTracker
+from backends import get_backend
+from bulb_store import BulbStore
+from energy import POWERCAP_ROOT, energy_between, energy_domains, energy_metrics, energy_tracker
+from hardware import hardware_profile, register_hardware
+from measurement import StoppingRule, measure
+from perplexity import cached_tokens, evaluate_perplexity, hf_scorer, hf_tokenizer_hash
+from roofline import hf_cost, host_ceilings, roofline_metrics
+from sample_store import SampleStore, memory_series, replica_series
+from speculative import DECODE_TPS, PROMPT_KINDS, compare_to_baseline, decode_metrics, hf_lookup_missing, speculation_prompt
+from memory_tracker import RSS, MemoryTracker
 from tqdm import tqdm
+from workload import REQUESTS_TABLE, parse_workload, replay, request_metrics
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
@@ -21,8 +29,7 @@ from transformers import (
     GenerationConfig,
     GPTQConfig,
 )
-
-from optimum.exporters import TasksManager
+from transformers.generation.streamers import BaseStreamer
 
 device = torch.device("cuda:0")
 
@@ -33,18 +40,34 @@ def parse_arguments():
         description='Generate inference stats for GPTQ quantized models.'
     )
     parser.add_argument("--model", type=str, help="Path of Model to benchmark.")
-    parser.add_argument("--replica", type=int, default=3, help="Number of repeated experiments.")
+    parser.add_argument("--replica", type=int, default=10, help="Maximum number of repeated experiments.")
+    parser.add_argument("--min-replica", type=int, default=3, help="Repetitions before the confidence interval is checked.")
+    parser.add_argument("--warmup", type=int, default=1, help="Cold runs discarded before the measured ones.")
+    parser.add_argument("--rel-ci", type=float, default=0.02, help="Repeat until the 95%% CI half-width of --ci-metric is below this fraction of its mean.")
+    parser.add_argument("--ci-metric", type=str, default="Decode Time (tk/s)", help="Metric whose confidence interval decides when to stop repeating.")
     parser.add_argument("--n-request", action='store',  nargs='+', type=int, default=[1], help="Prompt processing maximum batch size.")
     parser.add_argument("--task", type=str, default=None, help="Task")
     parser.add_argument("--prompt-length", nargs='+', type=int, default=[100], help="Length of the prompt (ratio fro te context window menus new_tokens).")
     parser.add_argument("--new-tokens", nargs='+', type=int, default=[100], help="Length of the generation.")
+    parser.add_argument("--workload", type=str, default=None, help="Replay a JSONL trace or a parametric workload (lognormal:n=1000,prompt=256,...) instead of --prompt-length/--new-tokens.")
+    parser.add_argument("--draft-tokens", nargs='+', type=int, default=None, help="Benchmark speculative decoding with these draft lengths against plain decoding (0, always included).")
+    parser.add_argument("--assistant-model", type=str, default=None, help="Draft with this smaller model instead of prompt lookup.")
+    parser.add_argument("--prompt-kind", nargs='+', choices=PROMPT_KINDS, default=list(PROMPT_KINDS), help="Prompts of --draft-tokens: repetitive code, repeated sentences or random tokens.")
     parser.add_argument("--gptq", action="store_true", help="Indicate that the model to benchmark is a GPTQ model.")
     parser.add_argument("--bitsandbytes", action="store_true", help="Indicate that the model uses bitsandbytes through transformers load_in_4bit=True.")
     #parser.add_argument("--exllama-version", type=int, default=0, help="Use Exllamav2 kernel. Set 1 in order to use exllama kernel")
-    #parser.add_argument("--ppl", action="store_true", help="Calculate the perplexity on wikitext2 dataset")
+    parser.add_argument("--ppl", type=str, default=None, help="Text file to measure the perplexity of the model on, written next to the speed of every configuration of the model.")
+    parser.add_argument("--ppl-ctx", type=int, default=512, help="Tokens per perplexity window.")
+    parser.add_argument("--ppl-stride", type=int, default=256, help="Tokens the perplexity windows move by, each one scores the tokens it adds.")
+    parser.add_argument("--ppl-rel-ci", type=float, default=0.01, help="Stop the perplexity once its 95%% CI half-width is below this fraction of it.")
+    parser.add_argument("--ppl-max-tokens", type=int, default=None, help="Score at most this many tokens of --ppl.")
     parser.add_argument('--kernel', action='store', default='exllamav2', choices=['exllamav2', 'exllama', 'autotogptq-cuda', 'autogptq-cuda-old'], type=str, help="Kernel.")
     parser.add_argument("--revision", default='main', help="Revision of the model to benchmark")
     parser.add_argument("--memo", type=str, default='', help="Description of the experiment.")
+    parser.add_argument('--force', action='store_true', default=False, help="Run the combinations already in the bulb again.")
+    parser.add_argument("--profile-startup", action='store_true', default=False, help="Report the time spent before the first experiment.")
+    parser.add_argument("--energy", action='store_true', default=False, help="Measure the energy of prefill and decode from NVML and the RAPL counters (joules, watts, tokens/J).")
+    parser.add_argument("--powercap-root", type=str, default=POWERCAP_ROOT, help="Sysfs directory of the RAPL powercap zones.")
     parser.add_argument("--debug", action='store_true', default=False, help="Reslts won't be stored.")
 
     return parser.parse_args()
@@ -89,13 +112,8 @@ def load_model(model: str,
 
         return model, load_time
 
-def warmup(
-    model,
-    input_ids: torch.Tensor,
-    masks: torch.Tensor,
-    new_tokens: int,
-    pad_token_id: int):
-
+def fixed_length_config(model, new_tokens: int, pad_token_id: int) -> GenerationConfig:
+    """Greedy generation of exactly new_tokens tokens."""
     gen_config = GenerationConfig(
         max_new_tokens=new_tokens,
         min_new_tokens=new_tokens,
@@ -106,6 +124,16 @@ def warmup(
         eos_token_id=None,  # This is required for min_new_tokens to actually have an effect.
     )
     model.generation_config.eos_token_id = None  # greedy_search falls back on this eos_token_id that we need to set to None as well for min_new_tokens to have an effect.
+    return gen_config
+
+def warmup(
+    model,
+    input_ids: torch.Tensor,
+    masks: torch.Tensor,
+    new_tokens: int,
+    pad_token_id: int):
+
+    gen_config = fixed_length_config(model, new_tokens, pad_token_id)
     model.generate(input_ids, attention_mask=masks, generation_config=gen_config)
 
     return gen_config
@@ -114,10 +142,12 @@ def benchmark_gptq(
     model,
     n_request: int,
     prompt_length: int,
-    replica: int,
+    rule: StoppingRule,
+    metric: str,
     new_tokens: int,
     pad_token_id: int,
     memory_tracker: MemoryTracker,
+    energy: MemoryTracker | None = None,
 ):
     torch.cuda.empty_cache()
     gc.collect()
@@ -125,109 +155,249 @@ def benchmark_gptq(
     input_ids = torch.randint(1, model.config.vocab_size - 1, size=(n_request, prompt_length)).to(device)
     masks = torch.ones(n_request, prompt_length, dtype=torch.int32).to(device)
 
-    diagnostics = {
-        "Prefill Time (s)": [],
-        "Latency (s)": [],
-        "Prefill Time (tk/s)": [],
-        "Latency (tk/s)": []
-    }
-
-    gen_config = warmup(
-        model,
-        input_ids,
-        masks,
-        1,
-        pad_token_id,
-    )
+    # measure() runs the --warmup generations, nothing is generated before it
+    prefill_config = fixed_length_config(model, 1, pad_token_id)
+    gen_config = fixed_length_config(model, new_tokens, pad_token_id)
 
     print("Measuring latency...")
     assert gen_config.min_new_tokens == gen_config.max_new_tokens
 
-    # Prefill
-    for r in range(replica):
+    def timed_generate(generation_config):
         start_event = torch.cuda.Event(enable_timing=True)
         end_event = torch.cuda.Event(enable_timing=True)
         torch.cuda.synchronize()
         start_event.record()
-        _ = model.generate(input_ids, attention_mask=masks, generation_config=gen_config)
+        _ = model.generate(input_ids, attention_mask=masks, generation_config=generation_config)
         end_event.record()
-
-        torch.cuda.synchronize()
-        latency_s = start_event.elapsed_time(end_event) / 1000
-        diagnostics["Prefill Time (s)"].append(latency_s)
-        diagnostics["Prefill Time (tk/s)"].append(latency_s / prompt_length)
-
-    # Tot
-    torch.cuda.empty_cache()
-    gc.collect()
-    gen_config = warmup(
-        model,
-        input_ids,
-        masks,
-        new_tokens,
-        pad_token_id,
-    )
-
-    for r in range(replica):
-        start_event = torch.cuda.Event(enable_timing=True)
-        end_event = torch.cuda.Event(enable_timing=True)
         torch.cuda.synchronize()
-        start_event.record()
-        if r == 0:
+        return start_event.elapsed_time(end_event) / 1000
+
+    def metered_generate(generation_config):
+        """Seconds of a generation and, with energy counters, the joules it took."""
+        if energy is None:
+            return timed_generate(generation_config), np.nan
+        with energy.track():
+            start = time.perf_counter()
+            seconds = timed_generate(generation_config)
+            end = time.perf_counter()
+        return seconds, energy_between(energy, start, end)
+
+    memory_stats = []
+
+    def replica():
+        # Prefill
+        prefill_s, prefill_j = metered_generate(prefill_config)
+        # Tot
+        if not memory_stats:
             with memory_tracker.track():
-                _ = model.generate(input_ids, attention_mask=masks, generation_config=gen_config)
-                end_event.record()
-                memory_stats = torch.cuda.memory_stats()
+                latency_s, latency_j = metered_generate(gen_config)
+                memory_stats.append(torch.cuda.memory_stats())
         else:
-            _ = model.generate(input_ids, attention_mask=masks, generation_config=gen_config)
-            end_event.record()
-
-        torch.cuda.synchronize()
-        latency_s = start_event.elapsed_time(end_event) / 1000
-        diagnostics["Latency (s)"].append(latency_s)
-        diagnostics["Latency (tk/s)"].append(latency_s / (prompt_length + new_tokens))
-
-    averaged_timings = {key: average_timings(value) for key, value in diagnostics.items()}
-    decode_time = averaged_timings["Latency (s)"] - averaged_timings["Prefill Time (s)"] # time needed to generate all tokens as the response to the prompt (excludes all pre-processing time, and it only measures the time since it starts outputting tokens).
-    per_token_decode_time = decode_time / new_tokens 
-    diagnostics["Decode Time (s)"] = decode_time
-    diagnostics["Decode Time (tk/s)"] = per_token_decode_time
+            latency_s, latency_j = metered_generate(gen_config)
+        # time needed to generate all tokens as the response to the prompt (excludes all pre-processing time, and it only measures the time since it starts outputting tokens).
+        decode_s = latency_s - prefill_s
+        metrics = {
+            "Prefill Time (s)": prefill_s,
+            "Decode Time (s)": decode_s,
+            "Latency (s)": latency_s,
+            "Prefill Time (tk/s)": n_request * prompt_length / prefill_s,
+            "Decode Time (tk/s)": n_request * new_tokens / decode_s,
+            "Latency (tk/s)": n_request * (prompt_length + new_tokens) / latency_s,
+        }
+        if energy is not None:
+            # like the times, the decode is the full generation minus the one token run
+            metrics.update(energy_metrics(prefill_j, prefill_s, latency_j - prefill_j, decode_s,
+                                          n_request * prompt_length, n_request * new_tokens))
+        return metrics
+
+    measurement = measure(replica, metric, rule)
+    diagnostics = {"id": f"hf-{uuid.uuid4()}", **measurement.summary(rule)}
+    if energy is not None:
+        diagnostics["Energy Domains"] = energy_domains(energy)
     #throughput = new_tokens * batch_size / averaged_timings["Latency (s)"]
 
-    peak_allocated_torch_mb = memory_stats["allocated_bytes.all.peak"] * 1e-6
-    peak_reserved_torch_mb = memory_stats["reserved_bytes.all.peak"] * 1e-6
+    peak_allocated_torch_mb = memory_stats[0]["allocated_bytes.all.peak"] * 1e-6
+    peak_reserved_torch_mb = memory_stats[0]["reserved_bytes.all.peak"] * 1e-6
     peak_nvml_mb = memory_tracker.peak_memory
     peak_external_mb = peak_nvml_mb - peak_reserved_torch_mb
     peak_memory_mb = peak_allocated_torch_mb + peak_external_mb
 
-    diagnostics["Mem. Usage (GB)"] = f'{peak_memory_mb / 1000:.2f}'
+    diagnostics["Mem. Usage (GB)"] = round(peak_memory_mb / 1000, 2)
+    diagnostics["RAM Usage (GB)"] = round(memory_tracker.peaks[RSS] / 1000, 2)
+
+    return diagnostics, replica_series(measurement.samples) + memory_series(memory_tracker.timeline)
+
+class TokenTimer(BaseStreamer):
+    """Streamer recording when generate() hands over each new token, the first put() is the prompt."""
+    def __init__(self):
+        self.prompt_seen = False
+        self.token_ns = []
+
+    def put(self, value):
+        # generate() moves the token to the CPU before put(), the timestamp follows the kernel
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        self.token_ns.append(time.perf_counter_ns())
+
+    def end(self):
+        pass
+
+def replay_workload(
+    model,
+    workload: str,
+    pad_token_id: int,
+    memory_tracker: MemoryTracker,
+    flush,
+):
+    """Serve the requests of a workload one at a time, transformers keeps no KV cache across requests."""
+    torch.cuda.empty_cache()
+    gc.collect()
+
+    experiment_id = f"workload-{uuid.uuid4()}"
+    rng = random.Random(101)
+    max_length = getattr(model.config, "max_position_embeddings", None)
+
+    input_ids = torch.randint(1, model.config.vocab_size - 1, size=(1, 8)).to(device)
+    warmup(model, input_ids, torch.ones_like(input_ids), 1, pad_token_id)
+
+    def serve(request):
+        prompt = request.prompt_tokens(model.config.vocab_size - 1, rng)
+        new_tokens = request.new_tokens if max_length is None else min(request.new_tokens, max_length - len(prompt))
+        if new_tokens < 1:
+            return None
+        input_ids = torch.tensor([prompt], device=device)
+        gen_config = GenerationConfig(
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            use_cache=True,
+            pad_token_id=pad_token_id,
+            num_beams=1,
+            do_sample=False,
+            eos_token_id=None,
+        )
+        timer = TokenTimer()
+        torch.cuda.synchronize()
+        start_ns = time.perf_counter_ns()
+        model.generate(input_ids, attention_mask=torch.ones_like(input_ids), generation_config=gen_config, streamer=timer)
+        return {"id": experiment_id,
+                "Prompt Length": len(prompt),
+                "Prefix ID": request.prefix_id,
+                **request_metrics(start_ns, timer.token_ns)}
+
+    # a replay can last hours, sample memory coarser than a single generation
+    with memory_tracker.track(interval=0.1):
+        diagnostics = replay(parse_workload(workload), serve, flush)
+        memory_stats = torch.cuda.memory_stats()
+
+    peak_reserved_torch_mb = memory_stats["reserved_bytes.all.peak"] * 1e-6
+    peak_memory_mb = memory_stats["allocated_bytes.all.peak"] * 1e-6 + memory_tracker.peak_memory - peak_reserved_torch_mb
+
+    diagnostics["id"] = experiment_id
+    diagnostics["Mode"] = "workload"
+    diagnostics["Workload"] = workload
+    diagnostics["Mem. Usage (GB)"] = round(peak_memory_mb / 1000, 2)
+    diagnostics["RAM Usage (GB)"] = round(memory_tracker.peaks[RSS] / 1000, 2)
 
     return diagnostics
 
-def average_timings(lst):
-        return round(sum(lst) / len(lst), 2)
+class ForwardCounter:
+    """Count the forward passes of a model during generate()."""
+    def __init__(self, model):
+        self.calls = 0
+        self.handle = model.register_forward_hook(self.hook)
+
+    def hook(self, module, inputs, outputs):
+        self.calls += 1
+
+    def remove(self):
+        self.handle.remove()
+
+def benchmark_speculative(
+    model,
+    assistant_model,
+    prompt: list,
+    new_tokens: int,
+    draft_tokens: int,
+    pad_token_id: int,
+    rule: StoppingRule,
+):
+    """
+    Greedy decoding with assisted generation, drafting `draft_tokens` tokens per step, plain decoding when 0.
+
+    Drafts come from the assistant model when there is one, from prompt lookup otherwise.
+    Every forward pass of the model after the prompt verifies one draft and yields the
+    accepted tokens plus one, so the accepted tokens are the new tokens minus the forward passes.
+    An assistant proposes one token per forward pass, prompt lookup does not say how many
+    it proposed and its acceptance rate is left empty.
+    """
+    torch.cuda.empty_cache()
+    gc.collect()
 
+    input_ids = torch.tensor([prompt], device=device)
+    speculation = {}
+    if draft_tokens > 0 and assistant_model is not None:
+        assistant_model.generation_config.num_assistant_tokens = draft_tokens
+        assistant_model.generation_config.num_assistant_tokens_schedule = "constant"
+        speculation = {"assistant_model": assistant_model}
+    elif draft_tokens > 0:
+        missing = hf_lookup_missing()
+        if missing is not None:
+            raise ImportError(missing)
+        speculation = {"prompt_lookup_num_tokens": draft_tokens}
+    gen_config = GenerationConfig(
+        max_new_tokens=new_tokens,
+        min_new_tokens=new_tokens,
+        use_cache=True,
+        pad_token_id=pad_token_id,
+        num_beams=1,
+        do_sample=False,
+        eos_token_id=None,
+        prompt_lookup_num_tokens=speculation.get("prompt_lookup_num_tokens"),
+    )
+    model.generation_config.eos_token_id = None
+
+    def replica():
+        counters = [ForwardCounter(model)] + ([ForwardCounter(assistant_model)] if "assistant_model" in speculation else [])
+        timer = TokenTimer()
+        try:
+            torch.cuda.synchronize()
+            start_ns = time.perf_counter_ns()
+            model.generate(input_ids,
+                           attention_mask=torch.ones_like(input_ids),
+                           generation_config=gen_config,
+                           assistant_model=speculation.get("assistant_model"),
+                           streamer=timer)
+            torch.cuda.synchronize()
+        finally:
+            for counter in counters:
+                counter.remove()
+        metrics = decode_metrics(start_ns, timer.token_ns, new_tokens)
+        if speculation:
+            accepted = new_tokens - counters[0].calls
+            proposed = counters[1].calls if len(counters) > 1 else np.nan
+            metrics.update({
+                "Forward Passes": counters[0].calls,
+                "Tokens per Step": new_tokens / counters[0].calls,
+                "Accepted Tokens": accepted,
+                "Proposed Tokens": proposed,
+                "Acceptance Rate": accepted / proposed if proposed else np.nan,
+            })
+        return metrics
+
+    measurement = measure(replica, DECODE_TPS, rule)
+    return measurement.summary(rule), replica_series(measurement.samples)
 
 def main():
     args = parse_arguments()
+    profile = StepTimer()
 
-    run_name = random_noun_adjective()
-    
-    columns = ['Device',
-               'CPU Count',
-               'Model',
-               'Prompt Length',
-               'New Tokens',
-               'llama_cpp_v',
-               'Context Length',
-               'Decode Threads',
-               'Prefill Threads',
-               'GPU Layers',
-               'auto_gptq_v',
-               'Num. Requests',
-               'Kernel']
-
-    bulb = initialize_bulb(columns) if not os.path.exists('bulb.csv') else pd.read_csv('bulb.csv')
+    with profile.step("run name"):
+        run_name = random_noun_adjective()
+
+    with profile.step("open bulb"):
+        store = BulbStore()
+        samples = SampleStore(store)
     model_path = args.model
 
     if not torch.cuda.is_available():
@@ -238,9 +408,70 @@ def main():
         )
 
     memory_tracker = MemoryTracker()
-    
+    energy = energy_tracker(args.powercap_root) if args.energy else None
+    if args.energy and energy is None:
+        print(f"No readable energy counter (NVML needs a Volta or newer GPU, RAPL under {args.powercap_root} "
+              f"is root-only since Linux 5.10), energy is not measured.")
+
+    uses_gptq = args.gptq
+    uses_bitsandbytes = args.bitsandbytes
+
+    if uses_gptq:
+        backend = get_backend('gptq')
+    elif uses_bitsandbytes:
+        backend = get_backend('bitsandbytes')
+    else:
+        backend = get_backend('fp16')
+
+    # only the packages of the selected backend are imported
+    with profile.step("import backend"):
+        backend.load()
+
+    # identity of the sweep, queried once instead of once per combination
+    with profile.step("query hardware"):
+        identity = {
+            **hardware_identity(),
+            "Model": os.path.basename(model_path)+'-'+args.revision,
+            "Quant. Method": backend.quant_method,
+            **backend.versions(),
+        }
+        register_hardware(store, hardware_profile())
+
+    param_combinations = {
+        "Num. Requests": args.n_request,
+        "Prompt Length": args.prompt_length,
+        "New Tokens": args.new_tokens,
+        "Kernel": [args.kernel]
+    }
+    if args.draft_tokens is not None:
+        missing = hf_lookup_missing() if args.assistant_model is None and any(args.draft_tokens) else None
+        if missing is not None:
+            print(missing)
+            return None
+        # assisted generation decodes one request at a time, Draft Tokens is inner-most so 0 runs first
+        param_combinations = {
+            "Prompt Kind": args.prompt_kind,
+            "Prompt Length": args.prompt_length,
+            "New Tokens": args.new_tokens,
+            "Kernel": [args.kernel],
+            "Assistant Model": [args.assistant_model],
+            "Draft Tokens": sorted({0, *args.draft_tokens}),
+        }
+    if args.workload is not None:
+        # the workload sets the lengths of every request, which are served one at a time
+        param_combinations = {"Workload": [args.workload], "Kernel": [args.kernel]}
+
+    # checked before loading the model, nothing is loaded when the whole sweep is in the bulb
+    with profile.step("check bulb"):
+        pending = check_experiment(store.fingerprints(), param_combinations, identity, force=args.force)
+    if not pending:
+        if args.profile_startup:
+            print(profile.report())
+        return None
+
     #tokenizer = AutoTokenizer.from_pretrained(args.model, revision=args.revision, use_fast=False, trust_remote_code=True)
-    tokenizer = AutoTokenizer.from_pretrained(args.model, revision=args.revision, use_fast=True, trust_remote_code=True)
+    with profile.step("load tokenizer"):
+        tokenizer = AutoTokenizer.from_pretrained(args.model, revision=args.revision, use_fast=True, trust_remote_code=True)
 
     if not hasattr(tokenizer, "pad_token") or tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
@@ -253,108 +484,163 @@ def main():
         exllama_version = 1
         use_exllama = True
 
-    model, load_time = load_model(args.model,
-                                  args.gptq,
-                                  args.bitsandbytes,
-                                  args.revision,
-                                  use_exllama,
-                                  exllama_version)
-
-    uses_gptq = args.gptq
-    uses_bitsandbytes = args.bitsandbytes
+    with profile.step("load model"):
+        model, load_time = load_model(args.model,
+                                      args.gptq,
+                                      args.bitsandbytes,
+                                      args.revision,
+                                      use_exllama,
+                                      exllama_version)
 
     model = model.eval()
-
-    if uses_gptq:
-        quantization = 'gptq'
-    elif uses_bitsandbytes:
-        quantization = 'bitsandbytes'
-    else:
-        quantization = 'noquant'
-
-    # if args.ppl:
-    #     output_file = open(file_name + "_perplexity.csv", "w")
-    #     header = "quantization, act_order, bits, group_size, kernel, perplexity\n"
-    #     output_file.write(header)
-    #     ppl = Perplexity(model, tokenizer)
-    #     ppl_value = np.mean(ppl.calculate_perplexity())
-    #     line = "{},{},{},{},{},{}\n".format(
-    #         quantization,
-    #         act_order,
-    #         bits,
-    #         group_size,
-    #         kernel,
-    #         f"{ppl_value:.2f}",
-    #     )
-    #     print(header)
-    #     print(line)
-    #     output_file.write(line)
-    #     output_file.close()
+    if args.profile_startup:
+        print(profile.report())
+
+    quality = {}
+    if args.ppl is not None:
+        with profile.step("measure perplexity"):
+            tokens = cached_tokens(args.ppl, hf_tokenizer_hash(tokenizer),
+                                   lambda text: tokenizer(text, add_special_tokens=False)["input_ids"])
+            quality = {"PPL Dataset": os.path.basename(args.ppl),
+                       **evaluate_perplexity(tokens, hf_scorer(model), args.ppl_ctx, args.ppl_stride,
+                                             bos=tokenizer.bos_token_id, rel_ci=args.ppl_rel_ci,
+                                             max_tokens=args.ppl_max_tokens)}
+        print(f"Perplexity {quality['Perplexity']:.3f} +/- {quality['Perplexity CI']:.3f} on {quality['PPL Tokens']} tokens")
+        if not args.debug:
+            # the rows already in the bulb get it too, perplexity does not depend on the speed parameters
+            n_rows = store.update(quality, where={"Model": identity["Model"],
+                                                   "Quant. Method": identity["Quant. Method"]})
+            print(f"Perplexity written to {n_rows} experiments of {identity['Model']} ({identity['Quant. Method']}).")
 
 
-    param_combinations = {
-        "Num. Requests": args.n_request,
-        "Prompt Length": args.prompt_length,
-        "New Tokens": args.new_tokens,
-        "Kernel": [args.kernel]
-    }
-
-    if check_experiment(bulb, param_combinations, '-'.join([model_path, args.revision])):
+    if args.draft_tokens is not None:
+        assistant_model = None
+        if args.assistant_model is not None:
+            with device:
+                assistant_model = AutoModelForCausalLM.from_pretrained(args.assistant_model, torch_dtype=torch.float16,
+                                                                       trust_remote_code=True).eval()
+        rule = StoppingRule(warmup=args.warmup, min_runs=min(args.min_replica, args.replica),
+                            max_runs=args.replica, rel_ci=args.rel_ci)
+        baselines = {}
+        for params in tqdm(pending, total=len(pending), desc='Measuring speculative decoding'):
+            prompt = speculation_prompt(params["Prompt Kind"],
+                                        params["Prompt Length"],
+                                        lambda text: tokenizer(text, add_special_tokens=False).input_ids,
+                                        model.config.vocab_size - 1)
+            with torch.no_grad():
+                diagnostics, series = benchmark_speculative(model,
+                                                            assistant_model,
+                                                            prompt,
+                                                            params["New Tokens"],
+                                                            params["Draft Tokens"],
+                                                            tokenizer.pad_token_id,
+                                                            rule)
+            key = tuple((k, v) for k, v in params.items() if k not in ("Draft Tokens", "Config Hash", "Params Hash"))
+            if params["Draft Tokens"] == 0:
+                baselines[key] = diagnostics
+                speculation = "none"
+            else:
+                speculation = "assistant" if assistant_model is not None else "prompt-lookup"
+            experiment = {
+                "memo": args.memo,
+                "Run Name": run_name,
+                "Config Hash": params["Config Hash"],
+                **identity,
+                **quality,
+                "id": f"speculative-{uuid.uuid4()}",
+                "Mode": "speculative",
+                "Speculation": speculation,
+                **params,
+                "Num. Requests": 1,
+                **diagnostics,
+                **compare_to_baseline(diagnostics, baselines.get(key)),
+                }
+            if not args.debug:
+                samples.append(experiment["id"], series)
+                store.append(experiment)
         return None
 
-    param_combinations = list(itertools.product(
-        args.n_request,
-        args.prompt_length,
-        args.new_tokens,
-        [args.kernel]
-    ))
+    if args.workload is not None:
+        def flush(rows):
+            if not args.debug:
+                store.append_many(rows, table=REQUESTS_TABLE)
+
+        for params in pending:
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
+            with torch.no_grad():
+                diagnostics = replay_workload(model, args.workload, tokenizer.pad_token_id, memory_tracker, flush)
+            experiment = {
+                "memo": args.memo,
+                "Run Name": run_name,
+                "Config Hash": params["Config Hash"],
+                "Params Hash": params["Params Hash"],
+                **identity,
+                **quality,
+                "Kernel": params["Kernel"],
+                **diagnostics
+                }
+            if not args.debug:
+                store.append(experiment)
+        return None
 
-    for params in tqdm(param_combinations, total=len(param_combinations), desc='Running experiments'):
-        n_request, prompt_length, new_tokens, kernel = params
+    rule = StoppingRule(warmup=args.warmup, min_runs=min(args.min_replica, args.replica),
+                        max_runs=args.replica, rel_ci=args.rel_ci)
+    cost = hf_cost(model)
+    ceilings = host_ceilings(hardware_profile(), gpu=True)
+    for params in tqdm(pending, total=len(pending), desc='Running experiments'):
+        n_request = params["Num. Requests"]
+        prompt_length = params["Prompt Length"]
+        new_tokens = params["New Tokens"]
+        kernel = params["Kernel"]
         print(f"---- Running: n_request={n_request}, prompt_length={prompt_length}, new_tokens={new_tokens}")
 
         torch.cuda.empty_cache()
         torch.cuda.reset_peak_memory_stats()
 
         with torch.no_grad():
-            diagnostics = benchmark_gptq(
+            diagnostics, series = benchmark_gptq(
                 model,
                 n_request,
                 prompt_length,
-                args.replica,
+                rule,
+                args.ci_metric,
                 new_tokens,
                 tokenizer.pad_token_id,
                 memory_tracker=memory_tracker,
+                energy=energy,
             )
 
         experiment = {
             # experiment configuration
             "memo": args.memo,
             "Run Name": run_name,
-            # software configuration
-            "auto_gptq_v": auto_gptq.__version__,
+            "Config Hash": params["Config Hash"],
+            "Params Hash": params["Params Hash"],
+            # software configuration, hardware configuration and model
+            **identity,
+            **quality,
             "Kernel": kernel,
-            # harware configuration
-            "Device": torch.cuda.get_device_name(),
-            "VRAM (GB)": round(torch.cuda.get_device_properties('cuda').total_memory / 1024 / 1024 / 1024, 2),
-            "RAM (GB)": round(psutil.virtual_memory().total / 1024 / 1024 / 1024, 2),
-            "CPU Count": len(psutil.Process().cpu_affinity()),
             # model configuration
-            "Quant. Method": quantization,
-            "Model": os.path.basename(model_path)+'-'+args.revision,
             #"Model Size (GB)": round(os.path.getsize(model_path) / 1024 / 1024 / 1024, 2),
             "Num. Requests": n_request,
             "Prompt Length": prompt_length,
             "New Tokens": new_tokens,
             # experiment diagnostics
-            **diagnostics
+            **diagnostics,
+            # a decode step reads the weights once for the whole batch
+            **roofline_metrics(cost,
+                               ceilings,
+                               diagnostics["Prefill Time (tk/s)"],
+                               diagnostics["Decode Time (tk/s)"],
+                               context=prompt_length + new_tokens / 2,
+                               n_sequences=n_request),
             }
 
+        # committed as soon as it is measured, a crash later in the sweep keeps it
         if not args.debug:
-            bulb = pd.concat([bulb, pd.DataFrame([experiment])], ignore_index=True)
-
-    if not args.debug:
-        bulb.to_csv('bulb.csv', index=False)
+            samples.append(experiment["id"], series)
+            store.append(experiment)
      
 if __name__ == '__main__':
      main()
@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from utils import *
+
+import numpy as np
+
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+from bulb_store import BulbStore
+from hardware import hardware_profile, register_hardware
+from latency_stats import tpot_percentiles
+
+MODELS_DIR = os.path.join(os.path.expanduser("~"), 'models')
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='Load benchmarking',
+        description='Drive concurrent clients against a backend and measure throughput vs latency.'
+    )
+    parser.add_argument('--target', default='llama', choices=['llama', 'http'], help="In-process llama.cpp model or OpenAI-compatible HTTP endpoint.")
+    parser.add_argument('--model', action='store', type=str, help="GGUF model to load in-process, or model name sent to the endpoint.")
+    parser.add_argument('--url', type=str, default='http://localhost:8000', help="Base URL of the OpenAI-compatible server (e.g. python -m llama_cpp.server).")
+    parser.add_argument('--n-threads', type=int, default=10, help="Number of threads to use for generation (in-process target).")
+    parser.add_argument('--n-threads_batch', type=int, default=10, help="Number of threads to use during batch and prompt processing (in-process target).")
+    parser.add_argument('--n-batch', type=int, default=512, help="Prompt processing maximum batch size (in-process target).")
+    parser.add_argument('--ngl', type=int, default=0, help="Number of layers to store in VRAM (in-process target).")
+    parser.add_argument("--ctx", type=int, default=1100, help="Context length (in-process target).")
+    parser.add_argument('--pattern', default='closed', choices=['closed', 'open'], help="Closed loop (N clients back to back) or open loop (Poisson arrivals).")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 2, 4, 8], help="Number of clients per level (closed loop), or in-flight cap (open loop).")
+    parser.add_argument('--rate', nargs='+', type=float, default=[0.5, 1, 2, 4], help="Arrival rates in req/s per level (open loop).")
+    parser.add_argument('--requests', type=int, default=32, help="Requests sent per level.")
+    parser.add_argument("--prompt-length", type=int, default=100, help="Length of the prompt.")
+    parser.add_argument("--new-tokens", type=int, default=100, help="Length of the generation.")
+    parser.add_argument('--slo-ttft', type=float, default=2.0, help="TTFT objective (s) for goodput.")
+    parser.add_argument('--slo-tpot', type=float, default=200, help="TPOT objective (ms) for goodput.")
+    parser.add_argument('--saturation-gain', type=float, default=0.1, help="Throughput gain below which a level counts as saturated.")
+    parser.add_argument("--memo", type=str, default='', help="Description of the experiment.")
+    parser.add_argument("--debug", action='store_true', default=False, help="Reslts won't be stored.")
+    args = parser.parse_args()
+    if args.target == 'llama' and args.model is None:
+        parser.error("--model is required with --target llama.")
+    return args
+
+
+@dataclass
+class RequestRecord:
+    arrival_ns: int
+    start_ns: int = 0  # when the backend started serving it
+    token_ns: List[int] = field(default_factory=list)
+    error: str | None = None
+
+    @property
+    def queue_delay(self) -> float:
+        return (self.start_ns - self.arrival_ns) / 1e9 if self.start_ns else np.nan
+
+    @property
+    def ttft(self) -> float:
+        return (self.token_ns[0] - self.arrival_ns) / 1e9 if self.token_ns else np.nan
+
+    @property
+    def tpot_ms(self) -> float:
+        return float(np.diff(self.token_ns).mean() / 1e6) if len(self.token_ns) > 1 else np.nan
+
+    @property
+    def latency(self) -> float:
+        return (self.token_ns[-1] - self.arrival_ns) / 1e9 if self.token_ns else np.nan
+
+
+class LlamaTarget:
+    """
+    In-process llama.cpp model. One context serves one request at a time, so
+    concurrent requests wait on the lock and that wait is the queueing delay.
+    """
+    def __init__(self, model, n_vocab: int):
+        from llama_cpp import LogitsProcessorList
+
+        self.model = model
+        self.n_vocab = n_vocab
+        self.lock = threading.Lock()
+
+        def suppress_eos(input_ids, scores):
+            scores[model._token_eos] = -np.inf
+            return scores
+        self.logits_processor = LogitsProcessorList([suppress_eos])
+
+    def make_prompt(self, prompt_length: int, rng: random.Random) -> List[int]:
+        return [rng.randrange(1, self.n_vocab) for _ in range(prompt_length)]
+
+    def _generate(self, prompt: List[int], new_tokens: int, record: RequestRecord):
+        with self.lock:
+            record.start_ns = time.perf_counter_ns()
+            self.model.reset()
+            for _ in self.model.generate(prompt, temp=0.3, logits_processor=self.logits_processor):
+                record.token_ns.append(time.perf_counter_ns())
+                if len(record.token_ns) >= new_tokens:
+                    break
+
+    async def send(self, prompt: List[int], new_tokens: int, record: RequestRecord):
+        await asyncio.get_running_loop().run_in_executor(None, self._generate, prompt, new_tokens, record)
+
+
+class HTTPTarget:
+    """OpenAI-compatible /v1/completions endpoint consumed as a server-sent event stream."""
+    def __init__(self, url: str, model: str | None):
+        self.url = url.rstrip('/') + '/v1/completions'
+        self.model = model
+        self.session = None
+
+    def make_prompt(self, prompt_length: int, rng: random.Random) -> str:
+        # short common words are roughly one token each
+        words = ['the', 'of', 'and', 'to', 'in', 'is', 'for', 'on', 'that', 'with', 'as', 'it', 'at', 'by', 'from']
+        return ' '.join(rng.choice(words) for _ in range(prompt_length))
+
+    async def send(self, prompt: str, new_tokens: int, record: RequestRecord):
+        import aiohttp
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None))
+        payload = {"prompt": prompt, "max_tokens": new_tokens, "stream": True, "temperature": 0.3}
+        if self.model:
+            payload["model"] = self.model
+        # the server queues internally, service start is not observable from the client
+        async with self.session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b'data:'):
+                    continue
+                data = line[len(b'data:'):].strip()
+                if data == b'[DONE]':
+                    break
+                if json.loads(data)["choices"][0].get("text"):
+                    record.token_ns.append(time.perf_counter_ns())
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+async def _serve(target, prompt, new_tokens: int, record: RequestRecord):
+    try:
+        await target.send(prompt, new_tokens, record)
+    except Exception as e:
+        record.error = repr(e)
+
+
+async def closed_loop(target, clients: int, n_requests: int, prompt_length: int, new_tokens: int, seed: int = 101) -> List[RequestRecord]:
+    """`clients` users each send their next request as soon as the previous one completes."""
+    rng = random.Random(seed)
+    records = []
+    remaining = iter(range(n_requests))
+
+    async def client():
+        for _ in remaining:
+            record = RequestRecord(arrival_ns=time.perf_counter_ns())
+            records.append(record)
+            await _serve(target, target.make_prompt(prompt_length, rng), new_tokens, record)
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return records
+
+
+async def open_loop(target, rate: float, max_inflight: int, n_requests: int, prompt_length: int, new_tokens: int, seed: int = 101) -> List[RequestRecord]:
+    """Poisson arrivals at `rate` req/s, independent of how fast the backend answers."""
+    rng = random.Random(seed)
+    inflight = asyncio.Semaphore(max_inflight)
+    records = []
+    tasks = []
+
+    async def request(record: RequestRecord, prompt):
+        # waiting for a slot counts in TTFT, the arrival time is when the user sent it
+        async with inflight:
+            await _serve(target, prompt, new_tokens, record)
+
+    next_arrival = time.perf_counter()
+    for _ in range(n_requests):
+        next_arrival += rng.expovariate(rate)
+        await asyncio.sleep(max(0, next_arrival - time.perf_counter()))
+        record = RequestRecord(arrival_ns=time.perf_counter_ns())
+        records.append(record)
+        tasks.append(asyncio.create_task(request(record, target.make_prompt(prompt_length, rng))))
+    await asyncio.gather(*tasks)
+    return records
+
+
+def summarize_level(records: List[RequestRecord], slo_ttft: float, slo_tpot_ms: float) -> Dict[str, float]:
+    """Aggregate one load level: throughput, goodput and latency percentiles."""
+    done = [r for r in records if r.error is None and r.token_ns]
+    start = min(r.arrival_ns for r in records)
+    end = max((r.token_ns[-1] for r in done), default=start)
+    wall = max(end - start, 1) / 1e9
+
+    ttft = np.array([r.ttft for r in done])
+    tpot = np.array([r.tpot_ms for r in done])
+    good = [r for r in done if r.ttft <= slo_ttft and (np.isnan(r.tpot_ms) or r.tpot_ms <= slo_tpot_ms)]
+
+    stats = {
+        "Completed Requests": len(done),
+        "Failed Requests": len(records) - len(done),
+        "Throughput (req/s)": len(done) / wall,
+        "Throughput (tk/s)": sum(len(r.token_ns) for r in done) / wall,
+        "Goodput (req/s)": len(good) / wall,
+        "Queue Delay (s)": float(np.nanmean([r.queue_delay for r in done])) if done else np.nan,
+        "Latency p50 (s)": float(np.percentile([r.latency for r in done], 50)) if done else np.nan,
+        "Latency p99 (s)": float(np.percentile([r.latency for r in done], 99)) if done else np.nan,
+    }
+    for key, value in tpot_percentiles(ttft * 1000, prefix='TTFT').items():
+        stats[key.replace('(ms)', '(s)')] = value / 1000
+    stats.update(tpot_percentiles(tpot[~np.isnan(tpot)]))
+    return stats
+
+
+def mark_saturation(levels: List[Dict[str, Any]], min_gain: float) -> int | None:
+    """Index of the first level whose token throughput grows by less than `min_gain` over the previous one."""
+    for i in range(1, len(levels)):
+        previous = levels[i - 1]["Throughput (tk/s)"]
+        if previous > 0 and levels[i]["Throughput (tk/s)"] < previous * (1 + min_gain):
+            return i
+    return None
+
+
+def load_target(args):
+    if args.target == 'http':
+        return HTTPTarget(args.url, args.model)
+
+    from gguf_reader import read_gguf
+    from model_cache import LlamaSessionCache, LoadKey
+
+    model_path = os.path.join(MODELS_DIR, args.model)
+    model = LlamaSessionCache(verbose=False).get(LoadKey(model_path=model_path,
+                                                         n_gpu_layers=args.ngl,
+                                                         n_batch=args.n_batch,
+                                                         n_threads=args.n_threads,
+                                                         n_threads_batch=args.n_threads_batch,
+                                                         n_ctx=args.ctx))
+    return LlamaTarget(model, read_gguf(model_path).n_vocab)
+
+
+async def run_levels(args, target) -> List[Dict[str, Any]]:
+    levels = []
+    if args.pattern == 'closed':
+        settings = [{"Concurrency": c} for c in args.concurrency]
+    else:
+        settings = [{"Arrival Rate (req/s)": rate, "Concurrency": max(args.concurrency)} for rate in args.rate]
+
+    for setting in settings:
+        print(f"---- Load level: {setting}")
+        if args.pattern == 'closed':
+            records = await closed_loop(target, setting["Concurrency"], args.requests, args.prompt_length, args.new_tokens)
+        else:
+            records = await open_loop(target, setting["Arrival Rate (req/s)"], setting["Concurrency"],
+                                      args.requests, args.prompt_length, args.new_tokens)
+        levels.append({**setting, **summarize_level(records, args.slo_ttft, args.slo_tpot), "records": records})
+
+    if isinstance(target, HTTPTarget):
+        await target.close()
+    return levels
+
+
+def main():
+    args = parse_arguments()
+    run_name = random_noun_adjective()
+    print(run_name)
+    store = BulbStore()
+    target = load_target(args)
+
+    levels = asyncio.run(run_levels(args, target))
+    saturation = mark_saturation(levels, args.saturation_gain)
+    if saturation is not None:
+        setting = {k: v for k, v in levels[saturation].items() if k in ('Concurrency', 'Arrival Rate (req/s)')}
+        print(f"Saturation reached at {setting}")
+
+    run_time = datetime.now().strftime("%d-%m-%Y_%H:%M:%S")
+    identity = hardware_identity()
+    if not args.debug:
+        register_hardware(store, hardware_profile())
+    for i, level in enumerate(levels):
+        records = level.pop("records")
+        experiment = {
+            # experiment configuration
+            "memo": args.memo,
+            "Run Name": run_name,
+            "run_time": run_time,
+            "id": f"load-{run_name}-{i}",
+            "Mode": f"load-{args.pattern}",
+            "Target": args.url if args.target == 'http' else 'llama',
+            # hardware configuration
+            **identity,
+            # model configuration
+            "Quant. Method": 'gguf' if args.target == 'llama' else None,
+            "Model": os.path.basename(args.model) if args.model else None,
+            "Prompt Length": args.prompt_length,
+            "New Tokens": args.new_tokens,
+            # experiment diagnostics
+            **level,
+            "Saturated": saturation is not None and i >= saturation,
+        }
+        print({k: round(v, 3) if isinstance(v, float) else v for k, v in level.items()})
+        if not args.debug:
+            store.append(experiment)
+            store.append_many(({"id": experiment["id"],
+                                "Queue Delay (s)": r.queue_delay,
+                                "TTFT (s)": r.ttft,
+                                "TPOT (ms)": r.tpot_ms,
+                                "Latency (s)": r.latency,
+                                "Tokens": len(r.token_ns),
+                                "Error": r.error} for r in records),
+                               table='load_requests')
+
+
+if __name__ == "__main__":
+    print('Thinking...')
+    main()
+    print('Done')
@@ -1,8 +1,9 @@
 import os
 import argparse
 
-import pandas as pd
 import plotly.graph_objects as go
+from bulb_store import BulbStore
+from pareto import DEFAULT_OBJECTIVES, column, pareto_front
 from plotly.subplots import make_subplots
 
 def parse_arguments():
@@ -14,6 +15,7 @@ def parse_arguments():
     parser.add_argument('-x', '--xaxes', action='store', default='GPU Layers', choices=['GPU Layers', 'Decode Threads', 'Prefill Threads', 'Prompt Length', 'Num. Requests'], type=str, help="X axes parameter.")
     parser.add_argument('--run-anchor', action='store', nargs='+', type=str, required=True, help="Anchor value for run name.")
     parser.add_argument('--store', action='store_true', default=False, help="Store graphs in images folder.")
+    parser.add_argument('--pareto', action='store', nargs='*', default=None, type=str, help=f"Circle the Pareto front of these objectives ({' '.join(DEFAULT_OBJECTIVES)} when none is given) in each run.")
 
     return parser.parse_args()
 
@@ -21,7 +23,12 @@ def main():
 
     args = parse_arguments()
 
-    df = pd.read_csv('bulb.csv').drop(['id'], axis=1)
+    columns = ['Run Name', 'Device', 'Model', args.xaxes,
+               'Prefill Time (tk/s)', 'Decode Time (tk/s)', 'Total Time (s)',
+               'Load Time (s)', 'Prefill Time (s)', 'Decode Time (s)']
+    objectives = (args.pareto or DEFAULT_OBJECTIVES) if args.pareto is not None else []
+    columns += [column(o) for o in objectives if column(o) not in columns]
+    df = BulbStore().read(columns=columns)
 
      # Create a subplot figure with 1 row and 2 columns
     fig = make_subplots(rows=3, cols=1,
@@ -60,6 +67,20 @@ def main():
             row=3, col=1
         )
 
+        if args.pareto is not None:
+            front_df = filtered_df[pareto_front(filtered_df, objectives)]
+            for row, metric in enumerate(["Prefill Time (tk/s)", "Decode Time (tk/s)", "Total Time (s)"], start=1):
+                fig.add_trace(
+                    go.Scatter(
+                        x=front_df[args.xaxes],
+                        y=front_df[metric],
+                        hoverinfo='skip',
+                        mode='markers',
+                        marker=dict(symbol='circle-open', size=14, color='crimson', line=dict(width=2)),
+                        name=f'{run_anchor} Pareto front'),
+                    row=row, col=1
+                )
+
     fig.update_yaxes(title_text="Prefill Time (tk/s)", row=1, col=1)
     fig.update_yaxes(title_text="Decode Time (tk/s)", row=2, col=1)
     fig.update_yaxes(title_text="Latency (s)", row=3, col=1)
@@ -0,0 +1,279 @@
+import ast
+import sqlite3
+import argparse
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from pandas import DataFrame
+
+BULB_PATH = 'bulb.db'
+EXPERIMENTS = 'experiments'
+# columns a legacy bulb.csv of benchmark_hf filled with seconds per token
+LEGACY_HF_RATES = ("Prefill Time (tk/s)", "Decode Time (tk/s)", "Latency (tk/s)")
+
+# Known columns of the experiments table, new keys get their type inferred on first insert
+COLUMN_TYPES = {
+    # experiment configuration
+    "id": "TEXT",
+    "Config Hash": "TEXT",
+    "Params Hash": "TEXT",
+    "run_time": "TEXT",
+    "memo": "TEXT",
+    "Run Name": "TEXT",
+    # software configuration
+    "llama_cpp_v": "TEXT",
+    "auto_gptq_v": "TEXT",
+    "Kernel": "TEXT",
+    # hardware configuration
+    "Hardware ID": "TEXT",
+    "Device": "TEXT",
+    "VRAM (GB)": "REAL",
+    "RAM (GB)": "REAL",
+    "CPU Count": "INTEGER",
+    # model configuration
+    "Quant. Method": "TEXT",
+    "Model": "TEXT",
+    "Model Size (GB)": "REAL",
+    "Bits Per Weight": "REAL",
+    "Batch Size": "INTEGER",
+    "Context Length": "INTEGER",
+    "Decode Threads": "INTEGER",
+    "Prefill Threads": "INTEGER",
+    "GPU Layers": "REAL",
+    "Num. Requests": "INTEGER",
+    "Prompt Length": "INTEGER",
+    "New Tokens": "INTEGER",
+    # experiment diagnostics
+    "Load Time (s)": "REAL",
+    "Prefill Time (s)": "REAL",
+    "Decode Time (s)": "REAL",
+    "Latency (s)": "REAL",
+    "Prefill Time (tk/s)": "REAL",
+    "Decode Time (tk/s)": "REAL",
+    "Latency (tk/s)": "REAL",
+    "Mem. Usage (GB)": "REAL",
+}
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sql_type(value: Any) -> str:
+    if isinstance(value, (bool, int, np.integer)):
+        return "INTEGER"
+    if isinstance(value, (float, np.floating)):
+        return "REAL"
+    return "TEXT"
+
+
+def to_sql_value(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, (list, tuple, dict)):
+        return str(value)
+    return value
+
+
+class BulbStore:
+    """
+    Append-only results store backed by SQLite in WAL mode.
+
+    Every append is its own transaction, so a crash loses at most the running
+    experiment, and several benchmark processes can write to the same bulb.
+    """
+    def __init__(self, path: str = BULB_PATH, timeout: float = 60.0):
+        self.path = path
+        self.timeout = timeout
+        with self.transaction() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {EXPERIMENTS} "
+                         f"({', '.join(f'{quote(c)} {t}' for c, t in COLUMN_TYPES.items())})")
+            # bulbs created by an older version get the known columns they miss
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({EXPERIMENTS})")}
+            for column, column_type in COLUMN_TYPES.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {EXPERIMENTS} ADD COLUMN {quote(column)} {column_type}")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS config_hash_idx ON {EXPERIMENTS} ({quote('Config Hash')})")
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connect() as conn:
+            # take the write lock up front so concurrent writers queue instead of failing mid-way
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def columns(self, table: str = EXPERIMENTS) -> List[str]:
+        with self.connect() as conn:
+            return [row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")]
+
+    def _ensure_columns(self, conn: sqlite3.Connection, table: str, rows: List[Dict[str, Any]]):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")}
+        missing = {}
+        for row in rows:
+            for key, value in row.items():
+                if key not in existing and key not in missing and value is not None:
+                    missing[key] = COLUMN_TYPES.get(key, sql_type(value))
+        if not existing:
+            conn.execute(f"CREATE TABLE {quote(table)} "
+                         f"({', '.join(f'{quote(c)} {t}' for c, t in missing.items())})")
+            return
+        for key, column_type in missing.items():
+            conn.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(key)} {column_type}")
+
+    def append_many(self, rows: Iterable[Dict[str, Any]], table: str = EXPERIMENTS) -> int:
+        """Commit rows to a table, adding any column that does not exist yet."""
+        rows = [{k: to_sql_value(v) for k, v in row.items()} for row in rows]
+        if not rows:
+            return 0
+        with self.transaction() as conn:
+            self._ensure_columns(conn, table, rows)
+            for row in rows:
+                keys = [k for k, v in row.items() if v is not None]
+                conn.execute(f"INSERT INTO {quote(table)} ({', '.join(map(quote, keys))}) "
+                             f"VALUES ({', '.join('?' * len(keys))})",
+                             [row[k] for k in keys])
+        return len(rows)
+
+    def append(self, row: Dict[str, Any], table: str = EXPERIMENTS):
+        self.append_many([row], table)
+
+    def update(self, values: Dict[str, Any], where: Dict[str, Any], table: str = EXPERIMENTS) -> int:
+        """
+        Set columns of the rows matching equality filters, e.g. a metric measured once per model.
+
+        Parameters:
+        - values (dict): Column -> value, missing columns are added.
+        - where (dict): Equality filters, at least one.
+        - table (str): Table to update.
+
+        Returns:
+        - int: Number of rows updated.
+        """
+        if not where:
+            raise ValueError("update() needs a filter, it would overwrite every row.")
+        values = {k: to_sql_value(v) for k, v in values.items()}
+        with self.transaction() as conn:
+            self._ensure_columns(conn, table, [values])
+            cursor = conn.execute(f"UPDATE {quote(table)} SET {', '.join(f'{quote(k)} = ?' for k in values)} "
+                                  f"WHERE {' AND '.join(f'{quote(k)} = ?' for k in where)}",
+                                  list(values.values()) + [to_sql_value(v) for v in where.values()])
+            return cursor.rowcount
+
+    def fingerprints(self) -> Dict[str, List[str]]:
+        """Map every Config Hash in the bulb to the runs that measured it."""
+        fingerprints = {}
+        with self.connect() as conn:
+            rows = conn.execute(f"SELECT DISTINCT {quote('Config Hash')}, {quote('Run Name')} FROM {EXPERIMENTS} "
+                                f"WHERE {quote('Config Hash')} IS NOT NULL")
+            for fingerprint, run_name in rows:
+                fingerprints.setdefault(fingerprint, []).append(run_name)
+        return fingerprints
+
+    def read(self,
+             columns: List[str] | None = None,
+             where: Dict[str, Any] | None = None,
+             table: str = EXPERIMENTS) -> DataFrame:
+        """
+        Read (a projection of) a table.
+
+        Parameters:
+        - columns (list): Columns to load, all when None. Columns that were never written come back as NaN.
+        - where (dict): Equality filters, e.g. {"Run Name": "eidetic_bullet_hole"}.
+        - table (str): Table to read.
+
+        Returns:
+        - pd.DataFrame: The selected rows.
+        """
+        existing = self.columns(table)
+        if columns is None:
+            columns = existing
+        if not existing:
+            return pd.DataFrame(columns=columns)
+        projection = ', '.join(quote(c) if c in existing else f'NULL AS {quote(c)}' for c in columns)
+        query = f"SELECT {projection} FROM {quote(table)}"
+        params = []
+        if where:
+            query += " WHERE " + " AND ".join(f"{quote(k)} = ?" for k in where)
+            params = [to_sql_value(v) for v in where.values()]
+        with self.connect() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+
+def parse_cell(value: Any) -> Any:
+    """Older benchmark_hf runs stored lists of replicas as strings, keep their mean."""
+    if isinstance(value, str) and value.startswith('['):
+        try:
+            values = ast.literal_eval(value)
+            return sum(values) / len(values)
+        except (ValueError, SyntaxError, ZeroDivisionError):
+            return value
+    return value
+
+
+def legacy_rates(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Tokens per second of a legacy benchmark_hf row.
+
+    benchmark_hf stored the seconds per token of one sequence under the (tk/s) columns, the
+    same columns now hold the tokens per second of the whole batch: n_request / value.
+    Values rounded down to 0 cannot be converted and are dropped. GGUF rows always stored tk/s.
+    """
+    if row.get("Quant. Method", 'gguf') == 'gguf':
+        return row
+    n_request = row.get("Num. Requests", 1)
+    for key in LEGACY_HF_RATES:
+        if key in row:
+            value = row[key]
+            row[key] = n_request / value if isinstance(value, (int, float)) and value > 0 else None
+    return row
+
+
+def import_csv(csv_path: str, store: BulbStore) -> int:
+    """One-shot import of a legacy bulb.csv into the store."""
+    df = pd.read_csv(csv_path)
+    rows = [legacy_rates({k: parse_cell(v) for k, v in row.items() if not pd.isna(v)}) for row in df.to_dict('records')]
+    return store.append_many(rows)
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='Bulb store',
+        description='Manage the results store of the lighthouse.',
+    )
+    parser.add_argument('--db', action='store', type=str, default=BULB_PATH, help="Path of the results store.")
+    parser.add_argument('--import-csv', action='store', type=str, default=None, help="Import a legacy bulb.csv into the store.")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    store = BulbStore(args.db)
+    if args.import_csv is not None:
+        n_rows = import_csv(args.import_csv, store)
+        print(f"Imported {n_rows} experiments from {args.import_csv} into {args.db}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import sys
+import math
+import argparse
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from bulb_store import BULB_PATH, BulbStore
+from sample_store import SampleStore
+
+DEFAULT_METRICS = ["Decode Time (tk/s)", "Prefill Time (tk/s)"]
+RUN_TIME_FORMAT = "%d-%m-%Y_%H:%M:%S"
+
+# columns describing a configuration in the report
+CONFIG_COLUMNS = ['Model', 'Quant. Method', 'Decode Threads', 'Prefill Threads', 'Batch Size', 'GPU Layers',
+                  'Num. Requests', 'Prompt Length', 'New Tokens']
+
+
+def higher_is_better(metric: str) -> bool:
+    """Speeds (tk/s), efficiencies (tk/J) and rates improve upwards, times, memory and energy downwards."""
+    return metric.endswith(("(tk/s)", "(tk/J)")) or metric in ("Speedup", "Acceptance Rate")
+
+
+# largest side the exact U distribution is computed for, the normal approximation is used beyond
+EXACT_MAX_N = 50
+
+
+def u_distribution(n1: int, n2: int) -> np.ndarray:
+    """
+    Probability of every U (0 to n1 n2) of n1 samples against n2 under the null hypothesis, without ties.
+
+    The largest of the pooled samples is either one of x, which beats every y, or one of y:
+    f(n1, n2, u) = f(n1 - 1, n2, u - n2) + f(n1, n2 - 1, u).
+    """
+    # counts[i] holds f(i, j) for the current j
+    counts = [np.ones(1) for _ in range(n1 + 1)]
+    for j in range(1, n2 + 1):
+        for i in range(1, n1 + 1):
+            f = np.zeros(i * j + 1)
+            f[:len(counts[i])] += counts[i]
+            f[j:j + len(counts[i - 1])] += counts[i - 1]
+            counts[i] = f
+    return counts[n1] / counts[n1].sum()
+
+
+def min_p_value(n1: int, n2: int) -> float:
+    """Smallest two-sided p-value the exact test reaches, when one side beats every sample of the other."""
+    if n1 == 0 or n2 == 0:
+        return np.nan
+    return min(1.0, 2 / math.comb(n1 + n2, n1))
+
+
+def mann_whitney(x: np.ndarray, y: np.ndarray) -> Tuple[float, float]:
+    """
+    Two-sided Mann-Whitney U test of x against y.
+
+    The p-value is exact without ties when both sides have at most EXACT_MAX_N samples,
+    otherwise it uses the normal approximation with tie and continuity corrections.
+    The approximation is far off on the handful of replicas a stable configuration stops at.
+
+    Returns:
+    - tuple: U of x and the p-value (nan when either side is empty or every sample ties).
+    """
+    n1, n2 = len(x), len(y)
+    if n1 == 0 or n2 == 0:
+        return np.nan, np.nan
+    pooled = np.concatenate([x, y])
+    ranks = pd.Series(pooled).rank(method='average').to_numpy()
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    _, counts = np.unique(pooled, return_counts=True)
+    if len(counts) == n and max(n1, n2) <= EXACT_MAX_N:
+        probabilities = u_distribution(n1, n2)
+        k = int(round(u))
+        return u, min(1.0, 2 * min(probabilities[:k + 1].sum(), probabilities[k:].sum()))
+    tie = (counts ** 3 - counts).sum() / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie))
+    if sigma == 0:
+        return u, np.nan
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return u, min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def cliffs_delta(x: np.ndarray, y: np.ndarray) -> float:
+    """P(x > y) - P(x < y), in [-1, 1]. It equals the rank-biserial correlation 2U / (n1 n2) - 1."""
+    if len(x) == 0 or len(y) == 0:
+        return np.nan
+    ys = np.sort(y)
+    greater = np.searchsorted(ys, x, side='left').sum()
+    less = (len(ys) - np.searchsorted(ys, x, side='right')).sum()
+    return (greater - less) / (len(x) * len(y))
+
+
+def magnitude(delta: float) -> str:
+    """Romano et al. thresholds of |delta|."""
+    if np.isnan(delta):
+        return ''
+    size = abs(delta)
+    if size < 0.147:
+        return 'negligible'
+    if size < 0.33:
+        return 'small'
+    if size < 0.474:
+        return 'medium'
+    return 'large'
+
+
+def load_runs(store: BulbStore, metrics: List[str]) -> pd.DataFrame:
+    columns = list(dict.fromkeys(['id', 'Run Name', 'run_time', 'Params Hash'] + CONFIG_COLUMNS + metrics))
+    df = store.read(columns=columns)
+    df = df[df['Params Hash'].notna()].copy()
+    # day first, the text does not sort in time order
+    df['run_time'] = pd.to_datetime(df['run_time'], format=RUN_TIME_FORMAT, errors='coerce')
+    return df
+
+
+def baseline_rows(df: pd.DataFrame, candidate: str, baseline: str | None, rolling: int | None) -> pd.DataFrame:
+    """
+    Rows the candidate run is compared with.
+
+    With a baseline run its rows are used. With rolling=N, every configuration of the candidate
+    is compared with the last N runs that measured it before the candidate did.
+    """
+    if baseline is not None:
+        return df[df['Run Name'] == baseline]
+    started = df[df['Run Name'] == candidate].groupby('Params Hash')['run_time'].min()
+    earlier = df[(df['Run Name'] != candidate) & df['Params Hash'].isin(started.index)]
+    earlier = earlier[earlier['run_time'] < earlier['Params Hash'].map(started)]
+    last_runs = (earlier.groupby(['Params Hash', 'Run Name'])['run_time'].max().reset_index()
+                 .sort_values('run_time').groupby('Params Hash').tail(rolling))
+    return earlier.merge(last_runs[['Params Hash', 'Run Name']], on=['Params Hash', 'Run Name'])
+
+
+def pooled_samples(samples: SampleStore, ids: List[str], metric: str) -> np.ndarray:
+    """Replicas of every row, rows stored without per-replica samples contribute nothing."""
+    chunks = [chunk for i in ids for chunk in samples.read(i, f"Replica {metric}")]
+    if not chunks:
+        return np.empty(0)
+    values = np.concatenate(chunks).astype(np.float64)
+    return values[~np.isnan(values)]
+
+
+def compare(df: pd.DataFrame,
+            candidate: pd.DataFrame,
+            baseline: pd.DataFrame,
+            samples: SampleStore,
+            metrics: List[str],
+            alpha: float,
+            max_regression: float) -> pd.DataFrame:
+    """
+    Compare the replicas of every configuration both sides measured.
+
+    Parameters:
+    - df (pd.DataFrame): Every row of the bulb, for the configuration columns.
+    - candidate (pd.DataFrame): Rows of the run under test.
+    - baseline (pd.DataFrame): Rows it is compared with.
+    - samples (SampleStore): Per-replica samples of the rows.
+    - metrics (list): Metrics compared.
+    - alpha (float): Significance level of the Mann-Whitney U test.
+    - max_regression (float): Median change (%) in the bad direction tolerated.
+
+    Returns:
+    - pd.DataFrame: One line per configuration and metric, "Regression" is True where the gate fails and
+      "Inconclusive" where there are too few replicas for any p-value to be below alpha.
+    """
+    lines = []
+    shared = sorted(set(candidate['Params Hash']) & set(baseline['Params Hash']))
+    for params_hash in shared:
+        config = df[df['Params Hash'] == params_hash].iloc[0]
+        for metric in metrics:
+            x = pooled_samples(samples, candidate.loc[candidate['Params Hash'] == params_hash, 'id'].tolist(), metric)
+            y = pooled_samples(samples, baseline.loc[baseline['Params Hash'] == params_hash, 'id'].tolist(), metric)
+            if len(x) == 0 or len(y) == 0:
+                continue
+            _, p = mann_whitney(x, y)
+            delta = cliffs_delta(x, y)
+            change = (np.median(x) / np.median(y) - 1) * 100 if np.median(y) else np.nan
+            worse = -change if higher_is_better(metric) else change
+            lines.append({
+                **{c: config[c] for c in CONFIG_COLUMNS},
+                "Metric": metric,
+                "Baseline": np.median(y),
+                "Candidate": np.median(x),
+                "Change (%)": change,
+                "p-value": p,
+                "Cliff's Delta": delta,
+                "Effect": magnitude(delta),
+                "Replicas": f"{len(x)}/{len(y)}",
+                "Regression": bool(p < alpha and worse > max_regression),
+                "Inconclusive": bool(min_p_value(len(x), len(y)) >= alpha),
+            })
+    return pd.DataFrame(lines)
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='Compare runs',
+        description='Compare the replicas of a run with a baseline and fail on significant regressions.',
+    )
+    parser.add_argument('run', type=str, help="Run Name of the candidate.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--baseline', action='store', type=str, default=None, help="Run Name of the baseline.")
+    group.add_argument('--rolling', action='store', type=int, default=None, help="Compare with the last N earlier runs of every configuration.")
+    parser.add_argument('--metric', action='store', nargs='+', default=DEFAULT_METRICS, type=str, help="Metrics to compare, they need per-replica samples.")
+    parser.add_argument('--alpha', action='store', type=float, default=0.01, help="Significance level of the Mann-Whitney U test.")
+    parser.add_argument('--max-regression', action='store', type=float, default=5.0, help="Median change (%%) in the bad direction tolerated.")
+    parser.add_argument('--db', action='store', type=str, default=BULB_PATH, help="Path of the results store.")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    store = BulbStore(args.db)
+    df = load_runs(store, args.metric)
+    candidate = df[df['Run Name'] == args.run]
+    if candidate.empty:
+        print(f"No experiment of the run {args.run} carries a Params Hash.")
+        return 2
+    baseline = baseline_rows(df, args.run, args.baseline, args.rolling)
+    report = compare(df, candidate, baseline, SampleStore(store), args.metric, args.alpha, args.max_regression)
+    if report.empty:
+        print("No configuration with replica samples was measured by both sides.")
+        return 2
+    with pd.option_context('display.max_columns', None, 'display.width', 250):
+        print(report.dropna(axis=1, how='all').to_string(index=False))
+    inconclusive = int(report['Inconclusive'].sum())
+    if inconclusive:
+        print(f"{inconclusive} comparisons have too few replicas to be significant at alpha={args.alpha}, "
+              f"raise --min-replica of the runs, compare with --rolling or raise --alpha.")
+    regressions = int(report['Regression'].sum())
+    if regressions:
+        print(f"{regressions} significant regressions beyond {args.max_regression}%.")
+        return 1
+    print("No significant regression.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import os
+import re
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from memory_tracker import MemoryBackend, MemoryTracker, visible_device_index
+
+POWERCAP_ROOT = "/sys/class/powercap"
+# top-level zones of the RAPL driver, the subzones (core, uncore, dram) are linked there too.
+# intel-rapl-mmio duplicates the package counters and is left out
+RAPL_ZONE = re.compile(r'^(intel|amd)-rapl:\d+(:\d+)?$')
+
+PACKAGE = "Package Energy (J)"
+DRAM = "DRAM Energy (J)"
+GPU_ENERGY = "GPU Energy (J)"
+ENERGY_KEYS = (PACKAGE, DRAM, GPU_ENERGY)
+
+
+class EnergyCounter:
+    """
+    Cumulative reading of a hardware energy counter that wraps around.
+
+    RAPL counters wrap every few minutes at full load (2^32 uJ on many parts),
+    sampling them every few ms never misses a whole period.
+    """
+    def __init__(self, read: Callable[[], int], wrap: int | None, joules_per_unit: float):
+        self.read = read
+        self.wrap = wrap
+        self.joules_per_unit = joules_per_unit
+        self.last = read()
+        self.total = 0
+
+    def sample(self) -> float:
+        """Joules since the counter was created."""
+        value = self.read()
+        delta = value - self.last
+        if delta < 0:
+            # without a known range a decrease is a reset, nothing is counted for it
+            delta = delta + self.wrap if self.wrap else 0
+        self.last = value
+        self.total += delta
+        return self.total * self.joules_per_unit
+
+
+def _read_int(path: str) -> int:
+    with open(path) as f:
+        return int(f.read())
+
+
+def rapl_domains(root: str = POWERCAP_ROOT) -> List[Tuple[str, str]]:
+    """
+    (metric, zone directory) of the readable package and DRAM domains.
+
+    energy_uj is only readable by root since Linux 5.10 (CVE-2020-8694), such zones are skipped.
+    """
+    if not os.path.isdir(root):
+        return []
+    domains = []
+    for entry in sorted(os.listdir(root)):
+        if not RAPL_ZONE.match(entry):
+            continue
+        zone = os.path.join(root, entry)
+        try:
+            with open(os.path.join(zone, "name")) as f:
+                name = f.read().strip()
+            _read_int(os.path.join(zone, "energy_uj"))
+        except (OSError, ValueError):
+            continue
+        if name.startswith("package"):
+            domains.append((PACKAGE, zone))
+        elif name == "dram":
+            domains.append((DRAM, zone))
+    return domains
+
+
+class RAPLBackend(MemoryBackend):
+    """
+    Energy of the CPU packages and their DRAM from the powercap sysfs, summed over sockets.
+
+    The counters are socket-wide: everything running on the host is counted.
+    """
+    def __init__(self, root: str = POWERCAP_ROOT):
+        self.counters: List[Tuple[str, EnergyCounter]] = []
+        for key, zone in rapl_domains(root):
+            try:
+                wrap = _read_int(os.path.join(zone, "max_energy_range_uj")) + 1
+            except (OSError, ValueError):
+                wrap = None
+            energy_path = os.path.join(zone, "energy_uj")
+            self.counters.append((key, EnergyCounter(lambda path=energy_path: _read_int(path), wrap, 1e-6)))
+        if not self.counters:
+            raise OSError(f"No readable RAPL package or DRAM domain under {root}.")
+        self.domains = sorted({key for key, _ in self.counters})
+
+    def sample(self) -> Dict[str, float]:
+        sample = {}
+        for key, counter in self.counters:
+            sample[key] = sample.get(key, 0.0) + counter.sample()
+        return sample
+
+
+class NVMLEnergyBackend(MemoryBackend):
+    """Energy of the GPU since the driver loaded (mJ, Volta and newer), a 64 bit counter."""
+    def __init__(self, device_index: int):
+        import pynvml
+        pynvml.nvmlInit()
+        self.pynvml = pynvml
+        handle = pynvml.nvmlDeviceGetHandleByIndex(device_index)
+        try:
+            self.counter = EnergyCounter(lambda: pynvml.nvmlDeviceGetTotalEnergyConsumption(handle), None, 1e-3)
+        except pynvml.NVMLError:
+            pynvml.nvmlShutdown()
+            raise
+        self.domains = [GPU_ENERGY]
+
+    def sample(self) -> Dict[str, float]:
+        return {GPU_ENERGY: self.counter.sample()}
+
+    def close(self):
+        self.pynvml.nvmlShutdown()
+
+
+def energy_backends(root: str = POWERCAP_ROOT, device_index: int | None = None) -> List[MemoryBackend]:
+    """RAPL domains of the host and the energy counter of the visible GPU, those that can be read."""
+    backends: List[MemoryBackend] = []
+    try:
+        backends.append(RAPLBackend(root))
+    except OSError:
+        pass
+    if device_index is None:
+        device_index = visible_device_index()
+    if device_index is not None:
+        try:
+            backends.append(NVMLEnergyBackend(device_index))
+        except Exception:
+            # pynvml missing, no NVIDIA driver or a GPU older than Volta
+            pass
+    return backends
+
+
+def energy_tracker(root: str = POWERCAP_ROOT, interval: float = 0.01) -> MemoryTracker | None:
+    """A tracker sampling the energy counters, None when none can be read."""
+    backends = energy_backends(root)
+    if not backends:
+        return None
+    return MemoryTracker(backends=backends, interval=interval)
+
+
+def energy_domains(tracker: MemoryTracker) -> str:
+    return ", ".join(domain for backend in tracker.backends for domain in getattr(backend, "domains", []))
+
+
+def energy_between(tracker: MemoryTracker, start: float, end: float) -> float:
+    """
+    Joules of every domain between two perf_counter() times of the last track().
+
+    The cumulative counters are interpolated linearly between their samples.
+    """
+    times = np.array([tracker.t0 + t for t, _ in tracker.timeline])
+    joules = 0.0
+    for key in ENERGY_KEYS:
+        values = np.array([sample.get(key, np.nan) for _, sample in tracker.timeline])
+        if np.isnan(values).all():
+            continue
+        joules += float(np.interp(end, times, values) - np.interp(start, times, values))
+    return joules
+
+
+def energy_metrics(prefill_j: float,
+                   prefill_s: float,
+                   decode_j: float,
+                   decode_s: float,
+                   prompt_tokens: int,
+                   decode_tokens: int) -> Dict[str, float]:
+    """Joules, average watts and tokens per joule of the prefill and the decode."""
+    return {
+        "Prefill Energy (J)": prefill_j,
+        "Decode Energy (J)": decode_j,
+        "Prefill Power (W)": prefill_j / prefill_s if prefill_s > 0 else np.nan,
+        "Decode Power (W)": decode_j / decode_s if decode_s > 0 else np.nan,
+        "Prefill Efficiency (tk/J)": prompt_tokens / prefill_j if prefill_j > 0 else np.nan,
+        "Decode Efficiency (tk/J)": decode_tokens / decode_j if decode_j > 0 else np.nan,
+    }
+
+
+def phase_energy(tracker: MemoryTracker,
+                 start: float,
+                 first_token: float,
+                 end: float,
+                 prompt_tokens: int,
+                 decode_tokens: int) -> Dict[str, float]:
+    """
+    Energy metrics of one generation, split at its first token.
+
+    Parameters:
+    - tracker (MemoryTracker): Tracker of the energy backends, its track() covered the generation.
+    - start (float): perf_counter() when the prompt was submitted.
+    - first_token (float): perf_counter() when the first token came out, the end of the prefill.
+    - end (float): perf_counter() when the last token came out.
+    - prompt_tokens (int): Tokens of the prompt (all sequences).
+    - decode_tokens (int): Tokens generated after the first one (all sequences).
+
+    Returns:
+    - dict: See energy_metrics.
+    """
+    return energy_metrics(energy_between(tracker, start, first_token), first_token - start,
+                          energy_between(tracker, first_token, end), end - first_token,
+                          prompt_tokens, decode_tokens)
@@ -0,0 +1,152 @@
+import os
+import ctypes
+import platform
+import multiprocessing
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, List
+
+from affinity import sibling_ranks
+from hardware import LogicalCpu, logical_cpus
+
+# set_mempolicy(2) has no glibc wrapper
+SET_MEMPOLICY = {'x86_64': 238, 'aarch64': 237}
+MPOL_DEFAULT = 0
+MPOL_BIND = 2
+
+
+@dataclass
+class Job:
+    params: Dict[str, Any]
+    n_cpus: int
+    exclusive: bool = False   # needs the whole machine, e.g. it shares the GPU
+
+
+class CoreScheduler:
+    """
+    Hand out disjoint sets of physical cores, from a single NUMA node whenever one has enough free.
+
+    Only one hyper-thread per core is scheduled: two jobs on the siblings of a
+    core would share its FMA units and interfere. An exclusive job gets every CPU.
+    """
+    def __init__(self, cpus: List[LogicalCpu]):
+        ranks = sibling_ranks(cpus)
+        self.all_cpus = sorted(c.cpu for c in cpus)
+        self.cpus = sorted((c for c in cpus if ranks[c.cpu] == 0), key=lambda c: (c.node, c.package, c.core))
+        self.node = {c.cpu: c.node for c in cpus}
+        self.free = [c.cpu for c in self.cpus]
+
+    @property
+    def idle(self) -> bool:
+        return len(self.free) == len(self.cpus)
+
+    def acquire(self, n: int) -> List[int] | None:
+        if n > len(self.free):
+            return None
+        by_node: Dict[int, List[int]] = {}
+        for cpu in self.free:
+            by_node.setdefault(self.node[cpu], []).append(cpu)
+        # the fullest node that fits leaves the others whole for larger jobs
+        fitting = [cpus for cpus in by_node.values() if len(cpus) >= n]
+        chosen = min(fitting, key=len)[:n] if fitting else self.free[:n]
+        self.free = [cpu for cpu in self.free if cpu not in chosen]
+        return chosen
+
+    def acquire_all(self) -> List[int] | None:
+        if not self.idle:
+            return None
+        self.free = []
+        return self.all_cpus
+
+    def release(self, cpus: List[int]):
+        released = set(cpus) | set(self.free)
+        self.free = [c.cpu for c in self.cpus if c.cpu in released]
+
+    def nodes(self, cpus: List[int]) -> List[int]:
+        return sorted({self.node[cpu] for cpu in cpus})
+
+
+def bind_memory(nodes: List[int] | None) -> bool:
+    """Allocate the new pages of this process on the given NUMA nodes only, anywhere again when None."""
+    number = SET_MEMPOLICY.get(platform.machine())
+    if number is None:
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    if nodes is None:
+        return libc.syscall(number, MPOL_DEFAULT, None, ctypes.c_ulong(0)) == 0
+    mask = ctypes.c_ulong(sum(1 << node for node in nodes))
+    return libc.syscall(number, MPOL_BIND, ctypes.byref(mask), ctypes.c_ulong(8 * ctypes.sizeof(mask) + 1)) == 0
+
+
+def _run_job(worker: Callable[[Dict[str, Any], List[int]], Any],
+             params: Dict[str, Any],
+             cpus: List[int],
+             nodes: List[int] | None):
+    # a worker runs several jobs, each one sets its own placement
+    os.sched_setaffinity(0, cpus)
+    bind_memory(nodes)
+    return worker(params, cpus)
+
+
+def run_parallel(jobs: List[Job],
+                 worker: Callable[[Dict[str, Any], List[int]], Any],
+                 on_result: Callable[[Job, Any], None],
+                 max_workers: int,
+                 on_error: Callable[[Job, BaseException], None] | None = None):
+    """
+    Run jobs in worker processes pinned to disjoint CPU sets.
+
+    Jobs start in order as soon as enough CPUs are free, smaller jobs further
+    down the list fill the gaps. An exclusive job waits for every running job
+    to finish and gets all the CPUs. Workers are spawned, not forked, so no
+    llama.cpp or CUDA state is inherited, and each one keeps its loaded model
+    between the jobs it runs.
+
+    Parameters:
+    - jobs (list): Jobs to run.
+    - worker (callable): worker(params, cpus) run in the child process, must be picklable.
+    - on_result (callable): on_result(job, result) called in this process as jobs finish.
+    - max_workers (int): Maximum number of jobs running at the same time.
+    - on_error (callable): on_error(job, exception) for failed jobs, they are raised when None.
+    """
+    allowed = set(os.sched_getaffinity(0))
+    cpus = [c for c in logical_cpus() if c.cpu in allowed] or \
+        [LogicalCpu(cpu=cpu, package=0, core=cpu, node=0) for cpu in sorted(allowed)]
+    scheduler = CoreScheduler(cpus)
+
+    for job in jobs:
+        job.exclusive = job.exclusive or job.n_cpus > len(scheduler.cpus)
+
+    pending = deque(jobs)
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        while pending or running:
+            for job in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if job.exclusive:
+                    # nothing overtakes an exclusive job, it starts once the running ones are done
+                    assigned, nodes = scheduler.acquire_all(), None
+                    if assigned is None:
+                        break
+                else:
+                    assigned = scheduler.acquire(job.n_cpus)
+                    if assigned is None:
+                        continue
+                    nodes = scheduler.nodes(assigned)
+                pending.remove(job)
+                future = pool.submit(_run_job, worker, job.params, assigned, nodes)
+                running[future] = (job, assigned)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, assigned = running.pop(future)
+                scheduler.release(assigned)
+                error = future.exception()
+                if error is None:
+                    on_result(job, future.result())
+                elif on_error is not None:
+                    on_error(job, error)
+                else:
+                    raise error
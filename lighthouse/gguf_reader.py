@@ -0,0 +1,287 @@
+# Spec: https://github.com/ggerganov/ggml/blob/master/docs/gguf.md
+
+import os
+import mmap
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+GGUF_MAGIC = b'GGUF'
+GGUF_DEFAULT_ALIGNMENT = 32
+
+# gguf_metadata_value_type -> struct format, strings (8) and arrays (9) are handled apart
+VALUE_FORMATS = {
+    0: 'B', 1: 'b', 2: 'H', 3: 'h', 4: 'I', 5: 'i',
+    6: 'f', 7: '?', 10: 'Q', 11: 'q', 12: 'd',
+}
+STRING_TYPE = 8
+ARRAY_TYPE = 9
+
+# ggml_type -> (name, elements per block, bytes per block)
+GGML_TYPES = {
+    0: ('F32', 1, 4),
+    1: ('F16', 1, 2),
+    2: ('Q4_0', 32, 18),
+    3: ('Q4_1', 32, 20),
+    6: ('Q5_0', 32, 22),
+    7: ('Q5_1', 32, 24),
+    8: ('Q8_0', 32, 34),
+    9: ('Q8_1', 32, 36),
+    10: ('Q2_K', 256, 84),
+    11: ('Q3_K', 256, 110),
+    12: ('Q4_K', 256, 144),
+    13: ('Q5_K', 256, 176),
+    14: ('Q6_K', 256, 210),
+    15: ('Q8_K', 256, 292),
+    16: ('IQ2_XXS', 256, 66),
+    17: ('IQ2_XS', 256, 74),
+    18: ('IQ3_XXS', 256, 98),
+    19: ('IQ1_S', 256, 50),
+    20: ('IQ4_NL', 32, 18),
+    21: ('IQ3_S', 256, 110),
+    22: ('IQ2_S', 256, 82),
+    23: ('IQ4_XS', 256, 136),
+    24: ('I8', 1, 1),
+    25: ('I16', 1, 2),
+    26: ('I32', 1, 4),
+    27: ('I64', 1, 8),
+    28: ('F64', 1, 8),
+    29: ('IQ1_M', 256, 56),
+    30: ('BF16', 1, 2),
+}
+
+
+class GGUFArray(NamedTuple):
+    """Placeholder for an array value, materialised on demand with GGUFFile.read_array()."""
+    item_type: int
+    length: int
+    offset: int
+
+
+@dataclass
+class GGUFTensor:
+    name: str
+    shape: Tuple[int, ...]
+    ggml_type: int
+    offset: int  # absolute byte offset in the file
+    n_elements: int
+    n_bytes: int | None  # None for a ggml type newer than GGML_TYPES
+
+    @property
+    def type_name(self) -> str:
+        return GGML_TYPES[self.ggml_type][0] if self.ggml_type in GGML_TYPES else f'unknown ({self.ggml_type})'
+
+    @property
+    def layer(self) -> int | None:
+        """Index of the repeating block the tensor belongs to, None for embeddings/output."""
+        if self.name.startswith('blk.'):
+            return int(self.name.split('.')[1])
+        return None
+
+
+@dataclass
+class GGUFFile:
+    path: str
+    version: int
+    file_size: int
+    data_offset: int
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    tensors: List[GGUFTensor] = field(default_factory=list)
+
+    @property
+    def architecture(self) -> str:
+        return self.metadata.get('general.architecture', 'llama')
+
+    def arch_value(self, key: str, default: Any = None) -> Any:
+        """Read an architecture scoped key, e.g. arch_value('block_count') -> llama.block_count."""
+        return self.metadata.get(f'{self.architecture}.{key}', default)
+
+    @property
+    def block_count(self) -> int:
+        """Repeating blocks, counted from the blk.N tensors when the header does not say."""
+        block_count = self.arch_value('block_count')
+        if block_count is not None:
+            return int(block_count)
+        return max((t.layer + 1 for t in self.tensors if t.layer is not None), default=0)
+
+    @property
+    def context_length(self) -> int | None:
+        return self.arch_value('context_length')
+
+    @property
+    def n_vocab(self) -> int:
+        vocab_size = self.arch_value('vocab_size')
+        if vocab_size is not None:
+            return int(vocab_size)
+        tokens = self.metadata['tokenizer.ggml.tokens']
+        return tokens.length if isinstance(tokens, GGUFArray) else len(tokens)
+
+    @property
+    def sizes_known(self) -> bool:
+        """False when a tensor has a ggml type this reader does not know, its size is then unknown."""
+        return all(t.n_bytes is not None for t in self.tensors)
+
+    @property
+    def n_bytes(self) -> int | None:
+        if not self.sizes_known:
+            return None
+        return sum(t.n_bytes for t in self.tensors)
+
+    @property
+    def n_elements(self) -> int:
+        return sum(t.n_elements for t in self.tensors)
+
+    @property
+    def bits_per_weight(self) -> float | None:
+        if not self.sizes_known:
+            return None
+        return self.n_bytes * 8 / self.n_elements
+
+    def layer_bytes(self) -> List[int] | None:
+        """
+        Bytes of weights held by each of the block_count repeating blocks, None when a tensor size is unknown.
+
+        Blocks past block_count (e.g. the MTP/NextN layers of newer GGUFs) are left out,
+        n_bytes still counts them.
+        """
+        if not self.sizes_known:
+            return None
+        sizes = [0] * self.block_count
+        for tensor in self.tensors:
+            if tensor.layer is not None and tensor.layer < len(sizes):
+                sizes[tensor.layer] += tensor.n_bytes
+        return sizes
+
+    def tensor(self, name: str) -> GGUFTensor | None:
+        return next((t for t in self.tensors if t.name == name), None)
+
+    def read_array(self, key: str) -> list:
+        value = self.metadata[key]
+        if not isinstance(value, GGUFArray):
+            return value
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return _Cursor(buffer, value.offset, self.version).read_array_items(value.item_type, value.length)
+
+
+class _Cursor:
+    def __init__(self, buffer, offset: int, version: int):
+        self.buffer = buffer
+        self.offset = offset
+        # GGUF v1 used 32 bits for lengths and counts
+        self.size_format = '<I' if version == 1 else '<Q'
+
+    def read(self, fmt: str):
+        value, = struct.unpack_from(fmt, self.buffer, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def read_size(self) -> int:
+        return self.read(self.size_format)
+
+    def read_string(self) -> str:
+        length = self.read_size()
+        value = bytes(self.buffer[self.offset:self.offset + length]).decode('utf-8', errors='replace')
+        self.offset += length
+        return value
+
+    def skip_string(self):
+        length = self.read_size()
+        self.offset += length
+
+    def read_value(self, value_type: int) -> Any:
+        if value_type == STRING_TYPE:
+            return self.read_string()
+        if value_type == ARRAY_TYPE:
+            item_type = self.read('<I')
+            length = self.read_size()
+            array = GGUFArray(item_type, length, self.offset)
+            self.skip_array_items(item_type, length)
+            return array
+        return self.read('<' + VALUE_FORMATS[value_type])
+
+    def skip_array_items(self, item_type: int, length: int):
+        if item_type in VALUE_FORMATS:
+            self.offset += length * struct.calcsize(VALUE_FORMATS[item_type])
+        elif item_type == STRING_TYPE:
+            for _ in range(length):
+                self.skip_string()
+        else:
+            for _ in range(length):
+                self.read_value(item_type)
+
+    def read_array_items(self, item_type: int, length: int) -> list:
+        if item_type in VALUE_FORMATS:
+            fmt = f'<{length}{VALUE_FORMATS[item_type]}'
+            values = list(struct.unpack_from(fmt, self.buffer, self.offset))
+            self.offset += struct.calcsize(fmt)
+            return values
+        return [self.read_value(item_type) for _ in range(length)]
+
+
+def tensor_nbytes(ggml_type: int, n_elements: int) -> int | None:
+    """Bytes of a tensor, None for a ggml type newer than GGML_TYPES (llama.cpp keeps adding quants)."""
+    if ggml_type not in GGML_TYPES:
+        return None
+    _, block_size, type_size = GGML_TYPES[ggml_type]
+    return n_elements // block_size * type_size
+
+
+def read_gguf(model_path: str) -> GGUFFile:
+    """
+    Parse the header of a GGUF file without touching the weights.
+
+    Only the KV metadata and the tensor table are read through an mmap, so the
+    cost depends on the vocabulary size and not on the file size. Array values
+    (e.g. the tokenizer vocabulary) are returned as GGUFArray placeholders.
+
+    Parameters:
+    - model_path (str): Path of the GGUF file.
+
+    Returns:
+    - GGUFFile: Metadata, tensor table and size helpers.
+    """
+    with open(model_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        if buffer[:4] != GGUF_MAGIC:
+            raise ValueError(f"{model_path} is not a GGUF file.")
+        version, = struct.unpack_from('<I', buffer, 4)
+        cursor = _Cursor(buffer, 8, version)
+        n_tensors = cursor.read_size()
+        n_kv = cursor.read_size()
+
+        metadata = {}
+        for _ in range(n_kv):
+            key = cursor.read_string()
+            value_type = cursor.read('<I')
+            metadata[key] = cursor.read_value(value_type)
+
+        infos = []
+        for _ in range(n_tensors):
+            name = cursor.read_string()
+            n_dims = cursor.read('<I')
+            shape = tuple(cursor.read_size() for _ in range(n_dims))
+            ggml_type = cursor.read('<I')
+            offset = cursor.read('<Q')
+            infos.append((name, shape, ggml_type, offset))
+
+        alignment = metadata.get('general.alignment', GGUF_DEFAULT_ALIGNMENT)
+        data_offset = cursor.offset + (alignment - cursor.offset % alignment) % alignment
+        file_size = os.fstat(f.fileno()).st_size
+
+    tensors = []
+    for name, shape, ggml_type, offset in infos:
+        n_elements = 1
+        for dim in shape:
+            n_elements *= dim
+        tensors.append(GGUFTensor(name=name,
+                                  shape=shape,
+                                  ggml_type=ggml_type,
+                                  offset=data_offset + offset,
+                                  n_elements=n_elements,
+                                  n_bytes=tensor_nbytes(ggml_type, n_elements)))
+
+    return GGUFFile(path=model_path,
+                    version=version,
+                    file_size=file_size,
+                    data_offset=data_offset,
+                    metadata=metadata,
+                    tensors=tensors)
@@ -0,0 +1,220 @@
+import os
+import glob
+import json
+import hashlib
+import platform
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Tuple
+
+from memory_tracker import gpu_info, visible_device_index
+
+HARDWARE_TABLE = 'hardware'
+HARDWARE_ID = "Hardware ID"
+
+CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                          "lighthouse", "hardware.json")
+
+# instruction set extensions llama.cpp and the torch kernels dispatch on
+ISA_FLAGS = (
+    # x86
+    'avx', 'avx2', 'fma', 'f16c', 'avx_vnni',
+    'avx512f', 'avx512bw', 'avx512vl', 'avx512_vnni', 'avx512_bf16',
+    'amx_tile', 'amx_int8', 'amx_bf16',
+    # arm
+    'asimd', 'asimddp', 'i8mm', 'bf16', 'sve', 'sve2',
+)
+
+
+@dataclass
+class HardwareProfile:
+    cpu_model: str
+    isa: List[str]
+    physical_cores: int
+    logical_cores: int
+    sockets: int
+    numa_nodes: int
+    ram_gb: float
+    gpu: str | None = None
+    vram_gb: float | None = None
+
+    @property
+    def hardware_id(self) -> str:
+        payload = json.dumps(asdict(self), sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+    @property
+    def device(self) -> str:
+        """What the model runs on: the GPU when there is one, the CPU otherwise."""
+        return self.gpu or self.cpu_model
+
+    def row(self) -> Dict[str, Any]:
+        """Row of the hardware table, experiments only keep the Hardware ID."""
+        return {
+            HARDWARE_ID: self.hardware_id,
+            "CPU Model": self.cpu_model,
+            "ISA": ' '.join(self.isa),
+            "Physical Cores": self.physical_cores,
+            "Logical Cores": self.logical_cores,
+            "Sockets": self.sockets,
+            "NUMA Nodes": self.numa_nodes,
+            "RAM (GB)": self.ram_gb,
+            "GPU": self.gpu,
+            "VRAM (GB)": self.vram_gb,
+        }
+
+
+def read_cpuinfo() -> Dict[str, str]:
+    """Fields of the first processor in /proc/cpuinfo, they are the same for every core we care about."""
+    fields = {}
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if not line.strip():
+                    if fields:
+                        break
+                    continue
+                key, _, value = line.partition(':')
+                fields[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return fields
+
+
+def parse_cpulist(cpulist: str) -> List[int]:
+    """Expand the kernel cpulist format, e.g. 0-3,8,10-11."""
+    cpus = []
+    for part in filter(None, cpulist.strip().split(',')):
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpulist(cpus) -> str:
+    """Inverse of parse_cpulist."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+@dataclass
+class LogicalCpu:
+    cpu: int
+    package: int
+    core: int   # hyper-threads of one physical core share it
+    node: int
+
+
+def logical_cpus() -> List[LogicalCpu]:
+    """Socket, core and NUMA node of every online logical CPU, from sysfs."""
+    nodes = {}
+    for node_dir in glob.glob('/sys/devices/system/node/node[0-9]*'):
+        with open(os.path.join(node_dir, 'cpulist')) as f:
+            for cpu in parse_cpulist(f.read()):
+                nodes[cpu] = int(os.path.basename(node_dir)[4:])
+    cpus = []
+    for topology in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/topology'):
+        cpu = int(os.path.basename(os.path.dirname(topology))[3:])
+        try:
+            with open(os.path.join(topology, 'physical_package_id')) as f:
+                package = int(f.read())
+            with open(os.path.join(topology, 'core_id')) as f:
+                core = int(f.read())
+        except OSError:
+            continue
+        cpus.append(LogicalCpu(cpu=cpu, package=package, core=core, node=nodes.get(cpu, 0)))
+    return sorted(cpus, key=lambda c: c.cpu)
+
+
+def cpu_topology() -> Tuple[int, int]:
+    """Physical cores and sockets."""
+    cpus = logical_cpus()
+    if not cpus:
+        return os.cpu_count(), 1
+    return len({(c.package, c.core) for c in cpus}), len({c.package for c in cpus})
+
+
+def probe_hardware() -> HardwareProfile:
+    cpuinfo = read_cpuinfo()
+    flags = set((cpuinfo.get('flags') or cpuinfo.get('Features') or '').split())
+    physical_cores, sockets = cpu_topology()
+    numa_nodes = len(glob.glob('/sys/devices/system/node/node[0-9]*')) or 1
+    ram_bytes = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    gpu = gpu_info()
+    return HardwareProfile(
+        cpu_model=cpuinfo.get('model name') or platform.processor() or platform.machine(),
+        isa=[flag for flag in ISA_FLAGS if flag in flags],
+        physical_cores=physical_cores,
+        logical_cores=os.cpu_count(),
+        sockets=sockets,
+        numa_nodes=numa_nodes,
+        ram_gb=round(ram_bytes / 1024 / 1024 / 1024, 2),
+        gpu=gpu["name"] if gpu is not None else None,
+        vram_gb=round(gpu["total"] / 1024 / 1024 / 1024, 2) if gpu is not None else None,
+    )
+
+
+def cache_key() -> str | None:
+    """The hardware cannot change without a reboot, except for the GPU picked by CUDA_VISIBLE_DEVICES."""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot_id = f.read().strip()
+    except OSError:
+        return None
+    return f"{boot_id}/{visible_device_index()}"
+
+
+_PROFILE: HardwareProfile | None = None
+
+
+def hardware_profile(cache_path: str = CACHE_PATH) -> HardwareProfile:
+    """
+    Profile of this machine, probed once per boot.
+
+    Parameters:
+    - cache_path (str): JSON file holding the profile of the current boot.
+
+    Returns:
+    - HardwareProfile: CPU model and ISA, core topology, NUMA nodes, memory and GPU.
+    """
+    global _PROFILE
+    if _PROFILE is not None:
+        return _PROFILE
+
+    key = cache_key()
+    if key is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                _PROFILE = HardwareProfile(**cached["profile"])
+                return _PROFILE
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # unreadable or from an older version, probe again
+
+    _PROFILE = probe_hardware()
+    if key is not None:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                json.dump({"key": key, "profile": asdict(_PROFILE)}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+    return _PROFILE
+
+
+def register_hardware(store, profile: HardwareProfile):
+    """Add the profile to the hardware table of the bulb unless it is already there."""
+    known = store.read(columns=[HARDWARE_ID], where={HARDWARE_ID: profile.hardware_id}, table=HARDWARE_TABLE)
+    if known.empty:
+        store.append(profile.row(), table=HARDWARE_TABLE)
+
+
+if __name__ == '__main__':
+    for key, value in hardware_profile().row().items():
+        print(f"{key}: {value}")
@@ -0,0 +1,88 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+CONTEXT_BUCKETS = 4
+
+
+def tpot_percentiles(itl_ms: Sequence[float], prefix: str = 'TPOT') -> Dict[str, float]:
+    """p50/p90/p99 of inter-token latencies in ms."""
+    if len(itl_ms) == 0:
+        return {f"{prefix} p{p} (ms)": np.nan for p in PERCENTILES}
+    values = np.percentile(np.asarray(itl_ms, dtype=np.float64), PERCENTILES)
+    return {f"{prefix} p{p} (ms)": float(v) for p, v in zip(PERCENTILES, values)}
+
+
+def summarize_token_latencies(start_ns: int,
+                              token_ns: Sequence[int],
+                              prompt_length: int) -> Dict[str, float]:
+    """
+    Reduce the arrival timestamps of one generation to latency statistics.
+
+    Parameters:
+    - start_ns (int): perf_counter_ns() right before the request was sent.
+    - token_ns (list): perf_counter_ns() at the arrival of every generated token.
+    - prompt_length (int): Number of prompt tokens, used to place tokens in the context.
+
+    Returns:
+    - dict: TTFT, TPOT percentiles, decode speed per quarter of the generation and its slope
+      against the context position.
+    """
+    arrivals = np.asarray(token_ns, dtype=np.int64)
+    if len(arrivals) == 0:
+        # nothing came out, e.g. an immediate EOS
+        return {"TTFT (s)": np.nan,
+                "TPOT (ms)": np.nan,
+                **tpot_percentiles([]),
+                **{f"Decode Q{i + 1} (tk/s)": np.nan for i in range(CONTEXT_BUCKETS)},
+                "TPOT Slope (ms/1k ctx)": np.nan}
+    itl_ms = np.diff(arrivals) / 1e6
+    stats = {
+        "TTFT (s)": float(arrivals[0] - start_ns) / 1e9,
+        "TPOT (ms)": float(itl_ms.mean()) if len(itl_ms) else np.nan,
+        **tpot_percentiles(itl_ms),
+    }
+
+    # decode speed while the KV cache fills up
+    for i, bucket in enumerate(np.array_split(itl_ms, CONTEXT_BUCKETS)):
+        stats[f"Decode Q{i + 1} (tk/s)"] = len(bucket) * 1000 / bucket.sum() if bucket.sum() > 0 else np.nan
+
+    if len(itl_ms) > 1:
+        positions = prompt_length + np.arange(1, len(arrivals))
+        slope, _ = np.polyfit(positions, itl_ms, 1)
+        stats["TPOT Slope (ms/1k ctx)"] = float(slope * 1000)
+    else:
+        stats["TPOT Slope (ms/1k ctx)"] = np.nan
+
+    return stats
+
+
+def average_summaries(summaries: List[Dict[str, float]]) -> Dict[str, float]:
+    if not summaries:
+        return {}
+    return {key: float(np.nanmean([s[key] for s in summaries])) for key in summaries[0]}
+
+
+def pooled_token_latencies(token_times: List[Tuple[int, Sequence[int]]], prompt_length: int) -> Dict[str, float]:
+    """
+    Latency statistics of the replicas of one configuration.
+
+    The TPOT mean and percentiles are taken once over the inter-token latencies of every
+    replica, a mean of per-replica percentiles is not a percentile. TTFT, the decode speed
+    per quarter and the slope are averaged over the replicas.
+
+    Parameters:
+    - token_times (list): (start_ns, token_ns) of every replica, see summarize_token_latencies.
+    - prompt_length (int): Number of prompt tokens.
+
+    Returns:
+    - dict: See summarize_token_latencies.
+    """
+    stats = average_summaries([summarize_token_latencies(start_ns, token_ns, prompt_length)
+                               for start_ns, token_ns in token_times])
+    itl_ms = np.concatenate([np.diff(np.asarray(token_ns, dtype=np.int64)) / 1e6 for _, token_ns in token_times]
+                            + [np.empty(0)])
+    stats["TPOT (ms)"] = float(itl_ms.mean()) if len(itl_ms) else np.nan
+    stats.update(tpot_percentiles(itl_ms))
+    return stats
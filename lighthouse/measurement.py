@@ -0,0 +1,139 @@
+import math
+import time
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# modified z-score above which a replica is flagged (Iglewicz and Hoaglin)
+OUTLIER_Z = 3.5
+
+
+def t_quantile(p: float, df: int) -> float:
+    """
+    Quantile of Student's t distribution.
+
+    Exact for 1 and 2 degrees of freedom, Cornish-Fisher expansion around the
+    normal quantile otherwise (within 0.2% of the exact value for df >= 3 at p = 0.975).
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    g1 = (z ** 3 + z) / 4
+    g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+    g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+    g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+    return z + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
+
+
+def ci_half_width(values: List[float], confidence: float = 0.95) -> float:
+    """Half-width of the t confidence interval of the mean, NaN below 2 values."""
+    n = len(values)
+    if n < 2:
+        return float('nan')
+    return t_quantile(0.5 + confidence / 2, n - 1) * float(np.std(values, ddof=1)) / math.sqrt(n)
+
+
+def mad_outliers(values: List[float], threshold: float = OUTLIER_Z) -> List[int]:
+    """Indices of the values whose modified z-score, based on the median absolute deviation, exceeds the threshold."""
+    x = np.asarray(values, dtype=np.float64)
+    median = np.median(x)
+    mad = np.median(np.abs(x - median))
+    if mad == 0:
+        return []
+    scores = 0.6745 * np.abs(x - median) / mad
+    return [int(i) for i in np.flatnonzero(scores > threshold)]
+
+
+@dataclass
+class StoppingRule:
+    """
+    When to stop repeating a measurement.
+
+    Parameters:
+    - warmup (int): Cold runs executed first and discarded.
+    - min_runs (int): Measured runs before the interval is checked.
+    - max_runs (int): Measured runs after which the measurement stops anyway.
+    - rel_ci (float): Target half-width of the confidence interval relative to the mean.
+    - confidence (float): Confidence level of the interval.
+    - max_seconds (float): Wall-clock budget of the measured runs.
+    """
+    warmup: int = 1
+    min_runs: int = 3
+    max_runs: int = 10
+    rel_ci: float = 0.02
+    confidence: float = 0.95
+    max_seconds: float | None = None
+
+    @classmethod
+    def fixed(cls, runs: int, warmup: int = 0) -> 'StoppingRule':
+        return cls(warmup=warmup, min_runs=runs, max_runs=runs)
+
+
+@dataclass
+class Measurement:
+    metric: str
+    confidence: float
+    warmup: int = 0
+    samples: Dict[str, List[float]] = field(default_factory=dict)
+
+    @property
+    def n(self) -> int:
+        return len(self.samples.get(self.metric, []))
+
+    def add(self, values: Dict[str, float]):
+        for key, value in values.items():
+            self.samples.setdefault(key, []).append(value)
+
+    def rel_ci(self) -> float:
+        values = self.samples.get(self.metric, [])
+        mean = abs(float(np.mean(values))) if values else 0
+        return ci_half_width(values, self.confidence) / mean if mean > 0 else float('nan')
+
+    def summary(self, rule: StoppingRule) -> Dict[str, float]:
+        """Mean of every metric with its standard deviation and CI half-width, plus how the runs went."""
+        stats = {}
+        for key, values in self.samples.items():
+            stats[key] = float(np.mean(values))
+            stats[f"{key} Std"] = float(np.std(values, ddof=1)) if len(values) > 1 else float('nan')
+            stats[f"{key} CI"] = ci_half_width(values, self.confidence)
+        rel_ci = self.rel_ci()
+        stats.update({
+            "Replicas": self.n,
+            "Warmup Runs": self.warmup,
+            "Outliers": len(mad_outliers(self.samples.get(self.metric, []))) if self.n else 0,
+            "CI Metric": self.metric,
+            "Rel. CI": rel_ci,
+            "Converged": bool(rel_ci <= rule.rel_ci),
+        })
+        return stats
+
+
+def measure(run: Callable[[], Dict[str, float]], metric: str, rule: StoppingRule) -> Measurement:
+    """
+    Repeat `run` until the mean of `metric` is known precisely enough.
+
+    Parameters:
+    - run (callable): Executes one replica and returns its metrics.
+    - metric (str): Metric whose relative CI half-width decides when to stop.
+    - rule (StoppingRule): Warmup, budget and precision.
+
+    Returns:
+    - Measurement: The samples of the measured (non-warmup) runs.
+    """
+    for _ in range(rule.warmup):
+        run()
+    measurement = Measurement(metric=metric, confidence=rule.confidence, warmup=rule.warmup)
+    start = time.perf_counter()
+    while measurement.n < rule.max_runs:
+        measurement.add(run())
+        if measurement.n < rule.min_runs:
+            continue
+        if measurement.rel_ci() <= rule.rel_ci:
+            break
+        if rule.max_seconds is not None and time.perf_counter() - start > rule.max_seconds:
+            break
+    return measurement
@@ -1,61 +1,228 @@
 # Adapted from https://github.com/huggingface/optimum/blob/main/tests/benchmark/memory_tracker.py
 
 import os
+import time
+import shutil
+import threading
 import subprocess
 from contextlib import contextmanager
-from multiprocessing import Pipe, Process
-from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Tuple
 
+GPU_USED = "GPU Used (MB)"
+RSS = "RSS (MB)"
+PSS = "PSS (MB)"
+FILE_BACKED = "File-backed (MB)"
 
-# Adapted from optimum-benchmark, I don't trust pytorch peak memory memory info when external libs are used.
-class MemoryTracker:
-    def __init__(self):
-        self.peak_memory: int = 0
-        self.device_index = int(os.environ["CUDA_VISIBLE_DEVICES"].split(",")[0])
 
-    @contextmanager
-    def track(self, interval: float = 0.1):
-        print(f"Tracking memory for device {self.device_index}")
-        yield from self._track_peak_memory(interval)
-
-    def _track_peak_memory(self, interval: float):
-        child_connection, parent_connection = Pipe()
-        # instantiate process
-        mem_process: Process = PeakMemoryMeasureProcess(self.device_index, child_connection, interval)
-        mem_process.start()
-        # wait until we get memory
-        parent_connection.recv()
-        yield
-        # start parent connection
-        parent_connection.send(0)
-        # receive peak memory
-        self.peak_memory = parent_connection.recv()
-
-
-class PeakMemoryMeasureProcess(Process):
-    def __init__(self, device_index: int, child_connection: Connection, interval: float):
-        super().__init__()
-        self.device_index = device_index
+class MemoryBackend:
+    """A source of memory readings, sample() returns values in MB keyed by metric name."""
+    def sample(self) -> Dict[str, float]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NVMLBackend(MemoryBackend):
+    """Device-wide used memory through NVML, same counter as nvidia-smi but with byte precision."""
+    def __init__(self, device_index: int):
+        import pynvml
+        pynvml.nvmlInit()
+        self.pynvml = pynvml
+        self.handle = pynvml.nvmlDeviceGetHandleByIndex(device_index)
+
+    def sample(self) -> Dict[str, float]:
+        return {GPU_USED: self.pynvml.nvmlDeviceGetMemoryInfo(self.handle).used * 1e-6}
+
+    def close(self):
+        self.pynvml.nvmlShutdown()
+
+
+class NvidiaSmiBackend(MemoryBackend):
+    """Fallback when pynvml is missing, each sample forks nvidia-smi so keep the interval coarse."""
+    def __init__(self, device_index: int):
+        self.command = f"nvidia-smi --query-gpu=memory.used --format=csv --id={device_index}"
+
+    def sample(self) -> Dict[str, float]:
+        gpu_mem_mb = subprocess.check_output(self.command.split()).decode("ascii").split("\n")[1].split()[0]
+        return {GPU_USED: int(gpu_mem_mb) * 1.048576}
+
+
+class ProcessBackend(MemoryBackend):
+    """
+    Host memory of a process from /proc/<pid>/smaps_rollup.
+
+    RSS and PSS include the pages of memory-mapped model files, which are also
+    reported separately as File-backed.
+    """
+    def __init__(self, pid: int | None = None):
+        self.pid = pid or os.getpid()
+        self.path = f"/proc/{self.pid}/smaps_rollup"
+        self.rollup = os.path.exists(self.path)
+
+    def sample(self) -> Dict[str, float]:
+        if not self.rollup:
+            return self._sample_statm()
+        fields = {}
+        with open(self.path, 'rb') as f:
+            for line in f.read().decode('ascii').splitlines()[1:]:
+                key, value = line.split(':', 1)
+                fields[key] = int(value.split()[0])  # kB
+        file_backed = fields.get("Pss_File", fields["Rss"] - fields.get("Anonymous", 0))
+        return {
+            RSS: fields["Rss"] * 1.024e-3,
+            PSS: fields["Pss"] * 1.024e-3,
+            FILE_BACKED: file_backed * 1.024e-3,
+        }
+
+    def _sample_statm(self) -> Dict[str, float]:
+        # kernels older than 4.14, no PSS
+        with open(f"/proc/{self.pid}/statm") as f:
+            _, resident, shared = (int(v) for v in f.read().split()[:3])
+        page_mb = os.sysconf('SC_PAGE_SIZE') * 1e-6
+        return {RSS: resident * page_mb, FILE_BACKED: shared * page_mb}
+
+
+def visible_device_index() -> int | None:
+    """Index of the first GPU in CUDA_VISIBLE_DEVICES, None when it hides every device."""
+    visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES", "0")
+    if not visible_devices:
+        return None
+    return int(visible_devices.split(",")[0])
+
+
+def gpu_info(device_index: int | None = None) -> Dict[str, Any] | None:
+    """
+    Name, total and free memory (bytes) of the visible GPU, None without one.
+
+    Queried through NVML (or nvidia-smi) so that benchmarks of non-torch
+    backends don't need to import torch and create a CUDA context.
+    """
+    device_index = visible_device_index() if device_index is None else device_index
+    if device_index is None:
+        return None
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(device_index)
+            name = pynvml.nvmlDeviceGetName(handle)
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            return {"name": name.decode() if isinstance(name, bytes) else name,
+                    "total": memory.total,
+                    "free": memory.free}
+        finally:
+            pynvml.nvmlShutdown()
+    except Exception:
+        pass
+    if shutil.which("nvidia-smi") is None:
+        return None
+    try:
+        output = subprocess.check_output(["nvidia-smi", "--query-gpu=name,memory.total,memory.free",
+                                          "--format=csv,noheader,nounits", f"--id={device_index}"])
+    except subprocess.CalledProcessError:
+        return None
+    name, total, free = (v.strip() for v in output.decode().strip().split(","))
+    return {"name": name, "total": int(total) * 1024 ** 2, "free": int(free) * 1024 ** 2}
+
+
+def default_backends(device_index: int | None = None) -> List[MemoryBackend]:
+    """Host memory of this process, plus the GPU when one is visible."""
+    backends: List[MemoryBackend] = [ProcessBackend()]
+    if device_index is None:
+        device_index = visible_device_index()
+        if device_index is None:
+            return backends
+    try:
+        backends.append(NVMLBackend(device_index))
+    except Exception:
+        # pynvml missing or no NVIDIA driver
+        if shutil.which("nvidia-smi") is not None:
+            backends.append(NvidiaSmiBackend(device_index))
+    return backends
+
+
+class MemorySampler(threading.Thread):
+    """
+    Poll the backends every `interval` seconds until stop() is called.
+
+    Reading procfs and NVML releases the GIL, so the thread keeps sampling while
+    llama.cpp or torch kernels run in the main thread.
+    """
+    def __init__(self, backends: List[MemoryBackend], interval: float):
+        super().__init__(daemon=True)
+        self.backends = backends
         self.interval = interval
-        self.connection = child_connection
-        self.mem_usage = 0
+        self.timeline: List[Tuple[float, Dict[str, float]]] = []
+        self.t0 = time.perf_counter()  # the timeline is relative to it
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+
+    def sample(self):
+        sample = {}
+        for backend in self.backends:
+            sample.update(backend.sample())
+        self.timeline.append((time.perf_counter() - self.t0, sample))
 
     def run(self):
-        self.connection.send(0)
-        stop = False
+        self.t0 = time.perf_counter()
+        self.sample()
+        self.started.set()
+        # one last sample after stop() so the tail of the run is covered
+        while not self.stopped.wait(self.interval):
+            self.sample()
+        self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
 
-        command = f"nvidia-smi --query-gpu=memory.used --format=csv --id={self.device_index}"
 
-        while True:
-            # py3nvml is broken since it outputs only the reserved memory, and nvidia-smi has only the MiB precision.
-            gpu_mem_mb = subprocess.check_output(command.split()).decode("ascii").split("\n")[1].split()[0]
-            gpu_mem_mb = int(gpu_mem_mb) * 1.048576
-            self.mem_usage = max(self.mem_usage, gpu_mem_mb)
+def is_gpu_backend(backend: MemoryBackend) -> bool:
+    return isinstance(backend, (NVMLBackend, NvidiaSmiBackend))
 
-            if stop:
-                break
-            stop = self.connection.poll(self.interval)
 
-        # send results to parent pipe
-        self.connection.send(self.mem_usage)
-        self.connection.close()
\ No newline at end of file
+# Adapted from optimum-benchmark, I don't trust pytorch peak memory memory info when external libs are used.
+class MemoryTracker:
+    def __init__(self, backends: List[MemoryBackend] | None = None, interval: float = 0.01):
+        self.backends = backends if backends is not None else default_backends()
+        self.interval = interval
+        self.peak_memory: float = 0  # GPU peak in MB, 0 without a GPU backend
+        self.gpu_tracked = False  # whether the last track() sampled the GPU
+        self.peaks: Dict[str, float] = {}
+        self.timeline: List[Tuple[float, Dict[str, float]]] = []
+        self.t0: float = 0  # perf_counter() of the first sample of the timeline
+
+    @property
+    def has_gpu(self) -> bool:
+        return any(is_gpu_backend(b) for b in self.backends)
+
+    @contextmanager
+    def track(self, interval: float | None = None, gpu: bool = True):
+        """
+        Sample the backends while the block runs.
+
+        With gpu=False the GPU backends are left out, e.g. when no layer is offloaded:
+        the device-wide reading would count other processes and say nothing about the run.
+        """
+        self.gpu_tracked = gpu and self.has_gpu
+        backends = self.backends if gpu else [b for b in self.backends if not is_gpu_backend(b)]
+        sampler = MemorySampler(backends, interval or self.interval)
+        sampler.start()
+        # wait until we get memory
+        sampler.started.wait()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            self.timeline = sampler.timeline
+            self.t0 = sampler.t0
+            self.peaks = {}
+            for _, sample in self.timeline:
+                for key, value in sample.items():
+                    self.peaks[key] = max(self.peaks.get(key, 0), value)
+            self.peak_memory = self.peaks.get(GPU_USED, 0)
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
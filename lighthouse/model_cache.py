@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, NamedTuple
+
+# imported on the first load, see backends.py
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+
+class LoadKey(NamedTuple):
+    """Parameters that require a new Llama instance when they change."""
+    model_path: str
+    n_gpu_layers: int
+    n_batch: int
+    n_threads: int
+    n_threads_batch: int
+    n_ctx: int
+    use_mmap: bool = True
+    use_mlock: bool = False
+    numa: bool = False
+    logits_all: bool = False   # needed to verify drafts of speculative decoding
+
+
+class LlamaSessionCache:
+    """
+    Keep loaded GGUF models alive across a sweep.
+
+    Configurations that only differ in prompt length or new tokens share the
+    same LoadKey, so the live context is reused after a reset(). When more than
+    `max_models` sessions are open the least recently used one is freed.
+    """
+    def __init__(self, max_models: int = 1, verbose: bool = False):
+        self.max_models = max_models
+        self.verbose = verbose
+        self.sessions: Dict[LoadKey, 'Llama'] = OrderedDict()
+
+    def get(self, key: LoadKey) -> 'Llama':
+        if key in self.sessions:
+            self.sessions.move_to_end(key)
+            model = self.sessions[key]
+            model.reset()
+            return model
+
+        # free before loading, two large models rarely fit in memory together
+        while len(self.sessions) >= self.max_models:
+            _, evicted = self.sessions.popitem(last=False)
+            self.free(evicted)
+
+        from llama_cpp import Llama
+        model = Llama(**key._asdict(), verbose=self.verbose)
+        self.sessions[key] = model
+        return model
+
+    @staticmethod
+    def free(model: 'Llama'):
+        """Release the llama.cpp context and weights right away instead of waiting for the GC."""
+        from llama_cpp import llama_free, llama_free_model
+        if model._ctx.ctx is not None:
+            llama_free(model._ctx.ctx)
+            model._ctx.ctx = None
+        if model._model.model is not None:
+            llama_free_model(model._model.model)
+            model._model.model = None
+
+    def clear(self):
+        while self.sessions:
+            _, model = self.sessions.popitem(last=False)
+            self.free(model)
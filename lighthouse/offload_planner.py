@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from typing import List
+
+from gguf_reader import GGUFFile
+
+GB = 1024 ** 3
+
+# bytes per KV cache element
+KV_TYPE_BYTES = {
+    'f32': 4,
+    'f16': 2,
+    'q8_0': 34 / 32,
+    'q4_0': 18 / 32,
+}
+
+# CUDA context, cuBLAS workspace and scratch allocations llama.cpp makes as soon as one layer is offloaded
+CUDA_OVERHEAD_BYTES = 400 * 1024 ** 2
+
+
+@dataclass
+class OffloadPrediction:
+    n_gpu_layers: int
+    vram_bytes: int
+    ram_bytes: int
+
+    @property
+    def vram_gb(self) -> float:
+        return self.vram_bytes / GB
+
+    @property
+    def ram_gb(self) -> float:
+        return self.ram_bytes / GB
+
+
+def layers_to_offload(ngl: float, block_count: int) -> int:
+    """Convert a --ngl fraction to n_gpu_layers, the output layer counts as one more layer."""
+    # round first so that k / (block_count + 1) maps back to k despite float error
+    return int(round((block_count + 1) * ngl, 6))
+
+
+def kv_bytes_per_layer(gguf: GGUFFile, n_ctx: int, kv_type: str = 'f16') -> float:
+    n_embd = gguf.arch_value('embedding_length')
+    n_head = gguf.arch_value('attention.head_count')
+    n_head_kv = gguf.arch_value('attention.head_count_kv', n_head)
+    head_dim_k = gguf.arch_value('attention.key_length', n_embd // n_head)
+    head_dim_v = gguf.arch_value('attention.value_length', n_embd // n_head)
+    return n_ctx * n_head_kv * (head_dim_k + head_dim_v) * KV_TYPE_BYTES[kv_type]
+
+
+def compute_buffer_bytes(gguf: GGUFFile, n_ctx: int, n_batch: int) -> float:
+    """
+    Rough size of the f32 scratch buffer of one forward pass over n_batch tokens:
+    the residual stream and FFN activations plus the attention scores.
+    """
+    n_embd = gguf.arch_value('embedding_length')
+    n_ff = gguf.arch_value('feed_forward_length', 4 * n_embd)
+    n_head = gguf.arch_value('attention.head_count')
+    return 4 * n_batch * (4 * n_embd + 2 * n_ff + n_head * n_ctx)
+
+
+def predict(gguf: GGUFFile,
+            n_gpu_layers: int,
+            n_ctx: int,
+            n_batch: int,
+            kv_type: str = 'f16') -> OffloadPrediction | None:
+    """
+    Predict VRAM and RAM needed by llama.cpp for a given number of offloaded layers.
+
+    llama.cpp offloads the last n_gpu_layers repeating blocks with their KV cache,
+    and the output layer once n_gpu_layers exceeds the block count. The token
+    embeddings and the logits always stay on the host. None when the model has
+    tensors of a ggml type whose size is unknown (see GGUFFile.sizes_known).
+    """
+    if not gguf.sizes_known:
+        return None
+    block_count = gguf.block_count
+    n_gpu_layers = max(0, min(n_gpu_layers, block_count + 1))
+    n_gpu_blocks = min(n_gpu_layers, block_count)
+
+    layer_bytes = gguf.layer_bytes()
+    gpu_weights = sum(layer_bytes[block_count - n_gpu_blocks:])
+    output_bytes = sum(t.n_bytes for t in gguf.tensors if t.layer is None and t.name.startswith('output'))
+    if n_gpu_layers > block_count:
+        gpu_weights += output_bytes
+
+    kv_layer = kv_bytes_per_layer(gguf, n_ctx, kv_type)
+    compute = compute_buffer_bytes(gguf, n_ctx, n_batch)
+    logits = 4 * n_batch * gguf.n_vocab
+
+    vram = 0
+    if n_gpu_layers > 0:
+        vram = gpu_weights + n_gpu_blocks * kv_layer + compute + CUDA_OVERHEAD_BYTES
+    ram = (gguf.n_bytes - gpu_weights) + (block_count - n_gpu_blocks) * kv_layer + compute + logits
+
+    return OffloadPrediction(n_gpu_layers=n_gpu_layers, vram_bytes=int(vram), ram_bytes=int(ram))
+
+
+def predictions(gguf: GGUFFile, n_ctx: int, n_batch: int, kv_type: str = 'f16') -> List[OffloadPrediction]:
+    """Predicted footprint of every offload level, from CPU-only to fully offloaded, empty when sizes are unknown."""
+    if not gguf.sizes_known:
+        return []
+    return [predict(gguf, k, n_ctx, n_batch, kv_type) for k in range(gguf.block_count + 2)]
+
+
+def plan_offload(gguf: GGUFFile,
+                 n_ctx: int,
+                 n_batch: int,
+                 vram_free_gb: float,
+                 ram_free_gb: float,
+                 leave_vram_gb: float = 0,
+                 leave_ram_gb: float = 0,
+                 kv_type: str = 'f16') -> OffloadPrediction | None:
+    """
+    Choose the largest n_gpu_layers that leaves the requested memory free.
+
+    Parameters:
+    - gguf (GGUFFile): Header of the model.
+    - n_ctx (int): Context length.
+    - n_batch (int): Prompt processing batch size.
+    - vram_free_gb (float): VRAM currently free, 0 without a GPU.
+    - ram_free_gb (float): RAM currently available.
+    - leave_vram_gb (float): VRAM that must stay free after loading.
+    - leave_ram_gb (float): RAM that must stay free after loading.
+    - kv_type (str): KV cache type, f16 in llama.cpp by default.
+
+    Returns:
+    - OffloadPrediction: The chosen level and its predicted footprint, None when no level fits both budgets.
+    """
+    # the CPU-only level uses no VRAM, it stays possible when less than leave_vram_gb is free (or no GPU)
+    vram_budget = max(vram_free_gb - leave_vram_gb, 0) * GB
+    ram_budget = (ram_free_gb - leave_ram_gb) * GB
+
+    # VRAM grows and RAM shrinks with every offloaded layer, keep the deepest level that fits both
+    chosen = None
+    for prediction in predictions(gguf, n_ctx, n_batch, kv_type):
+        if prediction.vram_bytes <= vram_budget and prediction.ram_bytes <= ram_budget:
+            chosen = prediction
+    return chosen
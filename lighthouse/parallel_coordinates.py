@@ -1,8 +1,9 @@
 import os
 import argparse
 
-import pandas as pd
 import plotly.graph_objects as go
+from bulb_store import BulbStore
+from pareto import DEFAULT_OBJECTIVES, column, pareto_front
 
 def parse_arguments():
     """Parse command line arguments."""
@@ -11,6 +12,7 @@ def parse_arguments():
         description='Generate ParCor interactive graphs of LLM inference performance.',
     )
     parser.add_argument('--store', action='store_true', default=False, help="Store graph in images folder.")
+    parser.add_argument('--pareto', action='store', nargs='*', default=None, type=str, help=f"Highlight the Pareto front of these objectives ({' '.join(DEFAULT_OBJECTIVES)} when none is given).")
 
     return parser.parse_args()
 
@@ -18,16 +20,25 @@ def main():
 
     args = parse_arguments()
 
-    df = pd.read_csv('bulb.csv')
-
-    # Create a mapping from model names to numbers
-    map_fn = {model: i for i, model in enumerate(df['Model'].unique())}
     columns = ['Model', 'Quant. Method', 'Device', 'Model Size (GB)',
                'Mem. Usage (GB)', 'Prompt Length', 'New Tokens','GPU Layers', 
                'Batch Size', 'Num. Requests', 'Prefill Threads', 'Kernel',
                'Decode Threads', 'Prefill Time (tk/s)', 'Decode Time (tk/s)']
 
-    df = df[columns]
+    if args.pareto is not None:
+        objectives = args.pareto or DEFAULT_OBJECTIVES
+        columns += [column(o) for o in objectives if column(o) not in columns]
+
+    df = BulbStore().read(columns=columns)
+
+    # Create a mapping from model names to numbers
+    map_fn = {model: i for i, model in enumerate(df['Model'].unique())}
+    line = dict(color = df['Model'].map(map_fn))
+    if args.pareto is not None:
+        # objectives nobody measured would be empty axes
+        df = df.dropna(axis=1, how='all')
+        df['Pareto'] = pareto_front(df, [o for o in objectives if column(o) in df.columns]).astype(int)
+        line = dict(color = df['Pareto'], colorscale = [[0, 'lightgrey'], [1, 'crimson']])
 
     def create_dict_dimensions(df):
         dicts = []
@@ -48,7 +59,7 @@ def main():
 
     fig = go.Figure(data=
         go.Parcoords(
-            line=dict(color = df['Model'].map(map_fn)),
+            line=line,
             dimensions = list(create_dict_dimensions(df)),
             labelangle = -45,
             labelfont =dict(
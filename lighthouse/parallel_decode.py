@@ -0,0 +1,159 @@
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+import numpy as np
+
+from latency_stats import tpot_percentiles
+from measurement import StoppingRule, measure
+from memory_tracker import GPU_USED, RSS, MemoryTracker
+from sample_store import Series, memory_series, replica_series
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+AGGREGATE_TPS = "Decode Time (tk/s)"
+
+
+def required_context(n_sequences: int, prompt_length: int, new_tokens: int) -> int:
+    """Cells of the KV cache the sequences need, llama.cpp shares one cache between them."""
+    return n_sequences * (prompt_length + new_tokens)
+
+
+class Batch:
+    """A llama_batch filled from Python, every token belongs to a single sequence."""
+    def __init__(self, capacity: int):
+        import llama_cpp
+        self.capacity = capacity
+        self.batch = llama_cpp.llama_batch_init(capacity, 0, 1)
+
+    def set(self, tokens: List[Tuple[int, int, int, bool]]):
+        """(token, position, sequence, logits) of the tokens to evaluate."""
+        for i, (token, pos, seq, logits) in enumerate(tokens):
+            self.batch.token[i] = token
+            self.batch.pos[i] = pos
+            self.batch.n_seq_id[i] = 1
+            self.batch.seq_id[i][0] = seq
+            self.batch.logits[i] = logits
+        self.batch.n_tokens = len(tokens)
+
+    def free(self):
+        import llama_cpp
+        llama_cpp.llama_batch_free(self.batch)
+
+
+def decode(model: 'Llama', batch: Batch, tokens: List[Tuple[int, int, int, bool]]):
+    import llama_cpp
+    batch.set(tokens)
+    status = llama_cpp.llama_decode(model._ctx.ctx, batch.batch)
+    if status != 0:
+        raise RuntimeError(f"llama_decode failed ({status}), the KV cache is too small for the sequences.")
+
+
+def greedy(model: 'Llama', index: int, n_vocab: int) -> int:
+    """Most likely token at a position of the last batch, end of sequence excluded."""
+    import llama_cpp
+    logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(model._ctx.ctx, index), shape=(n_vocab,)).copy()
+    logits[model._token_eos] = -np.inf
+    return int(np.argmax(logits))
+
+
+def benchmark_parallel_decode(model: 'Llama',
+                              n_vocab: int,
+                              n_sequences: int,
+                              prompt_length: int,
+                              new_tokens: int,
+                              n_batch: int,
+                              rule: StoppingRule,
+                              memory_tracker: MemoryTracker,
+                              gpu: bool = True) -> Tuple[Dict[str, Any], List[Series]]:
+    """
+    Decode n_sequences independent requests at once from one copy of the weights.
+
+    The prompts are prefilled one after the other, then every step evaluates one token
+    of each sequence in a single llama_batch (one sequence id per request), so the
+    weights are read once per step for all of them. The context must hold
+    required_context() tokens and n_batch must be at least n_sequences.
+
+    Parameters:
+    - model (Llama): Loaded model.
+    - n_vocab (int): Vocabulary size.
+    - n_sequences (int): Concurrent requests.
+    - prompt_length (int): Prompt tokens of every request.
+    - new_tokens (int): Tokens generated for every request.
+    - n_batch (int): Batch size of the context, prompts are evaluated in chunks of it.
+    - rule (StoppingRule): Replicas, stopping on the aggregate decode speed.
+    - memory_tracker (MemoryTracker): Samples memory during the cold run.
+    - gpu (bool): Whether layers are offloaded, the memory of the process is reported otherwise.
+
+    Returns:
+    - tuple: Diagnostics of the experiment and the per-replica samples.
+    """
+    import llama_cpp
+
+    if n_sequences > n_batch:
+        raise ValueError(f"{n_sequences} sequences do not fit in a batch of {n_batch} tokens, raise --n-batch.")
+    prompts = [np.random.randint(1, n_vocab, size=prompt_length).tolist() for _ in range(n_sequences)]
+    batch = Batch(n_batch)
+    step_ms = []
+
+    def replica() -> Dict[str, float]:
+        # every sequence of the previous replica leaves the cache
+        llama_cpp.llama_kv_cache_seq_rm(model._ctx.ctx, -1, -1, -1)
+        start = time.perf_counter()
+        last = []
+        for seq, prompt in enumerate(prompts):
+            for chunk in range(0, prompt_length, n_batch):
+                tokens = prompt[chunk:chunk + n_batch]
+                decode(model, batch, [(token, chunk + i, seq, chunk + i == prompt_length - 1)
+                                      for i, token in enumerate(tokens)])
+            last.append(greedy(model, len(tokens) - 1, n_vocab))
+        prefill_s = time.perf_counter() - start
+
+        steps = []
+        for step in range(new_tokens - 1):
+            step_start = time.perf_counter()
+            decode(model, batch, [(token, prompt_length + step, seq, True) for seq, token in enumerate(last)])
+            last = [greedy(model, seq, n_vocab) for seq in range(n_sequences)]
+            steps.append(time.perf_counter() - step_start)
+        decode_s = sum(steps)
+        step_ms[:] = [s * 1000 for s in steps]
+
+        return {
+            "Prefill Time (s)": prefill_s,
+            "Decode Time (s)": decode_s,
+            "Latency (s)": prefill_s + decode_s,
+            "Prefill Time (tk/s)": n_sequences * prompt_length / prefill_s,
+            # every step yields one token of each sequence
+            AGGREGATE_TPS: n_sequences * (new_tokens - 1) / decode_s if decode_s > 0 else np.nan,
+            "Sequence Decode (tk/s)": (new_tokens - 1) / decode_s if decode_s > 0 else np.nan,
+            "TPOT (ms)": float(np.mean(step_ms)) if step_ms else np.nan,
+            "Latency (tk/s)": n_sequences * (prompt_length + new_tokens) / (prefill_s + decode_s),
+        }
+
+    tracked = []
+
+    def tracked_replica() -> Dict[str, float]:
+        if tracked:
+            return replica()
+        # the cold run allocates the cache of every sequence, the growth comes from it
+        with memory_tracker.track(gpu=gpu):
+            tracked.append(True)
+            return replica()
+
+    try:
+        measurement = measure(tracked_replica, AGGREGATE_TPS, rule)
+    finally:
+        llama_cpp.llama_kv_cache_seq_rm(model._ctx.ctx, -1, -1, -1)
+        batch.free()
+
+    key = GPU_USED if memory_tracker.gpu_tracked else RSS
+    start_mb = memory_tracker.timeline[0][1].get(key, 0) if memory_tracker.timeline else 0
+    diagnostics = {
+        **measurement.summary(rule),
+        # percentiles of the steps of the last replica, one step is one token of every sequence
+        **tpot_percentiles(step_ms),
+        "Mem. Usage (GB)": round(memory_tracker.peaks.get(key, 0) / 1000, 2),
+        "Mem. Growth (GB)": round((memory_tracker.peaks.get(key, 0) - start_mb) / 1000, 2),
+        "RAM Usage (GB)": round(memory_tracker.peaks.get(RSS, 0) / 1000, 2),
+    }
+    return diagnostics, replica_series(measurement.samples) + memory_series(memory_tracker.timeline)
@@ -0,0 +1,174 @@
+import re
+import argparse
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from bulb_store import BULB_PATH, BulbStore
+from hardware import HARDWARE_ID, hardware_profile
+
+# short name -> (column, True when larger is better)
+OBJECTIVES = {
+    'decode': ("Decode Time (tk/s)", True),
+    'prefill': ("Prefill Time (tk/s)", True),
+    'memory': ("Mem. Usage (GB)", False),
+    'ram': ("RAM Usage (GB)", False),
+    'ttft': ("TTFT (s)", False),
+    'latency': ("Latency (s)", False),
+    'size': ("Model Size (GB)", False),
+    'energy': ("Decode Efficiency (tk/J)", True),
+    'ppl': ("Perplexity", False),
+}
+DEFAULT_OBJECTIVES = ['decode', 'memory', 'ttft', 'size']
+
+# configuration columns shown next to the objectives
+CONFIG_COLUMNS = ['Run Name', 'Model', 'Quant. Method', 'Device', 'Decode Threads', 'Prefill Threads',
+                  'Batch Size', 'GPU Layers', 'Pinning', 'Num. Requests', 'Prompt Length', 'New Tokens']
+
+CONSTRAINT = re.compile(r'^\s*(.+?)\s*(>=|<=|==|>|<)\s*([-+0-9.eE]+)\s*$')
+OPERATORS = {
+    '>=': np.greater_equal,
+    '<=': np.less_equal,
+    '==': np.equal,
+    '>': np.greater,
+    '<': np.less,
+}
+
+
+def column(name: str) -> str:
+    """Column of a short objective name, other names are columns already."""
+    return OBJECTIVES[name][0] if name in OBJECTIVES else name
+
+
+def parse_constraint(text: str) -> Tuple[str, str, float]:
+    """'decode>=15' or 'Mem. Usage (GB)<6' -> (column, operator, value)."""
+    match = CONSTRAINT.match(text)
+    if match is None:
+        raise ValueError(f"Cannot parse the constraint {text!r}, expected e.g. decode>=15 or 'Mem. Usage (GB)<=6'.")
+    name, operator, value = match.groups()
+    return column(name), operator, float(value)
+
+
+def pareto_mask(values: np.ndarray, maximize: np.ndarray, chunk: int = 1024) -> np.ndarray:
+    """
+    Rows of `values` no other row dominates.
+
+    A row dominates another when it is at least as good on every objective and better on one.
+    The comparison is vectorised over chunks of rows, memory stays O(chunk * n * k).
+
+    Parameters:
+    - values (np.ndarray): n x k objectives, without NaN.
+    - maximize (np.ndarray): k booleans, True when larger is better.
+    - chunk (int): Rows compared against all the others at once.
+
+    Returns:
+    - np.ndarray: n booleans, True on the front.
+    """
+    # minimise everything
+    costs = np.where(maximize, -values, values).astype(np.float64)
+    n = len(costs)
+    on_front = np.ones(n, dtype=bool)
+    for start in range(0, n, chunk):
+        block = costs[start:start + chunk]
+        # no_worse[i, j]: row j is at least as good as row i of the block on every objective
+        no_worse = np.all(costs[None, :, :] <= block[:, None, :], axis=2)
+        better = np.any(costs[None, :, :] < block[:, None, :], axis=2)
+        on_front[start:start + chunk] = ~np.any(no_worse & better, axis=1)
+    return on_front
+
+
+def apply_constraints(df: pd.DataFrame, constraints: List[Tuple[str, str, float]]) -> pd.DataFrame:
+    keep = np.ones(len(df), dtype=bool)
+    for name, operator, value in constraints:
+        # rows that never measured the column cannot satisfy it
+        keep &= OPERATORS[operator](df[name].to_numpy(dtype=np.float64), value)
+    return df[keep]
+
+
+def pareto_front(df: pd.DataFrame, objectives: List[str]) -> pd.Series:
+    """
+    Front membership of every row, NaN objectives keep a row off the front.
+
+    Objectives nobody measured (e.g. TTFT without --stream) are ignored.
+    """
+    columns = [column(o) for o in objectives if df[column(o)].notna().any()]
+    maximize = np.array([OBJECTIVES[o][1] if o in OBJECTIVES else True for o in objectives
+                         if df[column(o)].notna().any()])
+    on_front = pd.Series(False, index=df.index)
+    if not columns:
+        return on_front
+    complete = df[columns].notna().all(axis=1)
+    values = df.loc[complete, columns].to_numpy(dtype=np.float64)
+    on_front[complete] = pareto_mask(values, maximize)
+    return on_front
+
+
+def recommend(df: pd.DataFrame,
+              objectives: List[str],
+              constraints: List[Tuple[str, str, float]] | None = None) -> pd.DataFrame:
+    """
+    Configurations satisfying the constraints that no other one beats on every objective.
+
+    Parameters:
+    - df (pd.DataFrame): Experiments.
+    - objectives (list): Short names of OBJECTIVES or columns (larger is better for unknown columns).
+    - constraints (list): (column, operator, value), see parse_constraint.
+
+    Returns:
+    - pd.DataFrame: The front, best first on the first objective.
+    """
+    df = apply_constraints(df, constraints or [])
+    front = df[pareto_front(df, objectives)]
+    first = objectives[0]
+    ascending = not (OBJECTIVES[first][1] if first in OBJECTIVES else True)
+    return front.sort_values(column(first), ascending=ascending)
+
+
+def load_results(store: BulbStore,
+                 objectives: List[str],
+                 constraints: List[Tuple[str, str, float]],
+                 model: str | None = None,
+                 hardware_id: str | None = None) -> pd.DataFrame:
+    where: Dict[str, str] = {}
+    if model is not None:
+        where["Model"] = model
+    if hardware_id is not None:
+        where[HARDWARE_ID] = hardware_id
+    columns = list(dict.fromkeys(CONFIG_COLUMNS + [column(o) for o in objectives] + [c for c, _, _ in constraints]))
+    return store.read(columns=columns, where=where)
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='Pareto front',
+        description='Find the configurations of the bulb no other one beats, e.g. the fastest under a memory budget.',
+    )
+    parser.add_argument('--objective', action='store', nargs='+', default=DEFAULT_OBJECTIVES, type=str, help=f"Objectives, short names {list(OBJECTIVES)} or columns (maximised). The front is sorted on the first one.")
+    parser.add_argument('--where', action='store', nargs='+', default=[], type=parse_constraint, help="Constraints, e.g. decode>=15 memory<=6.")
+    parser.add_argument('--model', action='store', type=str, default=None, help="Only the runs of this model.")
+    parser.add_argument('--hardware-id', action='store', type=str, default=None, help="Only the runs of this Hardware ID, this host by default.")
+    parser.add_argument('--any-host', action='store_true', default=False, help="Use the runs of every host.")
+    parser.add_argument('--top', action='store', type=int, default=10, help="Configurations to print.")
+    parser.add_argument('--db', action='store', type=str, default=BULB_PATH, help="Path of the results store.")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    hardware_id = None if args.any_host else (args.hardware_id or hardware_profile().hardware_id)
+    df = load_results(BulbStore(args.db), args.objective, args.where, model=args.model, hardware_id=hardware_id)
+    front = recommend(df, args.objective, args.where)
+    if front.empty:
+        print(f"No configuration out of {len(df)} satisfies the constraints.")
+        return None
+    print(f"{len(front)} configurations on the front out of {len(df)}:")
+    shown = front.head(args.top).dropna(axis=1, how='all')
+    with pd.option_context('display.max_columns', None, 'display.width', 250):
+        print(shown.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import os
+import math
+import time
+import hashlib
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from gguf_reader import GGUFFile
+from hardware import CACHE_PATH
+from measurement import ci_half_width
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+TOKEN_CACHE_DIR = os.path.join(os.path.dirname(CACHE_PATH), "tokens")
+TOKEN_DTYPE = np.dtype('<i4')
+CHUNK_CHARS = 1 << 16
+
+# window -> negative log-likelihood of every token after its n_context first ones
+Scorer = Callable[[np.ndarray, int], np.ndarray]
+
+
+def tokenizer_hash(parts: Iterable[Any]) -> str:
+    """Hash of whatever defines a tokenizer (type, vocabulary, merges)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+def gguf_tokenizer_hash(gguf: GGUFFile) -> str:
+    """The quantizations of a model share their vocabulary, and so their token cache."""
+    keys = ('tokenizer.ggml.model', 'tokenizer.ggml.tokens', 'tokenizer.ggml.merges', 'tokenizer.ggml.token_type')
+    return tokenizer_hash((key, gguf.read_array(key)) for key in keys if key in gguf.metadata)
+
+
+def hf_tokenizer_hash(tokenizer) -> str:
+    return tokenizer_hash([type(tokenizer).__name__, sorted(tokenizer.get_vocab().items())])
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def text_chunks(path: str, chunk_chars: int = CHUNK_CHARS) -> Iterator[str]:
+    """Text of a file in chunks of about chunk_chars, cut at line ends."""
+    chunk = []
+    size = 0
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            chunk.append(line)
+            size += len(line)
+            if size >= chunk_chars:
+                yield ''.join(chunk)
+                chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def cached_tokens(text_path: str,
+                  tokenizer_id: str,
+                  tokenize: Callable[[str], List[int]],
+                  cache_dir: str = TOKEN_CACHE_DIR) -> np.ndarray:
+    """
+    Tokens of a text file, memory-mapped from a cache keyed by the tokenizer and the file content.
+
+    The file is tokenized chunk by chunk (cut at line ends) without special tokens, so it never
+    has to fit in memory. A chunk boundary may tokenize differently than the whole text would,
+    once every CHUNK_CHARS characters.
+
+    Parameters:
+    - text_path (str): UTF-8 text.
+    - tokenizer_id (str): Hash of the tokenizer, see gguf_tokenizer_hash and hf_tokenizer_hash.
+    - tokenize (callable): Text to token ids, without BOS.
+    - cache_dir (str): Directory of the cached token files.
+
+    Returns:
+    - np.ndarray: int32 token ids, read-only.
+    """
+    path = os.path.join(cache_dir, f"{tokenizer_id}-{file_hash(text_path)}.{TOKEN_DTYPE.str[1:]}")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # concurrent runs each write their own file, the last rename wins with identical content
+        tmp_path = f"{path}.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            for chunk in text_chunks(text_path):
+                f.write(np.asarray(tokenize(chunk), dtype=TOKEN_DTYPE).tobytes())
+        os.replace(tmp_path, path)
+    n = os.path.getsize(path) // TOKEN_DTYPE.itemsize
+    if n == 0:
+        raise ValueError(f"{text_path} has no tokens.")
+    return np.memmap(path, dtype=TOKEN_DTYPE, mode='r', shape=(n,))
+
+
+def windows(n_tokens: int, n_ctx: int, stride: int) -> Iterator[Tuple[int, int, int]]:
+    """
+    (begin, end, n_context) of the sliding windows over n_tokens tokens.
+
+    The first window scores all its tokens but the first, the next ones move by `stride`
+    and only score the tokens they add, with n_ctx - stride tokens of context before them.
+    """
+    if not 0 < stride < n_ctx:
+        raise ValueError(f"The stride ({stride}) must be between 1 and the context ({n_ctx}) - 1.")
+    end = min(n_ctx, n_tokens)
+    yield 0, end, 1
+    while end < n_tokens:
+        next_end = min(end + stride, n_tokens)
+        begin = next_end - n_ctx
+        yield begin, next_end, end - begin
+        end = next_end
+
+
+def negative_log_likelihood(logits: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """-log softmax(logits)[target] of every row."""
+    logits = np.asarray(logits, dtype=np.float32)
+    peak = logits.max(axis=1)
+    log_sum = peak + np.log(np.exp(logits - peak[:, None]).sum(axis=1))
+    return (log_sum - logits[np.arange(len(targets)), targets]).astype(np.float64)
+
+
+def gguf_scorer(model: 'Llama') -> Scorer:
+    """Scores windows with a llama.cpp model loaded with logits_all=True and a context of at least n_ctx."""
+    def score(window: np.ndarray, n_context: int) -> np.ndarray:
+        model.reset()
+        model.eval(window.tolist())
+        # the logits of a position predict the next token
+        return negative_log_likelihood(model.scores[n_context - 1:len(window) - 1], window[n_context:])
+    return score
+
+
+def hf_scorer(model) -> Scorer:
+    """Scores windows with a transformers causal LM."""
+    import torch
+
+    def score(window: np.ndarray, n_context: int) -> np.ndarray:
+        input_ids = torch.as_tensor(window, dtype=torch.long, device=model.device)[None]
+        with torch.no_grad():
+            logits = model(input_ids).logits[0, n_context - 1:-1].float()
+        return torch.nn.functional.cross_entropy(logits, input_ids[0, n_context:], reduction='none').cpu().numpy()
+    return score
+
+
+def evaluate_perplexity(tokens: np.ndarray,
+                        score: Scorer,
+                        n_ctx: int,
+                        stride: int,
+                        bos: int | None = None,
+                        rel_ci: float = 0.01,
+                        min_windows: int = 8,
+                        max_tokens: int | None = None,
+                        confidence: float = 0.95) -> Dict[str, Any]:
+    """
+    Perplexity of a model over sliding windows, stopping once it is known precisely enough.
+
+    Parameters:
+    - tokens (np.ndarray): Token ids of the text.
+    - score (callable): See gguf_scorer and hf_scorer.
+    - n_ctx (int): Tokens per window.
+    - stride (int): Tokens scored per window after the first one.
+    - bos (int): Put at the start of every window (as llama.cpp perplexity does), its first token is never scored.
+    - rel_ci (float): Stop when the CI half-width of the perplexity is below this fraction of it.
+    - min_windows (int): Windows before the interval is checked.
+    - max_tokens (int): Stop after scoring this many tokens, the whole text when None.
+    - confidence (float): Confidence level of the interval.
+
+    Returns:
+    - dict: Perplexity, its CI half-width and how much text was scored.
+    """
+    start = time.perf_counter()
+    nll_sum = 0.0
+    n_scored = 0
+    window_nll = []
+    half_width = float('nan')
+    converged = False
+    for begin, end, n_context in windows(len(tokens), n_ctx, stride):
+        window = np.array(tokens[begin:end], dtype=np.int64)
+        if bos is not None:
+            window[0] = bos
+        nll = score(window, n_context)
+        nll_sum += float(nll.sum())
+        n_scored += len(nll)
+        window_nll.append(float(nll.mean()))
+        # CI of the mean log-likelihood, the windows score disjoint tokens
+        half_width = ci_half_width(window_nll, confidence)
+        if len(window_nll) >= min_windows and math.expm1(half_width) <= rel_ci:
+            converged = True
+            break
+        if max_tokens is not None and n_scored >= max_tokens:
+            break
+    perplexity = math.exp(nll_sum / n_scored)
+    return {
+        "Perplexity": perplexity,
+        # exp(mean +/- half_width) is not symmetric, half of its width
+        "Perplexity CI": perplexity * math.sinh(half_width),
+        "PPL Tokens": n_scored,
+        "PPL Windows": len(window_nll),
+        "PPL Converged": converged,
+        "PPL Time (s)": time.perf_counter() - start,
+        "PPL Context": n_ctx,
+        "PPL Stride": stride,
+    }
@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from measurement import StoppingRule, measure
+from sample_store import Series, replica_series
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+# context: the prefix is still in the KV cache of the model, like consecutive requests on a server
+# ram, disk: the state after the prefix is saved in a LlamaRAMCache / LlamaDiskCache and restored
+CACHE_BACKENDS = ('context', 'ram', 'disk')
+
+HIT_LATENCY = "Hit Latency (s)"
+
+
+def make_cache(backend: str, capacity_bytes: int, cache_dir: str):
+    from llama_cpp import LlamaDiskCache, LlamaRAMCache
+    if backend == 'ram':
+        return LlamaRAMCache(capacity_bytes=capacity_bytes)
+    try:
+        return LlamaDiskCache(cache_dir=cache_dir, capacity_bytes=capacity_bytes)
+    except ImportError as e:
+        raise ImportError("The disk prompt cache needs diskcache, install it with `pip install diskcache`.") from e
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def evict_page_cache(path: str):
+    """Drop the files of a directory from the page cache, so reading them back hits the disk."""
+    for root, _, names in os.walk(path):
+        for name in names:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def timed_eval(model: 'Llama', tokens: Sequence[int]) -> float:
+    """Prefill tokens after the ones already in the context, in seconds."""
+    start = time.perf_counter()
+    model.eval(tokens)
+    return time.perf_counter() - start
+
+
+def benchmark_prompt_cache(model: 'Llama',
+                           n_vocab: int,
+                           prompt_length: int,
+                           prefix_length: int,
+                           backend: str,
+                           rule: StoppingRule,
+                           capacity_bytes: int = 2 << 30,
+                           cache_dir: str | None = None) -> Tuple[Dict[str, Any], List[Series]]:
+    """
+    Measure how much prefill a cached prefix saves.
+
+    Every replica prefills a prompt made of a shared prefix and a fresh suffix three times:
+    from scratch (miss), the prefix alone (what a hit avoids recomputing), and after restoring
+    the prefix from the backend (hit). Disk cache files are evicted from the page cache before
+    they are read back, the load time is the one of a cold read.
+
+    Parameters:
+    - model (Llama): Loaded model, its context must hold prompt_length tokens.
+    - n_vocab (int): Vocabulary size, the prompts are random tokens.
+    - prompt_length (int): Tokens of the whole prompt.
+    - prefix_length (int): Tokens shared with the cached prompt.
+    - backend (str): One of CACHE_BACKENDS.
+    - rule (StoppingRule): Replicas, stopping on the hit latency.
+    - capacity_bytes (int): Capacity of the RAM or disk cache.
+    - cache_dir (str): Parent directory of the disk cache, the system temp directory when None.
+
+    Returns:
+    - tuple: Diagnostics of the experiment and the per-replica samples.
+    """
+    prefix = np.random.randint(1, n_vocab, size=prefix_length).tolist()
+
+    def replica() -> Dict[str, float]:
+        prompt = prefix + np.random.randint(1, n_vocab, size=prompt_length - prefix_length).tolist()
+
+        model.reset()
+        miss_s = timed_eval(model, prompt)
+        model.reset()
+        recompute_s = timed_eval(model, prefix)
+
+        save_s = load_s = 0.0
+        cache_bytes = 0
+        if backend == 'context':
+            # keep the prefix in the KV cache and evaluate the rest, as Llama.generate does
+            start = time.perf_counter()
+            model.n_tokens = prefix_length
+            model.eval(prompt[prefix_length:])
+            hit_s = time.perf_counter() - start
+        else:
+            directory = tempfile.mkdtemp(prefix='lighthouse-prompt-cache-', dir=cache_dir)
+            try:
+                cache = make_cache(backend, capacity_bytes, directory)
+                start = time.perf_counter()
+                cache[prefix] = model.save_state()
+                save_s = time.perf_counter() - start
+                if prefix not in cache:
+                    raise ValueError(f"The state of {prefix_length} tokens does not fit in the "
+                                     f"{capacity_bytes / 1024 ** 3:.2f} GB {backend} cache, raise its capacity.")
+                if backend == 'disk':
+                    cache_bytes = directory_size(directory)
+                    evict_page_cache(directory)
+                else:
+                    cache_bytes = cache.cache_size
+
+                model.reset()
+                start = time.perf_counter()
+                model.load_state(cache[prompt])
+                load_s = time.perf_counter() - start
+                model.eval(prompt[model.n_tokens:])
+                hit_s = time.perf_counter() - start
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+        model.reset()
+
+        return {
+            "Miss Latency (s)": miss_s,
+            HIT_LATENCY: hit_s,
+            "Recompute Time (s)": recompute_s,
+            "Cache Save Time (s)": save_s,
+            "Cache Load Time (s)": load_s,
+            "Saved Prefill (s)": miss_s - hit_s,
+            "Prefix Speedup": miss_s / hit_s,
+            "Cache Size (MB)": cache_bytes / 1e6,
+        }
+
+    measurement = measure(replica, HIT_LATENCY, rule)
+    diagnostics = measurement.summary(rule)
+    diagnostics.update(cache_payoff(backend,
+                                    diagnostics["Cache Save Time (s)"],
+                                    diagnostics["Cache Load Time (s)"],
+                                    diagnostics["Recompute Time (s)"]))
+    return diagnostics, replica_series(measurement.samples)
+
+
+def cache_payoff(backend: str, save_s: float, load_s: float, recompute_s: float) -> Dict[str, Any]:
+    """
+    Whether saving and restoring the prefix beats computing it again.
+
+    The context backend neither saves nor loads anything, there is nothing to weigh and both
+    fields are left empty. Otherwise the cache pays off when saving the prefix once and
+    restoring it once is faster than recomputing it, and every further hit saves
+    recompute - load, which repays the save after `Break-even Hits` hits.
+    """
+    if backend == 'context':
+        return {"Cache Pays Off": None, "Break-even Hits": np.nan}
+    gain_s = recompute_s - load_s
+    return {
+        "Cache Pays Off": bool(save_s + load_s < recompute_s),
+        "Break-even Hits": math.ceil(save_s / gain_s) if gain_s > 0 else np.nan,
+    }
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import argparse
+import threading
+import importlib.util
+from dataclasses import asdict, dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import numpy as np
+
+from gguf_reader import GGUFFile
+from hardware import CACHE_PATH, HardwareProfile, hardware_profile
+from offload_planner import kv_bytes_per_layer
+
+ROOFLINE_PATH = os.path.join(os.path.dirname(CACHE_PATH), "roofline.json")
+
+STREAM_BYTES = 256 * 1024 * 1024   # per array, well above the last level cache
+GEMM_SIZE = 2048
+REPEATS = 5
+
+
+@dataclass
+class HostCeilings:
+    """Peak memory bandwidth and matrix multiplication speed of a host, measured once."""
+    copy_gbs: float
+    triad_gbs: float
+    gemm_gflops: float                    # fp32, quantized kernels with int8 dot products can go beyond it
+    gpu_bandwidth_gbs: float | None = None
+    gpu_gemm_gflops: float | None = None  # fp16
+
+    def bandwidth(self, gpu_fraction: float) -> float:
+        """Ceiling of a read split between host and GPU memory, each side streams its own share."""
+        return self._split(gpu_fraction, self.triad_gbs, self.gpu_bandwidth_gbs)
+
+    def flops(self, gpu_fraction: float) -> float:
+        return self._split(gpu_fraction, self.gemm_gflops, self.gpu_gemm_gflops)
+
+    @staticmethod
+    def _split(gpu_fraction: float, cpu: float, gpu: float | None) -> float:
+        if gpu_fraction <= 0:
+            return cpu
+        if gpu is None:
+            return np.nan
+        return 1 / (gpu_fraction / gpu + (1 - gpu_fraction) / cpu)
+
+
+def _threaded(n_threads: int, n: int, kernel):
+    """Run kernel(start, stop) on n_threads slices of range(n) at once, numpy releases the GIL in them."""
+    bounds = np.linspace(0, n, n_threads + 1).astype(int)
+    barrier = threading.Barrier(n_threads)
+
+    def work(i):
+        barrier.wait()
+        kernel(bounds[i], bounds[i + 1])
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(work, range(n_threads)))
+        return time.perf_counter() - start
+
+
+def stream_bandwidth(n_bytes: int = STREAM_BYTES,
+                     n_threads: int | None = None,
+                     repeats: int = REPEATS) -> Dict[str, float]:
+    """
+    STREAM copy and triad bandwidth in GB/s, the best of `repeats`.
+
+    Bytes are counted as STREAM does (copy moves 2 arrays, triad 3). The triad runs as two
+    numpy passes, so it moves more than it is credited with and stays a lower bound.
+    """
+    n_threads = n_threads or len(os.sched_getaffinity(0))
+    n = n_bytes // 8
+    a = np.zeros(n)
+    b = np.ones(n)
+    c = np.full(n, 2.0)
+
+    def copy(start, stop):
+        np.copyto(a[start:stop], b[start:stop])
+
+    def triad(start, stop):
+        np.multiply(c[start:stop], 3.0, out=a[start:stop])
+        np.add(a[start:stop], b[start:stop], out=a[start:stop])
+
+    copy_s = min(_threaded(n_threads, n, copy) for _ in range(repeats))
+    triad_s = min(_threaded(n_threads, n, triad) for _ in range(repeats))
+    return {"copy_gbs": 2 * n * 8 / copy_s / 1e9, "triad_gbs": 3 * n * 8 / triad_s / 1e9}
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def gemm_gflops(size: int = GEMM_SIZE, repeats: int = REPEATS) -> float:
+    """fp32 matrix multiplication through the BLAS numpy is linked to, multi-threaded by it."""
+    rng = np.random.default_rng(101)
+    a = rng.standard_normal((size, size), dtype=np.float32)
+    b = rng.standard_normal((size, size), dtype=np.float32)
+    a @ b
+    best = min(_timed(lambda: a @ b) for _ in range(repeats))
+    return 2 * size ** 3 / best / 1e9
+
+
+def gpu_ceilings(n_bytes: int = STREAM_BYTES, size: int = 8192, repeats: int = REPEATS) -> Dict[str, float] | None:
+    """Device copy bandwidth and fp16 GEMM speed with torch, None without torch or a CUDA device."""
+    if importlib.util.find_spec('torch') is None:
+        return None
+    import torch
+    if not torch.cuda.is_available():
+        return None
+
+    def best(fn) -> float:
+        fn()
+        times = []
+        for _ in range(repeats):
+            start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+            start.record()
+            fn()
+            end.record()
+            torch.cuda.synchronize()
+            times.append(start.elapsed_time(end) / 1000)
+        return min(times)
+
+    src = torch.ones(n_bytes // 2, dtype=torch.float16, device='cuda')
+    dst = torch.empty_like(src)
+    copy_s = best(lambda: dst.copy_(src))
+    del src, dst
+    a = torch.randn(size, size, dtype=torch.float16, device='cuda')
+    b = torch.randn(size, size, dtype=torch.float16, device='cuda')
+    gemm_s = best(lambda: a @ b)
+    return {"gpu_bandwidth_gbs": 2 * n_bytes / copy_s / 1e9, "gpu_gemm_gflops": 2 * size ** 3 / gemm_s / 1e9}
+
+
+def host_ceilings(profile: HardwareProfile | None = None,
+                  cache_path: str = ROOFLINE_PATH,
+                  gpu: bool = False,
+                  force: bool = False) -> HostCeilings:
+    """
+    Ceilings of this host, measured on the first call and cached per Hardware ID.
+
+    Parameters:
+    - profile (HardwareProfile): Profile of the host, hardware_profile() when None.
+    - cache_path (str): JSON file mapping Hardware IDs to their ceilings.
+    - gpu (bool): The GPU ceilings are needed, they are added to a cached entry that misses them.
+    - force (bool): Measure again.
+
+    Returns:
+    - HostCeilings: CPU bandwidth and GEMM speed, and the GPU ones when torch can reach a GPU.
+    """
+    profile = profile or hardware_profile()
+    cached = {}
+    ceilings = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if not force and profile.hardware_id in cached:
+                ceilings = HostCeilings(**cached[profile.hardware_id])
+        except (OSError, ValueError, TypeError):
+            cached = {}
+
+    if ceilings is None:
+        print("Measuring the memory bandwidth and GEMM ceilings of this host...")
+        ceilings = HostCeilings(**stream_bandwidth(), gemm_gflops=gemm_gflops(), **(gpu_ceilings() or {}))
+    elif gpu and ceilings.gpu_bandwidth_gbs is None:
+        # cached by a run without torch
+        measured = gpu_ceilings()
+        if measured is None:
+            return ceilings
+        ceilings = HostCeilings(**{**asdict(ceilings), **measured})
+    else:
+        return ceilings
+    cached[profile.hardware_id] = asdict(ceilings)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return ceilings
+
+
+@dataclass
+class ModelCost:
+    """What a model reads and computes per token."""
+    weight_bytes: float         # read once per decode step, whatever the number of sequences
+    flops_per_token: float      # 2 per weight (one multiply-add), attention excluded
+    kv_bytes_per_token: float   # K and V of one context position, all layers
+    gpu_fraction: float = 0.0   # share of weight_bytes held by the GPU
+
+
+def gguf_cost(gguf: GGUFFile, n_gpu_layers: int = 0) -> ModelCost | None:
+    """
+    Cost of a GGUF model, n_gpu_layers as passed to llama.cpp.
+
+    A token only reads its row of the embedding table, which is then left out,
+    unless the model has no output tensor and reuses it as one.
+    None when a tensor type is unknown to gguf_reader, its size is then unknown.
+    """
+    if not gguf.sizes_known:
+        return None
+    tied = gguf.tensor('output.weight') is None
+    read = [t for t in gguf.tensors if tied or t.name != 'token_embd.weight']
+    weight_bytes = sum(t.n_bytes for t in read)
+    # llama.cpp offloads the last blocks first, the output layer once every block is on the GPU
+    first_gpu_block = gguf.block_count - min(n_gpu_layers, gguf.block_count)
+    gpu_bytes = sum(t.n_bytes for t in read
+                    if (t.layer is not None and t.layer >= first_gpu_block)
+                    or (t.layer is None and n_gpu_layers > gguf.block_count and t.name != 'token_embd.weight'))
+    return ModelCost(weight_bytes=weight_bytes,
+                     flops_per_token=2 * sum(t.n_elements for t in read),
+                     kv_bytes_per_token=kv_bytes_per_layer(gguf, 1) * gguf.block_count,
+                     gpu_fraction=gpu_bytes / weight_bytes)
+
+
+def hf_cost(model) -> ModelCost:
+    """Cost of a transformers model on the GPU, weights counted as stored (GPTQ keeps them in buffers)."""
+    config = model.config
+    tensors = list(model.parameters()) + list(model.buffers())
+    stored = sum(t.numel() * t.element_size() for t in tensors)
+    embedding = model.get_input_embeddings().weight
+    tied = model.get_output_embeddings() is not None and model.get_output_embeddings().weight is embedding
+    weight_bytes = stored - (0 if tied else embedding.numel() * embedding.element_size())
+
+    d = config.hidden_size
+    n_head = config.num_attention_heads
+    n_head_kv = getattr(config, 'num_key_value_heads', None) or n_head
+    head_dim = d // n_head
+    # logical weights of the matmuls, packed quantized tensors do not tell their element count
+    attention = 2 * d * d + 2 * d * n_head_kv * head_dim
+    mlp = 3 * d * config.intermediate_size
+    n_weights = config.num_hidden_layers * (attention + mlp) + d * config.vocab_size
+    return ModelCost(weight_bytes=weight_bytes,
+                     flops_per_token=2 * n_weights,
+                     kv_bytes_per_token=2 * config.num_hidden_layers * n_head_kv * head_dim * 2,
+                     gpu_fraction=1.0)
+
+
+def roofline_metrics(cost: ModelCost | None,
+                     ceilings: HostCeilings,
+                     prefill_tps: float,
+                     decode_tps: float,
+                     context: float,
+                     n_sequences: int = 1) -> Dict[str, float]:
+    """
+    Achieved bandwidth and FLOP/s of a run, and how close they are to the ceilings.
+
+    Parameters:
+    - cost (ModelCost): Bytes and FLOPs of the model per token, the metrics are NaN when None.
+    - ceilings (HostCeilings): Ceilings of the host.
+    - prefill_tps (float): Prompt tokens per second, all sequences.
+    - decode_tps (float): Generated tokens per second, all sequences.
+    - context (float): Mean context length during the decode, whose KV every token reads.
+    - n_sequences (int): Sequences decoded together, a step reads the weights once for all of them.
+
+    Returns:
+    - dict: Decode bandwidth (GB/s), prefill GFLOP/s and their % of the roofline.
+    """
+    if cost is None:
+        return {"Decode Bandwidth (GB/s)": np.nan, "Prefill GFLOP/s": np.nan,
+                "Bandwidth Roofline (%)": np.nan, "Compute Roofline (%)": np.nan}
+    bytes_per_step = cost.weight_bytes + n_sequences * context * cost.kv_bytes_per_token
+    bandwidth = bytes_per_step * decode_tps / n_sequences / 1e9
+    gflops = cost.flops_per_token * prefill_tps / 1e9
+    return {
+        "Decode Bandwidth (GB/s)": bandwidth,
+        "Prefill GFLOP/s": gflops,
+        "Bandwidth Roofline (%)": 100 * bandwidth / ceilings.bandwidth(cost.gpu_fraction),
+        "Compute Roofline (%)": 100 * gflops / ceilings.flops(cost.gpu_fraction),
+    }
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='Roofline',
+        description='Measure the memory bandwidth and GEMM ceilings of this host.',
+    )
+    parser.add_argument('--force', action='store_true', default=False, help="Measure again instead of reading the cache.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    for key, value in asdict(host_ceilings(force=args.force)).items():
+        print(f"{key}: {value if value is None else round(value, 1)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import os
+import re
+import fcntl
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from bulb_store import BulbStore
+
+SAMPLES_TABLE = 'samples'
+
+# memory timeline series, one value per sample of the MemorySampler
+MEMORY_TIME = "Memory Time (s)"
+MEMORY_PREFIX = "Memory "
+
+
+@dataclass
+class Series:
+    """Raw samples of one experiment, e.g. the token arrival times of a replica."""
+    name: str
+    values: np.ndarray
+    replica: int | None = None   # None for series spanning the replicas
+
+
+def series_file(name: str, dtype: np.dtype) -> str:
+    """File holding every sample of a series, the dtype is part of the name so a file never mixes types."""
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_').lower()
+    return f"{slug}.{dtype.kind}{dtype.itemsize}"
+
+
+def replica_series(samples: Dict[str, List[float]]) -> List[Series]:
+    """The per-replica values of a Measurement, one series per metric."""
+    return [Series(name=f"Replica {key}", values=np.asarray(values, dtype=np.float64))
+            for key, values in samples.items()]
+
+
+def token_series(start_ns: int, token_ns: Sequence[int], replica: int) -> Series:
+    """Arrival time of every generated token of a replica, in ms since the request."""
+    return Series(name="Token Time (ms)",
+                  values=(np.asarray(token_ns, dtype=np.int64) - start_ns) / 1e6,
+                  replica=replica)
+
+
+def memory_series(timeline: List[Tuple[float, Dict[str, float]]]) -> List[Series]:
+    """Split a MemoryTracker timeline into one series per backend reading, plus the sample times."""
+    if not timeline:
+        return []
+    keys = sorted({key for _, sample in timeline for key in sample})
+    series = [Series(name=MEMORY_TIME, values=np.array([t for t, _ in timeline], dtype=np.float64))]
+    for key in keys:
+        series.append(Series(name=MEMORY_PREFIX + key,
+                             values=np.array([sample.get(key, np.nan) for _, sample in timeline], dtype=np.float64)))
+    return series
+
+
+class SampleStore:
+    """
+    Raw samples next to the bulb, as append-only binary files of one dtype per series.
+
+    The bulb only keeps an index (`samples` table) mapping every experiment id and series
+    to an offset and a length in the file of the series, the analysis memory-maps the files
+    and slices them without loading anything else. Appends take an exclusive flock on the
+    file, so several benchmark processes can share a store; the index row is committed
+    after the samples are on disk, a crash in between only leaves unreferenced bytes.
+    """
+    def __init__(self, store: BulbStore, root: str | None = None):
+        self.store = store
+        self.root = root if root is not None else os.path.splitext(store.path)[0] + '.samples'
+        self._maps: Dict[str, np.memmap] = {}
+        with store.transaction() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {SAMPLES_TABLE} "
+                         f"(id TEXT, Series TEXT, Replica INTEGER, File TEXT, Offset INTEGER, Length INTEGER)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS samples_id_idx ON {SAMPLES_TABLE} (id)")
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.root, filename)
+
+    def _write(self, filename: str, values: np.ndarray) -> int:
+        """Append values to a series file, returns their offset in elements."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.path(filename), 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END) // values.itemsize
+                f.write(np.ascontiguousarray(values).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return offset
+
+    def append(self, experiment_id: str, series: List[Series]) -> int:
+        """
+        Store the series of one experiment.
+
+        Parameters:
+        - experiment_id (str): The id of the experiment row they belong to.
+        - series (list): Series to store, empty ones are skipped.
+
+        Returns:
+        - int: Number of series stored.
+        """
+        rows = []
+        for s in series:
+            values = np.asarray(s.values)
+            if values.size == 0:
+                continue
+            filename = series_file(s.name, values.dtype)
+            rows.append({
+                "id": experiment_id,
+                "Series": s.name,
+                "Replica": s.replica,
+                "File": filename,
+                "Offset": self._write(filename, values.ravel()),
+                "Length": int(values.size),
+            })
+        return self.store.append_many(rows, table=SAMPLES_TABLE)
+
+    def index(self, where: Dict[str, Any] | None = None) -> DataFrame:
+        """Index rows, e.g. where={"id": ...} or where={"Series": "Token Time (ms)"}."""
+        return self.store.read(columns=["id", "Series", "Replica", "File", "Offset", "Length"],
+                               where=where, table=SAMPLES_TABLE)
+
+    def open(self, filename: str) -> np.ndarray:
+        """Whole series file, memory-mapped. Reopened when it grew since it was mapped."""
+        path = self.path(filename)
+        dtype = np.dtype(filename.rsplit('.', 1)[1])
+        n = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        mapped = self._maps.get(filename)
+        if mapped is None or len(mapped) != n:
+            mapped = self._maps[filename] = np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+        return mapped
+
+    def read(self, experiment_id: str, series: str, replica: int | None = None) -> List[np.ndarray]:
+        """
+        Samples of one series of an experiment, as memory-mapped views.
+
+        Parameters:
+        - experiment_id (str): The id of the experiment row.
+        - series (str): Name of the series, e.g. "Token Time (ms)".
+        - replica (int): Only this replica, every stored chunk when None.
+
+        Returns:
+        - list: One array per stored chunk (one per replica for per-replica series).
+        """
+        where = {"id": experiment_id, "Series": series}
+        if replica is not None:
+            where["Replica"] = replica
+        index = self.index(where)
+        return [self.open(row["File"])[int(row["Offset"]):int(row["Offset"]) + int(row["Length"])]
+                for row in index.to_dict('records')]
@@ -0,0 +1,222 @@
+import time
+import random
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from measurement import StoppingRule, measure
+from sample_store import Series, replica_series
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+# lookup proposes n-grams of the context, it pays on prompts that repeat themselves
+PROMPT_KINDS = ('code', 'repeat', 'random')
+
+WORDS = ('order', 'price', 'user', 'item', 'total', 'count', 'name', 'value', 'index', 'record',
+         'status', 'amount', 'result', 'buffer', 'token', 'score', 'weight', 'limit', 'offset', 'batch')
+
+DECODE_TPS = "Decode Time (tk/s)"
+LATENCY = "Latency (s)"
+
+
+def code_snippet(rng: random.Random) -> str:
+    """A small function in the shape most code is written in, names change but the structure repeats."""
+    a, b, c = rng.sample(WORDS, 3)
+    return (f"def filter_{a}_by_{b}(items, min_{b}):\n"
+            f"    result = []\n"
+            f"    for item in items:\n"
+            f"        if item.{b} >= min_{b} and item.{c} is not None:\n"
+            f"            result.append(item.{a})\n"
+            f"    return result\n\n\n")
+
+
+def speculation_text(kind: str, rng: random.Random) -> Callable[[], str]:
+    """Generator of text chunks of a prompt kind."""
+    if kind == 'code':
+        return lambda: code_snippet(rng)
+    if kind == 'repeat':
+        # a handful of sentences coming back over and over, like a chat history or a templated document
+        pool = [f"The {a} of the {b} is checked against the {c} before the {a} is stored."
+                for a, b, c in (rng.sample(WORDS, 3) for _ in range(8))]
+        return lambda: rng.choice(pool) + ' '
+    raise ValueError(f"Unknown prompt kind {kind}, expected one of {PROMPT_KINDS}.")
+
+
+def speculation_prompt(kind: str,
+                       prompt_length: int,
+                       tokenize: Callable[[str], List[int]],
+                       n_vocab: int,
+                       seed: int = 101) -> List[int]:
+    """
+    Prompt of exactly prompt_length tokens.
+
+    Parameters:
+    - kind (str): 'code' and 'repeat' are text where lookup finds continuations, 'random' tokens never repeat.
+    - prompt_length (int): Number of tokens.
+    - tokenize (callable): Text to token ids of the benchmarked model.
+    - n_vocab (int): Vocabulary size, for random prompts.
+    - seed (int): Seed of the text.
+
+    Returns:
+    - list: Token ids.
+    """
+    rng = random.Random(seed)
+    if kind == 'random':
+        return [rng.randrange(1, n_vocab) for _ in range(prompt_length)]
+    chunk = speculation_text(kind, rng)
+    text = ''
+    tokens = []
+    while len(tokens) < prompt_length:
+        text += ''.join(chunk() for _ in range(8))
+        tokens = tokenize(text)
+    return tokens[:prompt_length]
+
+
+class CountingDraft:
+    """Draft model wrapper keeping every proposal, where it starts in the sequence and the time spent drafting."""
+    def __init__(self, draft):
+        self.draft = draft
+        self.proposals: List[Tuple[int, List[int]]] = []
+        self.seconds = 0.0
+
+    def reset(self):
+        self.proposals = []
+        self.seconds = 0.0
+
+    def __call__(self, input_ids, **kwargs):
+        start = time.perf_counter()
+        draft = self.draft(input_ids, **kwargs)
+        self.seconds += time.perf_counter() - start
+        self.proposals.append((len(input_ids), np.asarray(draft).astype(int).tolist()))
+        return draft
+
+
+def gguf_lookup_missing() -> str | None:
+    """Why the installed llama-cpp-python cannot draft with prompt lookup, None when it can."""
+    try:
+        import llama_cpp.llama_speculative  # noqa: F401
+    except ImportError:
+        import llama_cpp
+        return (f"Prompt lookup decoding needs a llama-cpp-python with draft model support "
+                f"(llama_cpp.llama_speculative, 0.2.34 or newer), {llama_cpp.__version__} is installed: "
+                f"pip install -U llama-cpp-python")
+    return None
+
+
+def hf_lookup_missing() -> str | None:
+    """
+    Why the installed transformers cannot draft with prompt lookup, None when it can.
+
+    Before 4.37 generate() takes prompt_lookup_num_tokens without complaint and decodes
+    without speculation, the run would be stored as prompt lookup.
+    """
+    try:
+        from transformers.generation.candidate_generator import PromptLookupCandidateGenerator  # noqa: F401
+    except ImportError:
+        import transformers
+        return (f"Prompt lookup decoding needs transformers 4.37 or newer, {transformers.__version__} is installed: "
+                f"pip install -U transformers")
+    return None
+
+
+def prompt_lookup_draft(num_pred_tokens: int) -> CountingDraft:
+    missing = gguf_lookup_missing()
+    if missing is not None:
+        raise ImportError(missing)
+    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+    return CountingDraft(LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens))
+
+
+def acceptance(sequence: Sequence[int], proposals: List[Tuple[int, List[int]]]) -> Tuple[int, int]:
+    """
+    Proposed and accepted draft tokens of a greedy generation.
+
+    With greedy sampling a drafted token is accepted when it is the token the model produced
+    at its position, and the drafts after the first mismatch are thrown away.
+    """
+    proposed = accepted = 0
+    for position, draft in proposals:
+        target = sequence[position:position + len(draft)]
+        proposed += len(target)
+        for drafted, produced in zip(draft, target):
+            if drafted != produced:
+                break
+            accepted += 1
+    return proposed, accepted
+
+
+def decode_metrics(start_ns: int, token_ns: Sequence[int], new_tokens: int) -> Dict[str, float]:
+    """TTFT, effective decode speed after the first token and latency, from token arrival times."""
+    decode_s = (token_ns[-1] - token_ns[0]) / 1e9
+    return {
+        "TTFT (s)": (token_ns[0] - start_ns) / 1e9,
+        DECODE_TPS: (new_tokens - 1) / decode_s if decode_s > 0 else np.nan,
+        LATENCY: (token_ns[-1] - start_ns) / 1e9,
+    }
+
+
+def compare_to_baseline(diagnostics: Dict[str, Any], baseline: Dict[str, Any] | None) -> Dict[str, float]:
+    """Speedup and latency overhead against the same prompt decoded without speculation."""
+    if baseline is None:
+        return {"Speedup": np.nan, "Latency Overhead (%)": np.nan}
+    return {
+        "Speedup": diagnostics[DECODE_TPS] / baseline[DECODE_TPS],
+        "Latency Overhead (%)": (diagnostics[LATENCY] / baseline[LATENCY] - 1) * 100,
+    }
+
+
+def benchmark_speculative_gguf(model: 'Llama',
+                               prompt: List[int],
+                               new_tokens: int,
+                               draft_tokens: int,
+                               rule: StoppingRule) -> Tuple[Dict[str, Any], List[Series]]:
+    """
+    Greedy decoding with prompt lookup drafting `draft_tokens` tokens per step, without any when 0.
+
+    The model must be loaded with logits_all=True: the draft is verified in one evaluation
+    and every drafted position is sampled. The draft model is swapped on the loaded
+    model, so the baseline and every draft length share it.
+
+    Returns:
+    - tuple: Diagnostics of the experiment and the per-replica samples.
+    """
+    from llama_cpp import LogitsProcessorList
+
+    def suppress_eos(input_ids, scores):
+        scores[model._token_eos] = -np.inf
+        return scores
+
+    draft = prompt_lookup_draft(draft_tokens) if draft_tokens > 0 else None
+    model.draft_model = draft
+
+    def replica() -> Dict[str, float]:
+        model.reset()
+        if draft is not None:
+            draft.reset()
+        generated = []
+        token_ns = []
+        start_ns = time.perf_counter_ns()
+        for token in model.generate(prompt, temp=0, logits_processor=LogitsProcessorList([suppress_eos])):
+            token_ns.append(time.perf_counter_ns())
+            generated.append(token)
+            if len(generated) >= new_tokens:
+                break
+        metrics = decode_metrics(start_ns, token_ns, new_tokens)
+        if draft is not None:
+            proposed, accepted = acceptance(prompt + generated, draft.proposals)
+            metrics.update({
+                "Draft Time (s)": draft.seconds,
+                "Proposed Tokens": proposed,
+                "Accepted Tokens": accepted,
+                "Acceptance Rate": accepted / proposed if proposed else np.nan,
+                "Mean Accepted Length": accepted / len(draft.proposals) if draft.proposals else np.nan,
+            })
+        return metrics
+
+    try:
+        measurement = measure(replica, DECODE_TPS, rule)
+    finally:
+        model.draft_model = None
+        model.reset()
+    return measurement.summary(rule), replica_series(measurement.samples)
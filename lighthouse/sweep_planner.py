@@ -0,0 +1,200 @@
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# a change in any of these needs a new Llama instance
+LOAD_PARAMS = ("Decode Threads", "Prefill Threads", "Batch Size", "GPU Layers", "NUMA", "Context Length")
+
+LOAD_TIME = "Load Time (s)"
+PREFILL_TPS = "Prefill Time (tk/s)"
+DECODE_TPS = "Decode Time (tk/s)"
+
+# used until the bulb holds a measurement of the model
+DEFAULT_COSTS = {LOAD_TIME: 10.0, PREFILL_TPS: 100.0, DECODE_TPS: 10.0}
+
+HISTORY_COLUMNS = [LOAD_TIME, PREFILL_TPS, DECODE_TPS, "Decode Threads", "Prefill Threads", "Batch Size", "GPU Layers"]
+
+ORDERS = ('product', 'shortest', 'information')
+
+
+def load_key(params: Dict[str, Any]) -> Tuple:
+    return tuple(params.get(p) for p in LOAD_PARAMS)
+
+
+def features(threads: float, batch: float, ngl: float) -> List[float]:
+    return [1.0, math.log(max(threads, 1)), math.log(max(batch, 1)), ngl]
+
+
+class CostModel:
+    """
+    Predict load time, prefill and decode speed of a configuration from earlier runs.
+
+    Speeds are fitted in log space, log(tk/s) ~ log(threads) + log(batch) + ngl, which
+    follows the sub-linear scaling with threads and the exponential gain of offloading
+    well enough to schedule a sweep. With too few runs the median of the model is used.
+    """
+    def __init__(self, history: pd.DataFrame):
+        self.history = history.dropna(subset=[DECODE_TPS, PREFILL_TPS]).reset_index(drop=True)
+        self.history = self.history[(self.history[DECODE_TPS] > 0) & (self.history[PREFILL_TPS] > 0)]
+        self.coefficients = {}
+        if self.history.empty:
+            return
+        for target, threads in ((DECODE_TPS, "Decode Threads"), (PREFILL_TPS, "Prefill Threads")):
+            X = np.array([features(t, b, g) for t, b, g in zip(self.history[threads].fillna(1),
+                                                                 self.history["Batch Size"].fillna(512),
+                                                                 self.history["GPU Layers"].fillna(0))])
+            y = np.log(self.history[target].to_numpy(dtype=np.float64))
+            if len(y) > 2 * X.shape[1]:
+                self.coefficients[target] = np.linalg.lstsq(X, y, rcond=None)[0]
+            else:
+                self.coefficients[target] = np.array([np.median(y), 0, 0, 0])
+        loads = self.history[LOAD_TIME].dropna()
+        self.load_s = float(loads.median()) if len(loads) else DEFAULT_COSTS[LOAD_TIME]
+
+    @classmethod
+    def from_store(cls, store, model: str, hardware_id: str | None = None) -> 'CostModel':
+        """Runs of the model on this machine, on any machine when there are none."""
+        history = pd.DataFrame()
+        if hardware_id is not None:
+            history = store.read(columns=HISTORY_COLUMNS, where={"Model": model, "Hardware ID": hardware_id})
+        if history.dropna(subset=[DECODE_TPS]).empty:
+            history = store.read(columns=HISTORY_COLUMNS, where={"Model": model})
+        return cls(history)
+
+    def predict(self, params: Dict[str, Any]) -> Dict[str, float]:
+        if not self.coefficients:
+            return dict(DEFAULT_COSTS)
+        batch = params.get("Batch Size", 512)
+        ngl = params.get("GPU Layers", 0)
+        return {
+            LOAD_TIME: self.load_s,
+            DECODE_TPS: float(np.exp(np.dot(self.coefficients[DECODE_TPS], features(params["Decode Threads"], batch, ngl)))),
+            PREFILL_TPS: float(np.exp(np.dot(self.coefficients[PREFILL_TPS], features(params["Prefill Threads"], batch, ngl)))),
+        }
+
+    def run_seconds(self, params: Dict[str, Any], replica: int) -> float:
+        """Predicted time of the replicas of one combination, NaN when its lengths are not fixed (workloads)."""
+        if "Prompt Length" not in params:
+            return float('nan')
+        costs = self.predict(params)
+        # concurrent sequences (--n-parallel) are counted as if they ran one after the other, an upper bound
+        tokens = params.get("Num. Requests", 1)
+        return replica * tokens * (params["Prompt Length"] / costs[PREFILL_TPS] + params.get("New Tokens", 0) / costs[DECODE_TPS])
+
+    def novelty(self, params: Dict[str, Any]) -> float:
+        """0 for a load configuration already in the bulb, else its distance to the closest one measured."""
+        if self.history.empty:
+            return 1.0
+        x = np.array(features(params["Decode Threads"], params.get("Batch Size", 512), params.get("GPU Layers", 0))[1:])
+        measured = np.array([features(t, b, g)[1:] for t, b, g in zip(self.history["Decode Threads"].fillna(1),
+                                                                       self.history["Batch Size"].fillna(512),
+                                                                       self.history["GPU Layers"].fillna(0))])
+        return float(np.min(np.linalg.norm(measured - x, axis=1)))
+
+
+@dataclass
+class PlannedGroup:
+    """Combinations sharing a loaded model, run back to back."""
+    key: Tuple
+    combinations: List[Dict[str, Any]]
+    load_s: float
+    run_s: List[float]
+    novelty: float = 0.0
+
+    @property
+    def total_s(self) -> float:
+        return self.load_s + sum(self.run_s)
+
+
+@dataclass
+class SweepPlan:
+    groups: List[PlannedGroup]
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def combinations(self) -> List[Dict[str, Any]]:
+        return [params for group in self.groups for params in group.combinations]
+
+    @property
+    def total_s(self) -> float:
+        return sum(group.total_s for group in self.groups)
+
+    def predicted(self) -> List[float]:
+        """Predicted duration of every combination, the first of a group pays for the load."""
+        durations = []
+        for group in self.groups:
+            durations.extend(s + (group.load_s if i == 0 else 0) for i, s in enumerate(group.run_s))
+        return durations
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def eta(self, done: int) -> float:
+        """
+        Seconds left after `done` combinations, the remaining predictions are
+        scaled by how far off the finished ones were.
+        """
+        durations = self.predicted()
+        predicted_done = np.nansum(durations[:done])
+        remaining = np.nansum(durations[done:])
+        elapsed = time.perf_counter() - self.started
+        if predicted_done > 0 and done > 0:
+            remaining *= elapsed / predicted_done
+        return float(remaining)
+
+    def report(self) -> str:
+        lines = [f"{len(self.combinations)} combinations, {len(self.groups)} model loads"]
+        for i, group in enumerate(self.groups):
+            config = ', '.join(f"{k}={v}" for k, v in zip(LOAD_PARAMS, group.key) if v is not None)
+            lines.append(f"{i + 1:>4}. {config}: {len(group.combinations)} runs, {format_seconds(group.total_s)}")
+        lines.append(f"Predicted total: {format_seconds(self.total_s)}")
+        return '\n'.join(lines)
+
+
+def format_seconds(seconds: float) -> str:
+    if math.isnan(seconds):
+        return '?'
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+def plan_sweep(pending: List[Dict[str, Any]],
+               cost_model: CostModel,
+               replica: int,
+               order: str = 'product') -> SweepPlan:
+    """
+    Group the combinations by loaded model and order the groups.
+
+    Parameters:
+    - pending (list): Combinations to run, as returned by check_experiment.
+    - cost_model (CostModel): Predictions of load and run times.
+    - replica (int): Replicas of every combination.
+    - order (str): 'product' keeps the order of the command line, 'shortest' runs the
+      quickest groups first, 'information' the least known configurations per second first.
+
+    Returns:
+    - SweepPlan: The groups to run in order and their predicted time.
+    """
+    groups: Dict[Tuple, PlannedGroup] = {}
+    for params in pending:
+        key = load_key(params)
+        if key not in groups:
+            groups[key] = PlannedGroup(key=key, combinations=[], load_s=cost_model.predict(params)[LOAD_TIME],
+                                       run_s=[], novelty=cost_model.novelty(params))
+        groups[key].combinations.append(params)
+        groups[key].run_s.append(cost_model.run_seconds(params, replica))
+
+    def duration(group: PlannedGroup) -> float:
+        # workloads have no predicted run time, only their load counts
+        return group.load_s if math.isnan(group.total_s) else group.total_s
+
+    ordered = list(groups.values())
+    if order == 'shortest':
+        ordered.sort(key=duration)
+    elif order == 'information':
+        ordered.sort(key=lambda g: g.novelty / max(duration(g), 1e-9), reverse=True)
+    return SweepPlan(groups=ordered)
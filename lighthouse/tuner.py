@@ -0,0 +1,94 @@
+import math
+import time
+import random
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+
+@dataclass
+class Trial:
+    config: Dict[str, Any]
+    rung: int
+    budget: int
+    score: float
+
+
+def thread_candidates(physical_cores: int, values: Sequence[int] | None = None) -> List[int]:
+    """
+    Thread counts worth trying.
+
+    llama.cpp speed grows with threads up to the physical core count and drops
+    past it (hyper-threads share the same FMA units), so larger values are pruned.
+    Without explicit values the powers of two below the core count are used.
+    """
+    if values:
+        candidates = sorted({v for v in values if v <= physical_cores}) or [physical_cores]
+    else:
+        candidates = sorted({2 ** i for i in range(int(math.log2(physical_cores)) + 1)} | {physical_cores})
+    return candidates
+
+
+def successive_halving(candidates: List[Dict[str, Any]],
+                       evaluate: Callable[[Dict[str, Any], int, int], float],
+                       eta: int = 2,
+                       min_budget: int = 1,
+                       max_trials: int | None = None,
+                       time_budget: float | None = None,
+                       seed: int = 101) -> Tuple[Dict[str, Any] | None, List[Trial]]:
+    """
+    Maximise evaluate(config, rung, budget) over the candidates.
+
+    Every rung evaluates the survivors with `eta` times the budget of the previous
+    one and keeps the best 1/eta of them, until one is left.
+
+    Parameters:
+    - candidates (list): Configurations to explore.
+    - evaluate (callable): Runs one configuration and returns the objective (higher is better).
+    - eta (int): Reduction factor between rungs.
+    - min_budget (int): Budget of the first rung, e.g. the number of replicas.
+    - max_trials (int): Maximum number of evaluations, the first rung is subsampled to fit.
+    - time_budget (float): Seconds after which no new evaluation is started.
+    - seed (int): Seed of the subsampling.
+
+    Returns:
+    - tuple: The best configuration of the deepest completed rung and all the trials.
+    """
+    start = time.perf_counter()
+    survivors = list(candidates)
+    if max_trials is not None:
+        # n + n/eta + n/eta^2 + ... <= n * eta / (eta - 1)
+        n_first = max(1, int(max_trials * (eta - 1) / eta))
+        if n_first < len(survivors):
+            survivors = random.Random(seed).sample(survivors, n_first)
+
+    trials: List[Trial] = []
+    best = None
+    rung = 0
+    budget = min_budget
+    while survivors:
+        scored = []
+        for config in survivors:
+            if time_budget is not None and time.perf_counter() - start > time_budget:
+                break
+            if max_trials is not None and len(trials) >= max_trials:
+                break
+            score = evaluate(config, rung, budget)
+            trials.append(Trial(config=config, rung=rung, budget=budget, score=score))
+            scored.append((score, config))
+        if not scored:
+            break
+
+        # failed trials (NaN) rank last
+        scored.sort(key=lambda item: item[0] if not math.isnan(item[0]) else -math.inf, reverse=True)
+        if len(scored) < len(survivors):
+            # out of budget mid-rung, a partial rung only counts when nothing else completed
+            best = best or scored[0][1]
+            break
+        best = scored[0][1]
+        if len(scored) == 1:
+            break
+        survivors = [config for _, config in scored[:max(1, len(scored) // eta)]]
+        rung += 1
+        budget *= eta
+
+    return best, trials
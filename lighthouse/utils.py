@@ -1,80 +1,121 @@
-import os
-import torch
+import re
+import json
+import time
 import psutil
 import random
+import hashlib
 import itertools
-import auto_gptq
-import llama_cpp
 
-import pandas as pd
+from contextlib import contextmanager
+from typing import Any, Dict, List, Tuple
+from hardware import hardware_profile
 
-from pathlib import Path
-from pandas import DataFrame
-from nltk.corpus import wordnet
+WORDNET_FILES = {'n': 'noun', 'a': 'adj'}
 
 def get_wordnet_word(pos):
-    """ Get a list of words for a specific part of speech from WordNet. """
-    synset = random.choice(list(wordnet.all_synsets(pos)))
-    return random.choice(synset.lemmas()).name()
+    """
+    Get a random word for a specific part of speech from WordNet.
+
+    Reads one line at a random offset of the WordNet data file instead of
+    building the ~100k synsets of the corpus reader.
+    """
+    import nltk.data
+    pointer = nltk.data.find(f'corpora/wordnet/data.{WORDNET_FILES[pos]}')
+    size = pointer.file_size()
+    with pointer.open() as f:
+        while True:
+            f.seek(random.randrange(size))
+            f.readline()  # skip the partial line
+            line = f.readline()
+            # the license header lines start with spaces
+            if line and not line.startswith(b' '):
+                break
+    # synset_offset lex_filenum ss_type w_cnt word lex_id [word lex_id ...] ...
+    fields = line.split()
+    words = fields[4:4 + 2 * int(fields[3], 16):2]
+    # adjectives may carry a syntactic marker, e.g. galore(ip)
+    return re.sub(r'\(\w+\)$', '', random.choice(words).decode())
 
 def random_noun_adjective():
-    noun = get_wordnet_word(wordnet.NOUN)
-    adjective = get_wordnet_word(wordnet.ADJ)
+    noun = get_wordnet_word('n')
+    adjective = get_wordnet_word('a')
     return f"{adjective}_{noun}".replace('-', '_').replace('\'', '_')
 
-def initialize_bulb(columns):
+def hardware_identity() -> Dict[str, Any]:
+    """ Hardware fields that identify where an experiment ran, the rest of the profile is in the hardware table. """
+    profile = hardware_profile()
+    return {
+        "Hardware ID": profile.hardware_id,
+        "Device": profile.device,
+        "CPU Count": len(psutil.Process().cpu_affinity()),
+    }
+
+class StepTimer:
+    """ Wall-clock time of the named steps of a script, reported with --profile-startup. """
+    def __init__(self):
+        # interpreter start-up and module imports happen before the first step
+        self.steps: List[Tuple[str, float]] = [("interpreter and imports", time.time() - psutil.Process().create_time())]
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def report(self) -> str:
+        total = sum(seconds for _, seconds in self.steps)
+        width = max(len(name) for name, _ in self.steps)
+        lines = [f"{name:<{width}} {seconds:8.3f} s {100 * seconds / total:5.1f} %" for name, seconds in self.steps]
+        return '\n'.join(["Start-up profile:", *lines, f"{'total':<{width}} {total:8.3f} s"])
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
     """
-    Initialize an empty DataFrame with specified columns.
+    Hash an experiment configuration.
 
     Parameters:
-    - columns (list): A list of strings representing the column names.
+    - config (dict): Hardware, software versions and load/run parameters of one combination.
 
     Returns:
-    - pd.DataFrame: An empty DataFrame with the specified columns.
+    - str: A stable hex digest, equal configurations give equal fingerprints regardless of key order.
     """
-    return pd.DataFrame(columns=columns)
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
 
-def check_experiment(bulb: DataFrame,
+def params_fingerprint(config: Dict[str, Any]) -> str:
+    """Hash of a configuration without the software versions (the *_v columns), equal across upgrades."""
+    return config_fingerprint({k: v for k, v in config.items() if not k.endswith('_v')})
+
+def check_experiment(fingerprints: Dict[str, List[str]],
                      param_combinations: dict,
-                     model_path: Path) -> bool:
-    run_names = []
+                     identity: Dict[str, Any],
+                     force: bool = False) -> List[Dict[str, Any]]:
+    """
+    Select the parameter combinations that still have to be measured.
+
+    Parameters:
+    - fingerprints (dict): Config Hash -> run names already in the bulb (see BulbStore.fingerprints).
+    - param_combinations (dict): Column name -> list of values to sweep.
+    - identity (dict): Fields shared by all combinations (hardware, software versions, model).
+    - force (bool): Keep the combinations that were already measured.
+
+    Returns:
+    - list: One dict per combination to run, with its "Config Hash" and its "Params Hash" (see params_fingerprint).
+    """
+    pending = []
+    run_names = set()
+    n_skipped = 0
     for params_i in itertools.product(*param_combinations.values()):
+        params_d = {k: v for k, v in zip(param_combinations.keys(), params_i)}
+        fingerprint = config_fingerprint({**identity, **params_d})
+        if fingerprint in fingerprints and not force:
+            run_names.update(fingerprints[fingerprint])
+            n_skipped += 1
+            continue
+        pending.append({**params_d, "Config Hash": fingerprint, "Params Hash": params_fingerprint({**identity, **params_d})})
 
-        params_d = {k: v for k, v in zip(param_combinations.keys(), params_i)} 
-
-        # General values to check
-        values_to_check = {
-            "Device": torch.cuda.get_device_name(),
-            "CPU Count": len(psutil.Process().cpu_affinity()),
-            "Model": os.path.basename(model_path),
-            "Prompt Length": params_d["Prompt Length"],
-            "New Tokens": params_d["New Tokens"]
-            }
-        if 'gguf' in model_path.lower():
-            values_to_check.update(
-                {
-                    "llama_cpp_v": llama_cpp.__version__,
-                    "Context Length": params_d["Context Length"],
-                    "Decode Threads": params_d["Decode Threads"],
-                    "Prefill Threads": params_d["Prefill Threads"],
-                    "GPU Layers": params_d["GPU Layers"],
-                }
-            )
-        elif 'gptq' in model_path.lower():
-            values_to_check.update(
-                {
-                    "auto_gptq_v": auto_gptq.__version__,
-                    "Num. Requests": params_d["Num. Requests"],
-                    "Kernel": params_d["Kernel"],
-                }
-            )
-
-        mask = (bulb[list(values_to_check)] == pd.Series(values_to_check)).all(axis=1)
-        if not mask.any():
-            return False
-
-        run_names.extend(bulb[mask]["Run Name"].tolist())
-
-    runs_to_check = '\n- '+'\n- '.join(set(run_names))
-    print(f"Warning: This experiment has already been run. Check:{runs_to_check}\n\nUse the parameter --force to ignore this message.")
-    return True
\ No newline at end of file
+    if n_skipped:
+        runs_to_check = '\n- '+'\n- '.join(sorted(run_names))
+        print(f"Skipping {n_skipped} of {n_skipped + len(pending)} combinations already in the bulb. Check:{runs_to_check}\n\nUse the parameter --force to run them again.")
+    return pending
@@ -0,0 +1,200 @@
+import json
+import math
+import time
+import random
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+import numpy as np
+
+from latency_stats import tpot_percentiles
+
+REQUESTS_TABLE = 'workload_requests'
+# per-request rows are written in chunks, a long replay never holds them all
+FLUSH_EVERY = 1000
+
+# defaults of the parametric workload, see parse_workload
+LOGNORMAL_DEFAULTS = {
+    'n': 1000,
+    'prompt': 256,          # median prompt length
+    'prompt_sigma': 0.8,
+    'output': 128,          # median output length
+    'output_sigma': 0.6,
+    'prefix_ratio': 0.0,    # share of requests starting with a shared prefix
+    'prefix': 128,          # length of the shared prefixes
+    'prefixes': 4,          # number of distinct shared prefixes
+    'max_prompt': 4096,
+    'max_output': 1024,
+    'seed': 101,
+}
+
+
+@dataclass
+class WorkloadRequest:
+    prompt_length: int
+    new_tokens: int
+    prefix_id: int | None = None
+    prefix_length: int = 0
+    tokens: List[int] | None = None  # explicit prompt tokens from a trace
+
+    def prompt_tokens(self, n_vocab: int, rng: random.Random) -> List[int]:
+        """Prompt ids: the shared prefix is the same for every request with this prefix_id."""
+        if self.tokens is not None:
+            return self.tokens
+        prefix = []
+        if self.prefix_id is not None and self.prefix_length:
+            prefix_rng = random.Random(self.prefix_id)
+            prefix = [prefix_rng.randrange(1, n_vocab) for _ in range(min(self.prefix_length, self.prompt_length))]
+        return prefix + [rng.randrange(1, n_vocab) for _ in range(self.prompt_length - len(prefix))]
+
+
+def read_trace(path: str) -> Iterator[WorkloadRequest]:
+    """
+    Stream requests from a JSONL trace, one request per line, without loading the file.
+
+    Lines hold prompt_length (or input_tokens, or explicit prompt_tokens) and
+    new_tokens (or output_tokens), optionally prefix_id and prefix_length.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            tokens = entry.get('prompt_tokens')
+            yield WorkloadRequest(
+                prompt_length=len(tokens) if tokens is not None else int(entry.get('prompt_length', entry.get('input_tokens'))),
+                new_tokens=int(entry.get('new_tokens', entry.get('output_tokens'))),
+                prefix_id=entry.get('prefix_id'),
+                prefix_length=int(entry.get('prefix_length', 0)),
+                tokens=tokens,
+            )
+
+
+def lognormal_workload(**kwargs) -> Iterator[WorkloadRequest]:
+    """Heavy-tailed prompt/output lengths, a share of the requests reusing one of a few prefixes."""
+    params = {**LOGNORMAL_DEFAULTS, **kwargs}
+    rng = random.Random(params['seed'])
+    for _ in range(int(params['n'])):
+        prompt_length = int(min(params['max_prompt'], max(1, rng.lognormvariate(math.log(params['prompt']), params['prompt_sigma']))))
+        new_tokens = int(min(params['max_output'], max(1, rng.lognormvariate(math.log(params['output']), params['output_sigma']))))
+        prefix_id = None
+        if rng.random() < params['prefix_ratio']:
+            prefix_id = rng.randrange(int(params['prefixes']))
+        yield WorkloadRequest(prompt_length=prompt_length,
+                              new_tokens=new_tokens,
+                              prefix_id=prefix_id,
+                              prefix_length=int(params['prefix']) if prefix_id is not None else 0)
+
+
+def parse_workload(spec: str) -> Iterator[WorkloadRequest]:
+    """
+    Build a lazy request stream from a command line spec.
+
+    - `path/to/trace.jsonl`: replay a trace.
+    - `lognormal:n=1000,prompt=256,prompt_sigma=0.8,output=128,prefix_ratio=0.5`: parametric
+      workload, missing keys take the values of LOGNORMAL_DEFAULTS.
+    """
+    if spec.startswith('lognormal'):
+        _, _, options = spec.partition(':')
+        kwargs = {}
+        for option in filter(None, options.split(',')):
+            key, value = option.split('=')
+            if key not in LOGNORMAL_DEFAULTS:
+                raise ValueError(f"Unknown workload option {key}, expected one of {list(LOGNORMAL_DEFAULTS)}.")
+            kwargs[key] = float(value)
+        return lognormal_workload(**kwargs)
+    return read_trace(spec)
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def request_metrics(start_ns: int, token_ns: List[int]) -> Dict[str, float]:
+    """TTFT, mean TPOT and end-to-end latency of one streamed request."""
+    return {
+        "New Tokens": len(token_ns),
+        "TTFT (s)": (token_ns[0] - start_ns) / 1e9,
+        "TPOT (ms)": (token_ns[-1] - token_ns[0]) / 1e6 / (len(token_ns) - 1) if len(token_ns) > 1 else float('nan'),
+        "Latency (s)": (token_ns[-1] - start_ns) / 1e9,
+    }
+
+
+@dataclass
+class ReplayStats:
+    """Running aggregates of a replay, per-request rows are flushed to the store separately."""
+    ttft: List[float] = field(default_factory=list)
+    tpot_ms: List[float] = field(default_factory=list)
+    latency: List[float] = field(default_factory=list)
+    prompt_tokens: int = 0
+    new_tokens: int = 0
+    reused_tokens: int = 0
+    skipped: int = 0
+
+    def add(self, request: Dict[str, float]):
+        self.ttft.append(request["TTFT (s)"])
+        self.tpot_ms.append(request["TPOT (ms)"])
+        self.latency.append(request["Latency (s)"])
+        self.prompt_tokens += request["Prompt Length"]
+        self.new_tokens += request["New Tokens"]
+        self.reused_tokens += request.get("Reused Prefix", 0)
+
+    def summary(self, wall_s: float) -> Dict[str, float]:
+        tpot = np.asarray(self.tpot_ms, dtype=np.float64)
+        stats = {
+            "Replayed Requests": len(self.ttft),
+            "Skipped Requests": self.skipped,
+            "Prompt Length": self.prompt_tokens / max(1, len(self.ttft)),
+            "New Tokens": self.new_tokens / max(1, len(self.ttft)),
+            "Prefix Reuse (%)": 100 * self.reused_tokens / max(1, self.prompt_tokens),
+            "Throughput (req/s)": len(self.ttft) / wall_s,
+            "Throughput (tk/s)": self.new_tokens / wall_s,
+            "Latency (s)": float(np.mean(self.latency)) if self.latency else float('nan'),
+            "Replay Time (s)": wall_s,
+        }
+        for key, value in tpot_percentiles(np.asarray(self.ttft) * 1000, prefix='TTFT').items():
+            stats[key.replace('(ms)', '(s)')] = value / 1000
+        stats.update(tpot_percentiles(tpot[~np.isnan(tpot)]))
+        return stats
+
+
+def replay(requests: Iterable[WorkloadRequest],
+           serve: Callable[[WorkloadRequest], Dict[str, Any] | None],
+           flush: Callable[[List[Dict[str, Any]]], None] | None = None) -> Dict[str, float]:
+    """
+    Serve the requests one after the other and aggregate their metrics.
+
+    Parameters:
+    - requests (iterable): Lazy request stream, e.g. from parse_workload.
+    - serve (callable): Runs one request and returns its row, None when it cannot be served.
+    - flush (callable): Receives the per-request rows every FLUSH_EVERY requests.
+
+    Returns:
+    - dict: Aggregate metrics of the replay.
+    """
+    stats = ReplayStats()
+    rows = []
+    flush_s = 0.0
+    start = time.perf_counter()
+    for i, request in enumerate(requests):
+        row = serve(request)
+        if row is None:
+            stats.skipped += 1
+            continue
+        row["Request"] = i
+        stats.add(row)
+        rows.append(row)
+        if flush is not None and len(rows) >= FLUSH_EVERY:
+            flush_start = time.perf_counter()
+            flush(rows)
+            flush_s += time.perf_counter() - flush_start
+            rows = []
+    wall_s = time.perf_counter() - start - flush_s
+    if flush is not None and rows:
+        flush(rows)
+    return stats.summary(wall_s)
@@ -0,0 +1,165 @@
+import math
+import struct
+
+import pytest
+
+from gguf_reader import GGML_TYPES, read_gguf, tensor_nbytes
+from offload_planner import GB, plan_offload, predict, predictions
+from tuner import successive_halving
+
+F16, Q4_K = 1, 12
+UNKNOWN_TYPE = max(GGML_TYPES) + 100
+
+N_EMBD = 256
+N_FF = 512
+N_VOCAB = 1000
+
+
+def gguf_string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack('<Q', len(data)) + data
+
+
+def write_gguf(path, metadata, tensors, alignment=32):
+    """A GGUF v3 header with uint32 and string metadata, the tensor data is left zeroed."""
+    header = b'GGUF' + struct.pack('<IQQ', 3, len(tensors), len(metadata))
+    for key, value in metadata.items():
+        header += gguf_string(key)
+        if isinstance(value, str):
+            header += struct.pack('<I', 8) + gguf_string(value)
+        else:
+            header += struct.pack('<II', 4, value)
+    offset = 0
+    for name, shape, ggml_type in tensors:
+        header += gguf_string(name) + struct.pack('<I', len(shape))
+        header += b''.join(struct.pack('<Q', dim) for dim in shape)
+        header += struct.pack('<IQ', ggml_type, offset)
+        n_bytes = tensor_nbytes(ggml_type, math.prod(shape)) or 0
+        offset += n_bytes + (alignment - n_bytes % alignment) % alignment
+    header += b'\0' * ((alignment - len(header) % alignment) % alignment)
+    path.write_bytes(header + b'\0' * offset)
+    return str(path)
+
+
+def llama_metadata(block_count=4):
+    metadata = {
+        'general.architecture': 'llama',
+        'llama.embedding_length': N_EMBD,
+        'llama.feed_forward_length': N_FF,
+        'llama.attention.head_count': 8,
+        'llama.vocab_size': N_VOCAB,
+    }
+    if block_count is not None:
+        metadata['llama.block_count'] = block_count
+    return metadata
+
+
+def llama_tensors(n_blocks=4, block_type=Q4_K):
+    tensors = [('token_embd.weight', (N_EMBD, N_VOCAB), F16)]
+    for i in range(n_blocks):
+        tensors += [(f'blk.{i}.attn_q.weight', (N_EMBD, N_EMBD), block_type),
+                    (f'blk.{i}.ffn_up.weight', (N_EMBD, N_FF), block_type)]
+    return tensors + [('output.weight', (N_EMBD, N_VOCAB), F16)]
+
+
+BLOCK_BYTES = tensor_nbytes(Q4_K, N_EMBD * N_EMBD) + tensor_nbytes(Q4_K, N_EMBD * N_FF)
+
+
+def test_reader_round_trip(tmp_path):
+    gguf = read_gguf(write_gguf(tmp_path / 'model.gguf', llama_metadata(), llama_tensors()))
+
+    assert gguf.version == 3
+    assert gguf.architecture == 'llama'
+    assert gguf.block_count == 4
+    assert gguf.n_vocab == N_VOCAB
+    assert [t.name for t in gguf.tensors][:3] == ['token_embd.weight', 'blk.0.attn_q.weight', 'blk.0.ffn_up.weight']
+    assert gguf.tensor('blk.0.attn_q.weight').type_name == 'Q4_K'
+    assert gguf.data_offset % 32 == 0
+    assert gguf.sizes_known
+    assert gguf.layer_bytes() == [BLOCK_BYTES] * 4
+    assert gguf.n_bytes == 4 * BLOCK_BYTES + 2 * tensor_nbytes(F16, N_EMBD * N_VOCAB)
+
+
+def test_unknown_ggml_type(tmp_path):
+    tensors = llama_tensors()
+    tensors[1] = ('blk.0.attn_q.weight', (N_EMBD, N_EMBD), UNKNOWN_TYPE)
+    gguf = read_gguf(write_gguf(tmp_path / 'model.gguf', llama_metadata(), tensors))
+
+    assert tensor_nbytes(UNKNOWN_TYPE, 256) is None
+    assert gguf.tensor('blk.0.attn_q.weight').type_name == f'unknown ({UNKNOWN_TYPE})'
+    assert not gguf.sizes_known
+    assert gguf.n_bytes is None
+    assert gguf.bits_per_weight is None
+    assert gguf.layer_bytes() is None
+    assert predict(gguf, 1, 512, 512) is None
+    assert predictions(gguf, 512, 512) == []
+    assert plan_offload(gguf, 512, 512, vram_free_gb=8, ram_free_gb=8) is None
+
+
+def test_layer_bytes_skips_blocks_past_block_count(tmp_path):
+    # an MTP/NextN layer stored as blk.4 of a 4 block model
+    gguf = read_gguf(write_gguf(tmp_path / 'model.gguf', llama_metadata(), llama_tensors(n_blocks=5)))
+
+    assert gguf.layer_bytes() == [BLOCK_BYTES] * 4
+    assert gguf.n_bytes == 5 * BLOCK_BYTES + 2 * tensor_nbytes(F16, N_EMBD * N_VOCAB)
+
+
+def test_block_count_from_tensors(tmp_path):
+    gguf = read_gguf(write_gguf(tmp_path / 'model.gguf', llama_metadata(block_count=None), llama_tensors()))
+
+    assert gguf.block_count == 4
+    assert gguf.layer_bytes() == [BLOCK_BYTES] * 4
+
+
+@pytest.fixture
+def model(tmp_path):
+    return read_gguf(write_gguf(tmp_path / 'model.gguf', llama_metadata(), llama_tensors()))
+
+
+def test_plan_offload_leave_vram_above_free_vram(model):
+    plan = plan_offload(model, 512, 512, vram_free_gb=0.5, ram_free_gb=8, leave_vram_gb=1)
+
+    assert plan is not None
+    assert plan.n_gpu_layers == 0
+    assert plan.vram_bytes == 0
+
+
+def test_plan_offload_fully_offloads_with_enough_vram(model):
+    plan = plan_offload(model, 512, 512, vram_free_gb=8, ram_free_gb=8)
+
+    assert plan.n_gpu_layers == model.block_count + 1
+    assert plan.vram_bytes > 0
+
+
+def test_plan_offload_without_ram(model):
+    cpu_only = predict(model, 0, 512, 512)
+
+    assert plan_offload(model, 512, 512, vram_free_gb=0, ram_free_gb=cpu_only.ram_bytes / GB / 2) is None
+
+
+def test_successive_halving_without_candidates():
+    best, trials = successive_halving([], lambda config, rung, budget: 1.0)
+
+    assert best is None
+    assert trials == []
+
+
+def test_successive_halving_ranks_failed_trials_last():
+    candidates = [{"threads": n} for n in (1, 2, 4, 8)]
+
+    def evaluate(config, rung, budget):
+        # the fastest configuration fails, e.g. it runs out of memory
+        return math.nan if config["threads"] == 8 else float(config["threads"])
+
+    best, trials = successive_halving(candidates, evaluate)
+
+    assert best == {"threads": 4}
+    assert len(trials) == 4 + 2 + 1
+    assert all(t.config["threads"] != 8 for t in trials if t.rung > 0)
+
+
+def test_successive_halving_every_trial_failing():
+    best, trials = successive_halving([{"threads": 1}, {"threads": 2}], lambda config, rung, budget: math.nan)
+
+    assert all(math.isnan(t.score) for t in trials)
+    assert best in ({"threads": 1}, {"threads": 2})